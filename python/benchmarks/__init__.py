@@ -0,0 +1,23 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Benchmarks of Cockpit Client against an in-process fake cockpit-ws. Run them
+with "python -m benchmarks.run"; see benchmarks.run for options.
+'''
@@ -0,0 +1,100 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Compares two benchmark result files written by benchmarks.run or
+benchmarks.memory:
+
+    python -m benchmarks.compare BASELINE.json CURRENT.json
+
+Prints median durations (or bytes per object) and their change per
+benchmark. Exits with 1, if a benchmark got slower (or bigger) by more than
+--threshold percent.
+'''
+
+import argparse
+import json
+import sys
+from collections import OrderedDict
+
+
+def get_value(result):
+    '''
+    Returns a compared value of a benchmark result and its format.
+    '''
+    if 'bytes_per_object' in result:
+        return result['bytes_per_object'], '%11.0fB'
+    return result['median'], '%11.6fs'
+
+
+def compare(baseline, current):
+    '''
+    Returns a list of (name, baseline value, current value, change in
+    percent, value format) of benchmarks present in both results. The change
+    is None for a zero baseline.
+    '''
+    rows = []
+    for name, result in current['benchmarks'].iteritems():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            continue
+        value, fmt = get_value(result)
+        base_value = get_value(base)[0]
+        change = None
+        if base_value:
+            change = (value - base_value) / base_value * 100.0
+        rows.append((name, base_value, value, change, fmt))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Compare two benchmark result files')
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument(
+        '--threshold', type=float, default=10.0,
+        help='slowdown in percent reported as a regression')
+    options = parser.parse_args(sys.argv[1:] if argv is None else argv)
+
+    with open(options.baseline) as fp:
+        baseline = json.load(fp, object_pairs_hook=OrderedDict)
+    with open(options.current) as fp:
+        current = json.load(fp, object_pairs_hook=OrderedDict)
+
+    regressed = False
+    print '%-16s %12s %12s %8s' % (
+        'benchmark', 'baseline', 'current', 'change')
+    for name, base, value, change, fmt in compare(baseline, current):
+        mark = ''
+        if change is None:
+            change = '%8s' % 'n/a'
+        else:
+            if change > options.threshold:
+                mark = ' !'
+                regressed = True
+            change = '%+7.1f%%' % change
+        print ('%%-16s %s %s %%s%%s' % (fmt, fmt)) % (
+            name, base, value, change, mark)
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,552 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+In-process fake cockpit-ws. It implements /login with Basic authentication,
+the WebSocket upgrade on the same keep-alive connection, the init exchange,
+channel open/close, ping and dbus-json3 call/reply, which is enough to drive
+CockpitClient and RemoteDBus without a real host. Properties of objects are
+kept in FakeCockpitWS.properties; set_property(), add_object(),
+remove_object() and emit_signal() notify watches and deliver signals to
+add-match subscribers.
+
+Methods of the fake D-Bus service:
+
+    Echo(args...)   replies with the call arguments
+    Payload(size)   replies with a string of size bytes
+    Fail()          replies with an org.fake.Error error
+    Hang()          never replies
+    Introspect()    replies with INTROSPECTION_XML
+    Quit(args...)   replies like Echo and closes the connection
+    Truncate(size)  starts a reply frame of size bytes and drops the
+                    connection halfway through it
+
+Any other method replies with a string of reply_size bytes. Get and GetAll
+of org.freedesktop.DBus.Properties and GetManagedObjects of
+org.freedesktop.DBus.ObjectManager read FakeCockpitWS.properties.
+FakeCockpitWS.call_hooks maps method names to functions called before a
+call of the method is answered.
+'''
+
+import Queue
+import base64
+import hashlib
+import json
+import socket
+import struct
+import threading
+import time
+
+
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+COOKIE = 'fake-session'
+
+PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+UNKNOWN_PROPERTY = 'org.freedesktop.DBus.Error.UnknownProperty'
+OBJECT_MANAGER_INTERFACE = 'org.freedesktop.DBus.ObjectManager'
+
+# Introspection data of every object. Echo replies with its arguments, so
+# any signature can be declared for it.
+INTROSPECTION_XML = '''<node>
+  <interface name="org.fake.Service">
+    <method name="Echo">
+      <arg type="s" direction="in"/>
+      <arg type="a{sv}" direction="in"/>
+      <arg type="s" direction="out"/>
+      <arg type="a{sv}" direction="out"/>
+    </method>
+    <method name="Broken">
+      <arg type="z" direction="in"/>
+    </method>
+  </interface>
+  <interface name="org.fake.Files">
+    <method name="Echo">
+      <arg type="h" direction="in"/>
+      <arg type="h" direction="out"/>
+    </method>
+  </interface>
+</node>'''
+
+
+def make_ws_frame(data, opcode=1):
+    '''
+    Returns an unmasked WebSocket frame (as sent by a server).
+    '''
+    size = len(data)
+    if size < 126:
+        header = struct.pack('!BB', 0x80 | opcode, size)
+    elif size < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, size)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, size)
+    return header + data
+
+
+def read_exactly(rfile, size):
+    data = rfile.read(size)
+    if len(data) < size:
+        raise EOFError
+    return data
+
+
+def read_ws_frame(rfile):
+    '''
+    Reads a (masked) client WebSocket frame. Returns an opcode and payload.
+    '''
+    first, second = struct.unpack('!BB', read_exactly(rfile, 2))
+    size = second & 0x7f
+    if size == 126:
+        size = struct.unpack('!H', read_exactly(rfile, 2))[0]
+    elif size == 127:
+        size = struct.unpack('!Q', read_exactly(rfile, 8))[0]
+    mask = read_exactly(rfile, 4) if second & 0x80 else None
+    data = read_exactly(rfile, size)
+    if mask is not None:
+        data = bytearray(data)
+        mask = bytearray(mask)
+        for i in xrange(size):
+            data[i] ^= mask[i & 3]
+        data = str(data)
+    return first & 0x0f, data
+
+
+def make_variant(value):
+    '''
+    Returns a dbus-json3 variant of a value.
+    '''
+    if isinstance(value, bool):
+        signature = 'b'
+    elif isinstance(value, (int, long)):
+        signature = 'i'
+    elif isinstance(value, float):
+        signature = 'd'
+    elif isinstance(value, list):
+        signature = 'as'
+    else:
+        signature = 's'
+    return {'t': signature, 'v': value}
+
+
+def make_variants(values):
+    '''
+    Returns a dbus-json3 a{sv} of a dict of property values.
+    '''
+    return dict((name, make_variant(value))
+                for name, value in values.iteritems())
+
+
+def match_signal(match, path, interface, member, args):
+    '''
+    Returns whether a signal matches an add_match dict.
+    '''
+    if 'path' in match and match['path'] != path:
+        return False
+    namespace = match.get('path_namespace')
+    if namespace is not None and namespace != '/' and path != namespace and \
+            not path.startswith(namespace + '/'):
+        return False
+    if 'interface' in match and match['interface'] != interface:
+        return False
+    if 'member' in match and match['member'] != member:
+        return False
+    if 'arg0' in match and (not args or match['arg0'] != args[0]):
+        return False
+    return True
+
+
+class FakeConnection(object):
+    '''
+    One client connection. Replies are written by a separate thread after
+    the configured latency, so pipelined calls overlap like with a real host.
+    '''
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+        self.replies = Queue.Queue()
+        # Signals and notifications are sent from other threads too.
+        self.send_lock = threading.Lock()
+        # (channel id, watch dict) and (channel id, match dict) tuples.
+        self.watches = []
+        self.matches = []
+        self.writer = threading.Thread(target=self.write_loop)
+        self.writer.daemon = True
+
+    def send(self, data):
+        if self.server.latency:
+            self.replies.put((time.time() + self.server.latency, data))
+        else:
+            with self.send_lock:
+                self.sock.sendall(data)
+
+    def send_message(self, channel_id, message):
+        self.send(make_ws_frame('%s\n%s' % (channel_id, json.dumps(message))))
+
+    def write_loop(self):
+        while True:
+            due, data = self.replies.get()
+            if data is None:
+                return
+            delay = due - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                self.sock.sendall(data)
+            except socket.error:
+                return
+
+    def read_request(self):
+        '''
+        Reads an HTTP request head. Returns a request line and a dict of
+        lower-cased headers.
+        '''
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                raise EOFError
+            if line == '\r\n':
+                break
+            lines.append(line.rstrip('\r\n'))
+        headers = {}
+        for line in lines[1:]:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        return lines[0], headers
+
+    def run(self):
+        if self.server.latency:
+            self.writer.start()
+        try:
+            if self.serve_http():
+                self.serve_websocket()
+        except (EOFError, socket.error):
+            pass
+        finally:
+            self.replies.put((0, None))
+            if self.writer.is_alive():
+                self.writer.join()
+            # The file object keeps the socket open; shut it down, so the
+            # client sees the end of the connection.
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self.sock.close()
+            self.server.connections.discard(self)
+
+    def serve_http(self):
+        '''
+        Serves HTTP requests until the WebSocket upgrade. Returns False, if
+        the connection should be closed instead.
+        '''
+        while True:
+            request_line, headers = self.read_request()
+            method, uri, _ = request_line.split(' ', 2)
+            if uri.startswith('/login'):
+                self.server.logins += 1
+                if headers.get('authorization') != self.server.authorization:
+                    self.send(
+                        'HTTP/1.1 401 Authentication failed\r\n'
+                        'Content-Length: 0\r\n\r\n')
+                    continue
+                body = json.dumps({'user': self.server.username})
+                self.send(
+                    'HTTP/1.1 200 OK\r\n'
+                    'Set-Cookie: cockpit=%s; Path=/; HttpOnly\r\n'
+                    'Content-Type: application/json\r\n'
+                    'Content-Length: %d\r\n\r\n%s' % (COOKIE, len(body), body))
+            elif uri == self.server.resource:
+                if headers.get('cookie') != 'cockpit=%s' % COOKIE:
+                    self.send(
+                        'HTTP/1.1 401 Authentication failed\r\n'
+                        'Content-Length: 0\r\n\r\n')
+                    return False
+                accept = base64.b64encode(hashlib.sha1(
+                    headers['sec-websocket-key'] + WEBSOCKET_GUID).digest())
+                self.send(
+                    'HTTP/1.1 101 Switching Protocols\r\n'
+                    'Upgrade: websocket\r\n'
+                    'Connection: Upgrade\r\n'
+                    'Sec-WebSocket-Accept: %s\r\n\r\n' % accept)
+                init = {
+                    'command': 'init',
+                    'version': 0,
+                    'channel-seed': '1000',
+                    'user': {'name': self.server.username},
+                }
+                if self.server.init_problem is not None:
+                    init['problem'] = self.server.init_problem
+                self.send_message('', init)
+                return True
+            else:
+                self.send('HTTP/1.1 404 Not Found\r\n'
+                          'Content-Length: 0\r\n\r\n')
+
+    def serve_websocket(self):
+        while True:
+            opcode, data = read_ws_frame(self.rfile)
+            if opcode == 0x8:
+                self.send(make_ws_frame(data, 0x8))
+                return
+            if opcode == 0x9:
+                self.send(make_ws_frame(data, 0xa))
+                continue
+            channel_id, payload = data.split('\n', 1)
+            message = json.loads(payload)
+            if channel_id:
+                self.handle_channel_message(channel_id, message)
+            else:
+                self.handle_control_message(message)
+
+    def handle_control_message(self, message):
+        command = message.get('command')
+        if command == 'open':
+            self.send_message(
+                '', {'command': 'ready', 'channel': message['channel']})
+        elif command == 'close':
+            self.watches = [
+                watch for watch in self.watches
+                if watch[0] != message['channel']]
+            self.matches = [
+                match for match in self.matches
+                if match[0] != message['channel']]
+            self.send_message(
+                '', {'command': 'close', 'channel': message['channel']})
+        elif command == 'logout':
+            raise EOFError
+
+    def handle_channel_message(self, channel_id, message):
+        call_id = message.get('id')
+        if 'watch' in message:
+            watch = message['watch']
+            self.watches.append((channel_id, watch))
+            # Like cockpit-ws, report the current values first.
+            notify = self.server.get_notify(
+                watch['path'], watch.get('interface'))
+            if notify:
+                self.send_message(channel_id, {'notify': notify})
+        elif 'unwatch' in message:
+            if (channel_id, message['unwatch']) in self.watches:
+                self.watches.remove((channel_id, message['unwatch']))
+        elif 'add-match' in message:
+            self.matches.append((channel_id, message['add-match']))
+        elif 'remove-match' in message:
+            if (channel_id, message['remove-match']) in self.matches:
+                self.matches.remove((channel_id, message['remove-match']))
+        if 'call' not in message:
+            # watch, add-match, ... just get an empty reply.
+            if call_id is not None:
+                self.send_message(channel_id, {'reply': [], 'id': call_id})
+            return
+
+        path, interface, method, args = message['call']
+        hook = self.server.call_hooks.get(method)
+        if hook is not None:
+            hook()
+        if method == 'Hang':
+            return
+        if method == 'Truncate':
+            frame = make_ws_frame('%s\n%s' % (channel_id, 'x' * args[0]))
+            self.send(frame[:len(frame) // 2])
+            raise EOFError
+        if method == 'Quit':
+            self.send_message(channel_id, {'reply': [args], 'id': call_id})
+            raise EOFError
+        if method == 'Fail':
+            reply = {'error': ['org.fake.Error', ['Failed']], 'id': call_id}
+        elif method == 'Introspect':
+            reply = {'reply': [[INTROSPECTION_XML]], 'id': call_id}
+        elif method == 'Echo':
+            reply = {'reply': [args], 'id': call_id}
+        elif method == 'Payload':
+            reply = {'reply': [['x' * args[0]]], 'id': call_id}
+        elif interface == OBJECT_MANAGER_INTERFACE and \
+                method == 'GetManagedObjects':
+            reply = {'reply': [[self.server.get_managed_objects(path)]],
+                     'id': call_id}
+        elif interface == PROPERTIES_INTERFACE and method in ('Get', 'GetAll'):
+            values = self.server.properties.get(path, {}).get(args[0], {})
+            if method == 'GetAll':
+                reply = {'reply': [[make_variants(values)]], 'id': call_id}
+            elif args[1] in values:
+                reply = {'reply': [[make_variant(values[args[1]])]],
+                         'id': call_id}
+            else:
+                reply = {'error': [UNKNOWN_PROPERTY, [args[1]]],
+                         'id': call_id}
+        else:
+            reply = {'reply': [[self.server.reply_payload]], 'id': call_id}
+        if call_id is not None:
+            self.send_message(channel_id, reply)
+
+
+class FakeCockpitWS(object):
+    '''
+    Fake cockpit-ws listening on a local port. Every reply is delayed by
+    latency seconds; calls of unknown methods reply with reply_size bytes.
+    If init_problem is set, the init message carries it as a problem.
+    properties maps paths to interfaces to dicts of property values.
+    Use it as a context manager, or call start() and stop().
+    '''
+
+    def __init__(self, latency=0.0, reply_size=16, username='user',
+                 password='pass', resource='/cockpit/socket',
+                 init_problem=None):
+        self.authorization = 'Basic ' + base64.b64encode(
+            '%s:%s' % (username, password))
+        self.call_hooks = {}
+        self.connections = set()
+        self.init_problem = init_problem
+        self.latency = latency
+        self.logins = 0
+        self.properties = {}
+        self.reply_payload = 'x' * reply_size
+        self.resource = resource
+        self.sock = None
+        self.thread = None
+        self.username = username
+
+    @property
+    def url(self):
+        '''
+        Property returning a WebSocket URL of the server.
+        '''
+        return 'ws://127.0.0.1:%d%s' % (self.sock.getsockname()[1],
+                                        self.resource)
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(128)
+        self.thread = threading.Thread(target=self.accept_loop)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        sock, self.sock = self.sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            sock.close()
+            self.thread.join()
+        for connection in list(self.connections):
+            try:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def get_notify(self, path, interface=None):
+        '''
+        Returns a notify dict of the current property values of path (and
+        interface).
+        '''
+        interfaces = dict(
+            (name, dict(values))
+            for name, values in self.properties.get(path, {}).iteritems()
+            if interface is None or name == interface)
+        return {path: interfaces} if interfaces else {}
+
+    def set_property(self, path, interface, name, value):
+        '''
+        Changes a property value. Watches of it get a notify message and
+        PropertiesChanged is emitted.
+        '''
+        self.properties.setdefault(path, {}).setdefault(
+            interface, {})[name] = value
+        notify = {'notify': {path: {interface: {name: value}}}}
+        for connection in list(self.connections):
+            for channel_id, watch in list(connection.watches):
+                if watch['path'] == path and \
+                        watch.get('interface', interface) == interface:
+                    connection.send_message(channel_id, notify)
+        self.emit_signal(path, PROPERTIES_INTERFACE, 'PropertiesChanged',
+                         [interface, {name: make_variant(value)}, []])
+
+    def get_managed_objects(self, manager_path):
+        '''
+        Returns a GetManagedObjects reply of objects below manager_path.
+        '''
+        prefix = manager_path.rstrip('/') + '/'
+        return dict(
+            (path, dict(
+                (interface, make_variants(values))
+                for interface, values in interfaces.iteritems()))
+            for path, interfaces in self.properties.iteritems()
+            if path.startswith(prefix))
+
+    def add_object(self, path, interfaces, manager_path='/'):
+        '''
+        Adds interfaces (a dict of dicts of property values) to an object and
+        emits InterfacesAdded of the object manager at manager_path.
+        '''
+        self.properties.setdefault(path, {}).update(
+            (interface, dict(values))
+            for interface, values in interfaces.iteritems())
+        self.emit_signal(
+            manager_path, OBJECT_MANAGER_INTERFACE, 'InterfacesAdded',
+            [path, dict(
+                (interface, make_variants(values))
+                for interface, values in interfaces.iteritems())])
+
+    def remove_object(self, path, manager_path='/'):
+        '''
+        Removes an object and emits InterfacesRemoved of the object manager
+        at manager_path.
+        '''
+        interfaces = self.properties.pop(path, {})
+        self.emit_signal(
+            manager_path, OBJECT_MANAGER_INTERFACE, 'InterfacesRemoved',
+            [path, sorted(interfaces)])
+
+    def emit_signal(self, path, interface, member, args):
+        '''
+        Sends a signal to every channel with a matching add_match.
+        '''
+        signal = {'signal': [path, interface, member, args]}
+        for connection in list(self.connections):
+            for channel_id, match in list(connection.matches):
+                if match_signal(match, path, interface, member, args):
+                    connection.send_message(channel_id, signal)
+
+    def accept_loop(self):
+        sock = self.sock
+        while True:
+            try:
+                client, _ = sock.accept()
+            except socket.error:
+                return
+            client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connection = FakeConnection(self, client)
+            self.connections.add(connection)
+            thread = threading.Thread(target=connection.run)
+            thread.daemon = True
+            thread.start()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
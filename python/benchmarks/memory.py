@@ -0,0 +1,220 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Measures memory held by records, which are created per request, call,
+signal or channel, and writes the results as JSON:
+
+    python -m benchmarks.memory [--count N] [--output FILE] [NAME...]
+
+Every benchmark creates count objects and reports bytes per object: the
+objects themselves and everything they own (their __dict__, slots and
+containers), but not the client and channel they refer to. Results of two
+runs can be compared by benchmarks.compare.
+'''
+
+import argparse
+import json
+import sys
+from collections import OrderedDict
+
+from benchmarks.run import get_environment
+from cockpit.client import CockpitClient
+from cockpit.client import http
+from cockpit.client.channel import DBusChannel
+from cockpit.client.channel import QueueChannel
+from cockpit.remote.signals import SignalEvent
+
+
+# Version of the results format.
+RESULTS_FORMAT = 1
+
+URL = 'ws://127.0.0.1:9/cockpit/socket'
+
+
+def get_slots(cls):
+    '''
+    Returns names of slots of cls and its bases.
+    '''
+    names = []
+    for klass in cls.__mro__:
+        slots = klass.__dict__.get('__slots__', ())
+        if isinstance(slots, basestring):
+            slots = (slots,)
+        names.extend(name for name in slots if name != '__dict__')
+    return names
+
+
+def get_size(obj, seen):
+    '''
+    Returns a size of obj and of objects it owns in bytes. Objects in seen
+    are not counted (again).
+    '''
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (basestring, int, long, float, bool, type(None))):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(get_size(key, seen) + get_size(value, seen)
+                          for key, value in obj.iteritems())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return size + sum(get_size(item, seen) for item in obj)
+
+    if hasattr(obj, '__dict__'):
+        size += get_size(obj.__dict__, seen)
+    for name in get_slots(type(obj)):
+        if hasattr(obj, name):
+            size += get_size(getattr(obj, name), seen)
+    return size
+
+
+def measure(create, count, shared=()):
+    '''
+    Creates count objects by create(i). Returns a size of one of them in
+    bytes; objects in shared are not counted.
+    '''
+    objects = [create(i) for i in xrange(count)]
+    seen = set(id(obj) for obj in shared)
+    total = sum(get_size(obj, seen) for obj in objects)
+    return OrderedDict([
+        ('objects', count),
+        ('bytes_per_object', total / float(count)),
+        ('total_bytes', total),
+    ])
+
+
+def bench_http_message(options):
+    '''
+    HTTPMessage of a request with a few headers.
+    '''
+    def create(i):
+        return http.HTTPMessage(
+            http.HTTPRequestLine('GET', '/login', http.HTTP_1_1),
+            OrderedDict([
+                ('Host', 'localhost:9090'),
+                ('Authorization', 'Basic dXNlcjpwYXNz'),
+                ('Content-Length', '0'),
+            ]))
+    return measure(create, options.count)
+
+
+def bench_pending_call(options):
+    '''
+    PendingCall of a sent call, which is waiting for its reply.
+    '''
+    client = CockpitClient(URL)
+    channel = DBusChannel(client, '1')
+
+    def create(i):
+        call_id = channel.get_next_call_id()
+        pending = channel.create_pending_call(call_id)
+        pending.request = {'call': ['/', 'org.Foo', 'Bar', [i]]}
+        return pending
+    return measure(create, options.count, (client, channel))
+
+
+def bench_dbus_channel(options):
+    '''
+    Registered DBusChannel without any calls.
+    '''
+    client = CockpitClient(URL)
+
+    def create(i):
+        channel = DBusChannel(client, str(i))
+        channel.open_options = {'bus': 'session', 'service': 'org.Foo'}
+        return channel
+    return measure(create, options.count, (client,))
+
+
+def bench_queue_channel(options):
+    '''
+    QueueChannel of a channel without a protocol object.
+    '''
+    client = CockpitClient(URL)
+    return measure(lambda i: QueueChannel(client, str(i)), options.count,
+                   (client,))
+
+
+def bench_signal_event(options):
+    '''
+    Received D-Bus signal buffered by a Subscription.
+    '''
+    return measure(
+        lambda i: SignalEvent('/obj/%d' % i, 'org.Foo', 'Changed', [i]),
+        options.count)
+
+
+BENCHMARKS = OrderedDict([
+    ('http_message', bench_http_message),
+    ('pending_call', bench_pending_call),
+    ('dbus_channel', bench_dbus_channel),
+    ('queue_channel', bench_queue_channel),
+    ('signal_event', bench_signal_event),
+])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Memory benchmarks of Cockpit Client records')
+    parser.add_argument(
+        'names', nargs='*', metavar='NAME',
+        help='benchmarks to run (%s); all by default' % ', '.join(BENCHMARKS))
+    parser.add_argument(
+        '--count', type=int, default=10000,
+        help='objects created by every benchmark')
+    parser.add_argument(
+        '--output', '-o',
+        help='file to write JSON results to (default: stdout)')
+    options = parser.parse_args(argv)
+    for name in options.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    return options
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+
+    results = OrderedDict([
+        ('format', RESULTS_FORMAT),
+        ('environment', get_environment()),
+        ('parameters', OrderedDict([
+            ('count', options.count),
+        ])),
+        ('benchmarks', OrderedDict()),
+    ])
+
+    for name in options.names or BENCHMARKS:
+        sys.stderr.write('%s...\n' % name)
+        results['benchmarks'][name] = BENCHMARKS[name](options)
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+            fp.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Runs the benchmarks and writes their results as JSON:
+
+    python -m benchmarks.run [--latency SECONDS] [--output FILE] [NAME...]
+
+Every benchmark reports timing statistics of its samples in seconds and a
+rate of operations per second. Results of two runs can be compared by
+benchmarks.compare.
+'''
+
+import argparse
+import json
+import math
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client import CockpitClient
+from cockpit.client import util
+from cockpit.client.channel import wait_all
+from cockpit.remote import RemoteDBus
+
+
+# Version of the results format.
+RESULTS_FORMAT = 1
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+def summarize(samples, operations=1):
+    '''
+    Returns statistics of a list of durations; each sample covered
+    operations operations.
+    '''
+    samples = sorted(samples)
+    count = len(samples)
+    total = sum(samples)
+    mean = total / count
+    stddev = math.sqrt(sum((x - mean) ** 2 for x in samples) / count)
+    return OrderedDict([
+        ('samples', count),
+        ('operations', operations),
+        ('min', samples[0]),
+        ('median', samples[count // 2]),
+        ('p95', samples[min(count - 1, int(count * 0.95))]),
+        ('max', samples[-1]),
+        ('mean', mean),
+        ('stddev', stddev),
+        ('ops_per_sec', count * operations / total if total else None),
+    ])
+
+
+def measure(func, iterations, warmup=1):
+    '''
+    Calls func warmup times and then iterations times. Returns a list of
+    durations of the measured calls.
+    '''
+    for _ in xrange(warmup):
+        func()
+    samples = []
+    for _ in xrange(iterations):
+        started = time.time()
+        func()
+        samples.append(time.time() - started)
+    return samples
+
+
+def connect_client(server):
+    client = CockpitClient(server.url)
+    client.connect(server.username, 'pass')
+    return client
+
+
+def bench_connect(server, options):
+    '''
+    CockpitClient.connect(): /login, WebSocket upgrade and init.
+    '''
+    def run():
+        connect_client(server).disconnect()
+    return summarize(measure(run, options.iterations))
+
+
+def bench_call_latency(server, options):
+    '''
+    Round trip of a single call and its reply.
+    '''
+    client = connect_client(server)
+    channel = client.open_dbus_channel(bus='session', service=SERVICE)
+    try:
+        return summarize(measure(
+            lambda: channel.call(PATH, SERVICE, 'Echo', [1]).wait(),
+            options.iterations * 10))
+    finally:
+        client.disconnect()
+
+
+def bench_pipelined(server, options):
+    '''
+    Batches of pipelined calls sent at once and their replies gathered.
+    '''
+    client = connect_client(server)
+    channel = client.open_dbus_channel(bus='session', service=SERVICE)
+    calls = [(PATH, SERVICE, 'Echo', [i]) for i in xrange(options.pipeline)]
+    try:
+        return summarize(
+            measure(lambda: wait_all(channel.call_many(calls)),
+                    options.iterations),
+            options.pipeline)
+    finally:
+        client.disconnect()
+
+
+def bench_large_reply(server, options):
+    '''
+    A call with a large reply, which is received and decoded.
+    '''
+    client = connect_client(server)
+    channel = client.open_dbus_channel(bus='session', service=SERVICE)
+    try:
+        result = summarize(measure(
+            lambda: channel.call(
+                PATH, SERVICE, 'Payload', [options.large_reply_size]).wait(),
+            options.iterations))
+        result['reply_size'] = options.large_reply_size
+        return result
+    finally:
+        client.disconnect()
+
+
+def bench_many_sessions(server, options):
+    '''
+    RemoteDBus sessions opened one after another, each making a call, all
+    kept open until the end.
+    '''
+    def run():
+        remotes = []
+        try:
+            for _ in xrange(options.sessions):
+                remote = RemoteDBus(
+                    server.url, server.username, 'pass', SERVICE)
+                remotes.append(remote)
+                remote(PATH, SERVICE, 'Echo', [1])
+        finally:
+            for remote in remotes:
+                remote.close()
+    result = summarize(measure(run, options.iterations), options.sessions)
+    result['sessions'] = options.sessions
+    return result
+
+
+BENCHMARKS = OrderedDict([
+    ('connect', bench_connect),
+    ('call_latency', bench_call_latency),
+    ('pipelined', bench_pipelined),
+    ('large_reply', bench_large_reply),
+    ('many_sessions', bench_many_sessions),
+])
+
+
+def get_environment():
+    return OrderedDict([
+        ('python', platform.python_version()),
+        ('implementation', platform.python_implementation()),
+        ('platform', platform.platform()),
+        ('json_codec', util.json_codec.name),
+        ('timestamp', time.time()),
+    ])
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description='Benchmarks of Cockpit Client with a fake cockpit-ws')
+    parser.add_argument(
+        'names', nargs='*', metavar='NAME',
+        help='benchmarks to run (%s); all by default' % ', '.join(BENCHMARKS))
+    parser.add_argument(
+        '--iterations', type=int, default=20,
+        help='measured iterations of every benchmark')
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='reply latency of the fake cockpit-ws in seconds')
+    parser.add_argument(
+        '--reply-size', type=int, default=16,
+        help='reply payload size of the fake D-Bus service in bytes')
+    parser.add_argument(
+        '--pipeline', type=int, default=100,
+        help='calls in a pipelined batch')
+    parser.add_argument(
+        '--large-reply-size', type=int, default=1024 * 1024,
+        help='reply size of the large_reply benchmark in bytes')
+    parser.add_argument(
+        '--sessions', type=int, default=20,
+        help='sessions of the many_sessions benchmark')
+    parser.add_argument(
+        '--output', '-o',
+        help='file to write JSON results to (default: stdout)')
+    options = parser.parse_args(argv)
+    for name in options.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    return options
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+
+    results = OrderedDict([
+        ('format', RESULTS_FORMAT),
+        ('environment', get_environment()),
+        ('parameters', OrderedDict([
+            ('iterations', options.iterations),
+            ('latency', options.latency),
+            ('reply_size', options.reply_size),
+            ('pipeline', options.pipeline),
+            ('large_reply_size', options.large_reply_size),
+            ('sessions', options.sessions),
+        ])),
+        ('benchmarks', OrderedDict()),
+    ])
+
+    with FakeCockpitWS(options.latency, options.reply_size) as server:
+        for name in options.names or BENCHMARKS:
+            sys.stderr.write('%s...\n' % name)
+            results['benchmarks'][name] = BENCHMARKS[name](server, options)
+
+    if options.output:
+        with open(options.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+            fp.write('\n')
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -18,3 +18,17 @@
 # ##### END LICENSE BLOCK #####
 
 from client import CockpitClient
+from async_client import AsyncCockpitClient
+from flow import FlowControlError
+from flow import SendQueue
+from metrics import MetricsCollector
+from metrics import MetricsHooks
+from metrics import StatsdExporter
+from metrics import format_prometheus
+from pool import CockpitClientPool
+from reconnect import ReconnectingCockpitClient
+from session import FileSessionStore
+from session import SessionStore
+from trace import FileTracer
+from trace import RingBufferTracer
+from trace import StreamTracer
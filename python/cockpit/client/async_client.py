@@ -0,0 +1,234 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import time
+from StringIO import StringIO
+
+from cockpit.client import http
+from cockpit.client import util
+from cockpit.client.channel import CallCancelledError
+from cockpit.client.channel import CallTimeoutError
+from cockpit.client.channel import DBusChannel
+from cockpit.client.client import CockpitAuthError
+from cockpit.client.client import CockpitClient
+from cockpit.client.client import CockpitProtocolError
+from cockpit.client.flow import FlowControlError
+from cockpit.client.metrics import DIRECTION_IN
+from cockpit.client.eventloop import Future
+from cockpit.client.eventloop import Return
+from cockpit.client.eventloop import coroutine
+from cockpit.client.eventloop import get_event_loop
+from cockpit.client.sock import AsyncWebSocket
+
+
+class PendingCallFuture(Future):
+    '''
+    Future of a remote D-Bus call reply.
+    '''
+    __slots__ = ('channel', 'call_id', 'idempotent', 'request', 'started')
+
+    def __init__(self, channel, call_id):
+        super(PendingCallFuture, self).__init__()
+        self.channel = channel
+        self.call_id = call_id
+        self.idempotent = False
+        self.request = None
+        self.started = None
+
+    def set_reply(self, reply):
+        self.set_result(reply)
+
+    def set_error(self, error):
+        self.set_exception(error)
+
+    def cancel(self, error=None):
+        '''
+        Cancels the call locally; see PendingCall.cancel().
+        '''
+        return self.channel.cancel_call(
+            self, error or CallCancelledError('Call cancelled'))
+
+
+class AsyncDBusChannel(DBusChannel):
+    '''
+    dbus-json3 channel, which returns futures from AsyncDBusChannel.call().
+    '''
+    __slots__ = ()
+
+    def create_pending_call(self, call_id):
+        return PendingCallFuture(self, call_id)
+
+    def wait_in_flight(self, count=1):
+        '''
+        Raises FlowControlError, if count more calls don't fit into
+        max_in_flight. The event loop can't be blocked for replies to arrive.
+        '''
+        if self.max_in_flight is None:
+            return
+        if self.pending and len(self.pending) + count > self.max_in_flight:
+            raise FlowControlError('Too many calls in flight')
+
+    def start_call_timer(self, call, timeout):
+        '''
+        Cancels a call with CallTimeoutError after timeout seconds by an event
+        loop timer.
+        '''
+        timer = self.client.loop.call_later(
+            timeout, call.cancel, CallTimeoutError('Call timed out'))
+        call.add_done_callback(lambda call: timer.cancel())
+
+
+class AsyncCockpitClient(CockpitClient):
+    '''
+    Non-blocking CockpitClient driven by an EventLoop. Methods, which wait for
+    cockpit-ws, return futures. Received messages are routed by the loop (see
+    CockpitClient.route_message()), so no dispatcher thread is needed.
+    Sessions are not stored (there's no session_store); every connect()
+    does a /login.
+    '''
+
+    dbus_channel_class = AsyncDBusChannel
+
+    def __init__(self, url, no_verification=False, debug=False, loop=None,
+                 metrics=None, tracer=None):
+        super(AsyncCockpitClient, self).__init__(
+            url, no_verification, debug, metrics=metrics, tracer=tracer)
+        self.loop = loop or get_event_loop()
+        self.ws = AsyncWebSocket(self.loop, sslopt=self.ws.sslopt)
+        self.ws.close_handler = self.handle_disconnect
+
+    @coroutine
+    def connect(self, username, password):
+        '''
+        Connects to a cockpit-ws. Performs /login, WebSockets handshake and
+        init exchange. Returns a Future of the init message.
+        '''
+        started = time.time()
+        yield self.ws.connect(self.url)
+
+        login_started = time.time()
+        cookie = yield self.login(username, password)
+        self.observe_duration('login', login_started)
+
+        handshake_started = time.time()
+        yield self.ws.handshake(header=['Cookie: cockpit=%s' % cookie])
+        self.observe_duration('handshake', handshake_started)
+
+        frame = yield self.ws.recv()
+        chan_id, resp = util.read_frame(frame)
+        if chan_id not in ('', '0') or resp['command'] != 'init':
+            raise CockpitProtocolError(
+                -1, 'Missing init message from cockpit-ws')
+        if 'problem' in resp:
+            self.ws.close()
+            if resp['problem'] in ('no-session', 'authentication-failed'):
+                raise CockpitAuthError(-1, resp['problem'])
+            raise CockpitProtocolError(-1, resp['problem'])
+
+        self.channel_seed = int(resp['channel-seed'])
+        self.send_init_message(resp['version'])
+
+        # From now on, every message is routed as soon as it's received.
+        self.ws.set_message_handler(self.handle_message)
+
+        self.observe_duration('connect', started)
+
+        raise Return(resp)
+
+    @coroutine
+    def login(self, username, password):
+        '''
+        Performs a login to cockpit-ws. Returns a Future of the cookie.
+        '''
+        assert self.is_connected, 'connect() must precede a login()'
+
+        wfile = StringIO()
+        http.send_message(self.make_login_request(username, password), wfile)
+        self.ws.write(wfile.getvalue())
+
+        msg_login_resp = yield self.recv_http_message()
+        cookie = self.get_login_cookie(msg_login_resp)
+
+        self.creds = (username, password)
+
+        raise Return(cookie)
+
+    @coroutine
+    def recv_http_message(self):
+        '''
+        Receives a HTTP message. Returns a Future of a HTTPMessage.
+        '''
+        head = yield self.ws.read_until(http.CRLF * 2)
+        reader = http.HTTPReader(StringIO(head + http.CRLF * 2))
+        init_line = reader.recv_init_line()
+        headers = reader.recv_headers()
+
+        content_length = http.get_content_length(headers)
+        if content_length:
+            body = yield self.ws.read_exactly(content_length)
+        elif http.is_chunked(headers):
+            chunks = []
+            while True:
+                chunk_size = yield self.ws.read_until(http.CRLF)
+                chunk_size = int(chunk_size.split(';', 1)[0].strip(), base=16)
+                chunk = yield self.ws.read_exactly(chunk_size + len(http.CRLF))
+                if not chunk_size:
+                    break
+                chunks.append(chunk[:chunk_size])
+            body = ''.join(chunks)
+        else:
+            # The connection stays open for the upgrade; there's no body.
+            body = ''
+
+        raise Return(http.HTTPMessage(init_line, headers, body))
+
+    def recv_message(self):
+        '''
+        Returns a Future of a next message as a channel ID and a message. Once
+        the init exchange is finished, messages are routed instead.
+        '''
+        future = Future()
+
+        def received(message):
+            if message.error is not None:
+                future.set_exception(message.error)
+            else:
+                future.set_result(message.value.split('\n', 1))
+
+        self.ws.recv().add_done_callback(received)
+        return future
+
+    def handle_message(self, frame):
+        '''
+        Routes a frame received by the loop.
+        '''
+        channel_id, message = util.read_frame(frame)
+        if self.metrics is not None:
+            self.metrics.observe_frame(
+                channel_id, DIRECTION_IN, len(frame), self.client_id)
+        if self.tracer is not None:
+            self.tracer.trace(DIRECTION_IN, frame, message)
+        self.route_message(channel_id, message)
+
+    def handle_disconnect(self):
+        '''
+        Closes all the channels, when the connection is lost.
+        '''
+        for channel in self.channels.values():
+            channel.closed('disconnected')
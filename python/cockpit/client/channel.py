@@ -0,0 +1,675 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import Queue
+import heapq
+import itertools
+import threading
+import time
+
+from cockpit.client import util
+from cockpit.client.flow import FlowControlError
+from cockpit.client.flow import get_remaining
+
+
+class ChannelError(Exception):
+    '''
+    Base channel exception class.
+    '''
+
+
+class DBusError(ChannelError):
+    '''
+    D-Bus error returned by a remote call. Arguments are the D-Bus error name
+    and a list of error message arguments.
+    '''
+
+    @property
+    def name(self):
+        '''
+        Returns D-Bus error name.
+        '''
+        return self.args[0]
+
+
+class CallCancelledError(ChannelError):
+    '''
+    Raised by a call, which was cancelled locally.
+    '''
+
+
+class CallTimeoutError(CallCancelledError):
+    '''
+    Raised by a call, which didn't get its reply before its deadline.
+    '''
+
+
+class ConnectionLostError(ChannelError):
+    '''
+    Raised by a call, which was pending when the connection broke. Arguments
+    are the channel problem and the exception, which broke the connection.
+    '''
+
+    @property
+    def cause(self):
+        '''
+        Returns the exception, which broke the connection.
+        '''
+        return self.args[1]
+
+
+class PendingCall(object):
+    '''
+    Remote D-Bus call, which has been sent and is waiting for its reply.
+    '''
+    __slots__ = ('channel', 'call_id', 'callbacks', 'deadline', 'done',
+                 'event', 'idempotent', 'reply', 'request', 'error',
+                 'started')
+
+    def __init__(self, channel, call_id):
+        self.channel = channel
+        self.call_id = call_id
+        self.callbacks = None
+        self.deadline = None
+        self.done = False
+        # Created by get_event() only for calls, which are waited for.
+        self.event = None
+        self.idempotent = False
+        self.reply = None
+        self.request = None
+        self.error = None
+        self.started = None
+
+    def set_reply(self, reply):
+        '''
+        Stores a reply and marks the call as finished.
+        '''
+        self.reply = reply
+        self.finish()
+
+    def set_error(self, error):
+        '''
+        Stores an exception and marks the call as finished.
+        '''
+        self.error = error
+        self.finish()
+
+    def finish(self):
+        with self.channel.in_flight_cond:
+            self.done = True
+            event = self.event
+            callbacks, self.callbacks = self.callbacks, None
+        if event is not None:
+            event.set()
+        for callback in callbacks or ():
+            callback(self)
+
+    def get_event(self):
+        '''
+        Returns an event set, when the call finishes.
+        '''
+        with self.channel.in_flight_cond:
+            if self.event is None:
+                self.event = threading.Event()
+                if self.done:
+                    self.event.set()
+            return self.event
+
+    def add_done_callback(self, callback):
+        '''
+        Calls callback with the call, when it's finished. Finished calls call
+        it immediately.
+        '''
+        with self.channel.in_flight_cond:
+            if not self.done:
+                if self.callbacks is None:
+                    self.callbacks = [callback]
+                else:
+                    self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self, error=None):
+        '''
+        Cancels the call locally; its reply will be dropped. The call fails
+        with error (CallCancelledError by default). Returns False, if the call
+        has finished already.
+        '''
+        return self.channel.cancel_call(
+            self, error or CallCancelledError('Call cancelled'))
+
+    def wait(self, timeout=None):
+        '''
+        Waits for the reply, at most timeout seconds and not past the call
+        deadline. Without a dispatcher thread, frames received meanwhile are
+        routed to their own channels and calls. Returns the reply arguments or
+        raises DBusError (ChannelError, if the channel closed;
+        CallTimeoutError, if the call timed out and was cancelled).
+        '''
+        deadline = self.deadline
+        if timeout is not None:
+            deadline = min(deadline or float('inf'), time.time() + timeout)
+
+        client = self.channel.client
+        while not self.done:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    if not self.cancel(CallTimeoutError('Call timed out')):
+                        # The reply is being routed right now.
+                        self.get_event().wait()
+                    break
+            if client.is_dispatching:
+                self.get_event().wait(remaining)
+            else:
+                client.process_message(remaining)
+
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+
+def wait_all(calls, return_exceptions=False, timeout=None):
+    '''
+    Waits for all the calls, at most timeout seconds in total. Returns a list
+    of their replies in the order of calls. If return_exceptions is True,
+    errors are returned in place of replies instead of being raised. Calls
+    not finished in time are cancelled with CallTimeoutError.
+    '''
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    results = []
+    for call in calls:
+        try:
+            if deadline is None:
+                results.append(call.wait())
+            else:
+                results.append(call.wait(max(deadline - time.time(), 0)))
+        except ChannelError as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+
+def iter_completed(calls, timeout=None):
+    '''
+    Yields calls as they finish, at most timeout seconds in total. Calls not
+    finished by then, or by their own deadlines, are cancelled with
+    CallTimeoutError and yielded too. All the calls must belong to channels
+    of the same client.
+    '''
+    calls = list(calls)
+    if not calls:
+        return
+
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+
+    client = calls[0].channel.client
+    finished = Queue.Queue()
+    # Heap of (deadline, index, call) of calls, which time out.
+    deadlines = []
+    for index, call in enumerate(calls):
+        call_deadline = call.deadline
+        if deadline is not None and \
+                (call_deadline is None or deadline < call_deadline):
+            call_deadline = deadline
+        if call_deadline is not None:
+            deadlines.append((call_deadline, index, call))
+        call.add_done_callback(finished.put)
+    heapq.heapify(deadlines)
+
+    for _ in calls:
+        while True:
+            try:
+                call = finished.get_nowait()
+                break
+            except Queue.Empty:
+                pass
+
+            while deadlines and deadlines[0][2].done:
+                heapq.heappop(deadlines)
+            remaining = None
+            if deadlines:
+                remaining = deadlines[0][0] - time.time()
+                if remaining <= 0:
+                    heapq.heappop(deadlines)[2].cancel(
+                        CallTimeoutError('Call timed out'))
+                    continue
+
+            if client.is_dispatching:
+                try:
+                    call = finished.get(timeout=remaining)
+                    break
+                except Queue.Empty:
+                    pass
+            else:
+                client.process_message(remaining)
+        yield call
+
+
+def make_watch(path, interface=None):
+    '''
+    Returns a dbus-json3 watch description.
+    '''
+    watch = {'path': path}
+    if interface is not None:
+        watch['interface'] = interface
+    return watch
+
+
+class Channel(object):
+    '''
+    Base class of an opened Cockpit channel.
+    '''
+    __slots__ = ('client', 'channel_id', 'open_options', 'problem')
+
+    def __init__(self, client, channel_id):
+        self.client = client
+        self.channel_id = channel_id
+        # Options the channel was opened with; used to reopen it.
+        self.open_options = {}
+        self.problem = None
+
+    def send(self, data):
+        '''
+        Sends a message via this channel.
+        '''
+        self.client.send_message(self.channel_id, data)
+
+    def dispatch(self, message):
+        '''
+        Handles a decoded message received on this channel.
+        '''
+
+    def closed(self, problem, error=None):
+        '''
+        Handles closing of the channel by the other side or a lost connection.
+        The error, if given, is the exception, which broke the connection.
+        '''
+        self.problem = problem
+
+    def suspend(self, problem, replay=True):
+        '''
+        Handles a lost connection, which is going to be restored. If replay is
+        True, requests waiting for a response may be sent again.
+        '''
+        self.problem = problem
+
+    def resume(self):
+        '''
+        Handles the channel being reopened on a restored connection.
+        '''
+        self.problem = None
+
+    def close(self, closing_reason=''):
+        '''
+        Closes the channel.
+        '''
+        self.client.close_channel_with_id(self.channel_id, closing_reason)
+        self.client.unregister_channel(self.channel_id)
+        self.closed(closing_reason or 'closed')
+
+
+class QueueChannel(Channel):
+    '''
+    Channel without a protocol object. Its messages are put into a queue
+    read by CockpitClient.recv_channel_message(); None marks its end.
+    '''
+    __slots__ = ('queue',)
+
+    def __init__(self, client, channel_id):
+        super(QueueChannel, self).__init__(client, channel_id)
+        self.queue = Queue.Queue()
+
+    def dispatch(self, message):
+        self.queue.put(message)
+
+    def closed(self, problem, error=None):
+        if self.problem is None:
+            self.queue.put(None)
+        super(QueueChannel, self).closed(problem, error)
+
+    def suspend(self, problem, replay=True):
+        # Channels without open options can't be reopened.
+        self.closed(problem)
+
+
+class DBusChannel(Channel):
+    '''
+    dbus-json3 channel. Every call gets a unique ID, so any number of calls
+    can be sent before the replies arrive; replies are matched by their ID.
+    '''
+    __slots__ = ('call_ids', 'in_flight_cond', 'in_flight_timeout',
+                 'listeners', 'max_in_flight', 'pending', 'subscriptions')
+
+    def __init__(self, client, channel_id):
+        super(DBusChannel, self).__init__(client, channel_id)
+        self.call_ids = itertools.count(1)
+        self.in_flight_cond = threading.Condition()
+        self.in_flight_timeout = None
+        self.listeners = []
+        self.max_in_flight = None
+        self.pending = {}
+        # Active watch and add_match requests; sent again on resume().
+        self.subscriptions = []
+
+    @property
+    def in_flight(self):
+        '''
+        Property returning the number of calls waiting for their replies.
+        '''
+        return len(self.pending)
+
+    def get_next_call_id(self):
+        '''
+        Returns a next unique call ID.
+        '''
+        return str(next(self.call_ids))
+
+    def create_pending_call(self, call_id):
+        '''
+        Returns an object tracking a call with call_id.
+        '''
+        return PendingCall(self, call_id)
+
+    def wait_in_flight(self, count=1):
+        '''
+        Waits until count more calls fit into max_in_flight (a batch larger
+        than that waits for all the calls to finish). Raises FlowControlError,
+        if they don't fit within in_flight_timeout seconds (forever, if None;
+        not at all, if 0).
+        '''
+        if self.max_in_flight is None:
+            return
+
+        limit = max(self.max_in_flight - count, 0)
+        deadline = None
+        if self.in_flight_timeout is not None:
+            deadline = time.time() + self.in_flight_timeout
+
+        client = self.client
+        with self.in_flight_cond:
+            while len(self.pending) > limit and self.problem is None:
+                remaining = get_remaining(deadline)
+                if client.is_dispatching:
+                    self.in_flight_cond.wait(remaining)
+                else:
+                    # Without a dispatcher, replies are received here; the
+                    # deadline is checked again, once nothing arrived.
+                    client.process_message(remaining)
+
+    def notify_in_flight(self):
+        if self.max_in_flight is not None:
+            with self.in_flight_cond:
+                self.in_flight_cond.notify_all()
+
+    def send_request(self, require_response=True, idempotent=False,
+                     timeout=None, **fields):
+        '''
+        Sends a dbus-json3 request made of fields. Returns a PendingCall
+        object, or None, when no response is required. Idempotent requests
+        may be sent again, when the connection is restored before their reply
+        arrives. A call with a timeout (in seconds) is cancelled, if its reply
+        doesn't arrive in time; cockpit-ws gets the timeout too.
+        '''
+        if timeout is not None and 'call' in fields:
+            fields['timeout'] = int(timeout * 1000)
+
+        call_id = None
+        pending = None
+        if require_response:
+            # Checking the limit and adding the call must be atomic.
+            with self.in_flight_cond:
+                self.wait_in_flight()
+                call_id = self.get_next_call_id()
+                pending = self.create_pending_call(call_id)
+                pending.idempotent = idempotent
+                pending.request = fields
+                if 'call' in fields and self.client.metrics is not None:
+                    pending.started = time.time()
+                self.pending[call_id] = pending
+            if timeout is not None:
+                self.start_call_timer(pending, timeout)
+
+        if self.problem is not None:
+            self.pending.pop(call_id, None)
+            raise ChannelError(self.problem)
+
+        try:
+            self.send(util.make_json(id=call_id, **fields))
+        except Exception:
+            self.pending.pop(call_id, None)
+            raise
+
+        return pending
+
+    def call(self, path, interface, method, args, require_response=True,
+             idempotent=False, timeout=None, signature=None):
+        '''
+        Sends a D-Bus call. Returns a PendingCall object, or None, when no
+        response is required. See DBusChannel.send_request() for idempotent
+        and timeout. With a signature of args, cockpit-ws doesn't introspect
+        the method itself.
+        '''
+        fields = {'call': [path, interface, method, args]}
+        if signature is not None:
+            fields['type'] = signature
+        return self.send_request(
+            require_response,
+            idempotent,
+            timeout,
+            **fields)
+
+    def watch(self, path, interface=None, require_response=True):
+        '''
+        Starts watching properties of path (and interface). Changes are
+        reported by notify messages passed to listeners.
+        '''
+        fields = {'watch': make_watch(path, interface)}
+        self.subscriptions.append(fields)
+        return self.send_request(require_response, True, **fields)
+
+    def unwatch(self, path, interface=None):
+        '''
+        Stops watching properties of path (and interface).
+        '''
+        watch = make_watch(path, interface)
+        if {'watch': watch} in self.subscriptions:
+            self.subscriptions.remove({'watch': watch})
+        self.send_request(False, unwatch=watch)
+
+    def add_match(self, match, require_response=True):
+        '''
+        Subscribes for signals described by a match dict (path,
+        path_namespace, interface, member, arg0). Signals are passed to
+        listeners.
+        '''
+        fields = {'add_match': match}
+        self.subscriptions.append(fields)
+        return self.send_request(require_response, True, **fields)
+
+    def remove_match(self, match):
+        '''
+        Unsubscribes signals described by a match dict.
+        '''
+        if {'add_match': match} in self.subscriptions:
+            self.subscriptions.remove({'add_match': match})
+        self.send_request(False, remove_match=match)
+
+    def call_many(self, calls, idempotent=False, timeout=None):
+        '''
+        Sends a list of (path, interface, method, args) D-Bus calls at once.
+        Returns a list of PendingCall objects in the same order. All of them
+        share the timeout.
+        '''
+        calls = list(calls)
+        pending = []
+        messages = []
+        started = None
+        if self.client.metrics is not None:
+            started = time.time()
+        with self.in_flight_cond:
+            self.wait_in_flight(len(calls))
+            for path, interface, method, args in calls:
+                call_id = self.get_next_call_id()
+                pending_call = self.create_pending_call(call_id)
+                pending_call.idempotent = idempotent
+                pending_call.request = {
+                    'call': [path, interface, method, args]}
+                if timeout is not None:
+                    pending_call.request['timeout'] = int(timeout * 1000)
+                pending_call.started = started
+                self.pending[call_id] = pending_call
+                pending.append(pending_call)
+                messages.append((
+                    self.channel_id,
+                    util.make_json(id=call_id, **pending_call.request)))
+
+        if self.problem is not None:
+            for pending_call in pending:
+                self.pending.pop(pending_call.call_id, None)
+            raise ChannelError(self.problem)
+
+        try:
+            self.client.send_messages(messages)
+        except Exception:
+            for pending_call in pending:
+                self.pending.pop(pending_call.call_id, None)
+            raise
+
+        if timeout is not None:
+            for pending_call in pending:
+                self.start_call_timer(pending_call, timeout)
+
+        return pending
+
+    def start_call_timer(self, call, timeout):
+        '''
+        Arranges for a call to time out after timeout seconds. The client
+        cancels it then, whether it's waited for or not.
+        '''
+        call.deadline = time.time() + timeout
+        self.client.add_call_deadline(call)
+
+    def cancel_call(self, call, error):
+        '''
+        Fails a call with error and forgets it, so its reply is dropped.
+        Returns False, if the call has finished already.
+        '''
+        if self.pending.pop(call.call_id, None) is None:
+            return False
+        self.notify_in_flight()
+        self.observe_call(call, True)
+        call.set_error(error)
+        return True
+
+    def observe_call(self, call, failed):
+        '''
+        Reports a finished call to the client metrics, if it's measured.
+        '''
+        if call.started is not None and self.client.metrics is not None:
+            interface, method = call.request['call'][1:3]
+            self.client.metrics.observe_call(
+                interface, method, time.time() - call.started, failed)
+
+    def dispatch(self, message):
+        '''
+        Routes a reply or an error to the call it belongs to. Other messages
+        (signals, notifications, ...) are passed to listeners. Replies of
+        cancelled calls are dropped.
+        '''
+        call_id = message.get('id')
+        pending = self.pending.pop(call_id, None)
+        if pending is None:
+            if call_id is not None:
+                return
+            for listener in list(self.listeners):
+                listener(message)
+            return
+        self.notify_in_flight()
+        self.observe_call(pending, 'error' in message)
+
+        if 'error' in message:
+            pending.set_error(DBusError(*message['error']))
+        else:
+            pending.set_reply((message.get('reply') or [None])[0])
+
+    def add_listener(self, listener):
+        '''
+        Registers a callable, which gets every decoded message not being a
+        reply to a call. When the channel is closed, listeners get a
+        {'closed': problem} message.
+        '''
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        '''
+        Unregisters a listener.
+        '''
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def suspend(self, problem, replay=True):
+        '''
+        Fails pending calls, which aren't idempotent. Idempotent ones are kept
+        and sent again by DBusChannel.resume(), unless replay is False.
+        '''
+        super(DBusChannel, self).suspend(problem, replay)
+        for call_id, call in self.pending.items():
+            if not (replay and call.idempotent):
+                del self.pending[call_id]
+                call.set_error(ChannelError(problem))
+        self.notify_in_flight()
+
+    def resume(self):
+        '''
+        Restores watches and signal matches and sends the kept calls again
+        under their original IDs.
+        '''
+        super(DBusChannel, self).resume()
+        messages = [(self.channel_id, util.make_json(**fields))
+                    for fields in self.subscriptions]
+        messages.extend(
+            (self.channel_id, util.make_json(id=call.call_id, **call.request))
+            for call in self.pending.values())
+        if messages:
+            self.client.send_messages(messages)
+
+    def closed(self, problem, error=None):
+        '''
+        Fails all the pending calls and notifies listeners. If error broke the
+        connection, the calls raise a ConnectionLostError of it.
+        '''
+        super(DBusChannel, self).closed(problem, error)
+        if error is None:
+            error = ChannelError(problem)
+        else:
+            error = ConnectionLostError(problem, error)
+        pending, self.pending = self.pending, {}
+        for call in pending.values():
+            call.set_error(error)
+        self.notify_in_flight()
+        for listener in list(self.listeners):
+            listener({'closed': problem})
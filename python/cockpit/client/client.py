@@ -17,14 +17,50 @@
 #
 # ##### END LICENSE BLOCK #####
 
+import errno
+import fcntl
+import heapq
+import itertools
+import logging
+import os
+import socket
 import ssl
 import struct
+import sys
+import threading
+import time
+import warnings
 
 from cockpit.client import constants
+from cockpit.client import flow
 from cockpit.client import http
+from cockpit.client import session
 from cockpit.client import util
+from cockpit.client.channel import CallTimeoutError
 from cockpit.client.channel import DBusChannel
+from cockpit.client.channel import QueueChannel
+from cockpit.client.metrics import DIRECTION_IN
+from cockpit.client.metrics import DIRECTION_OUT
 from cockpit.client.sock import WebSocket
+from cockpit.client.sock import WebSocketHandshakeError
+from cockpit.client.trace import StreamTracer
+
+
+logger = logging.getLogger(__name__)
+
+# Constant ping command.
+PING_MESSAGE = util.make_json(command='ping')
+
+# Maximum number of frames written by the sender thread at once.
+SEND_BATCH_SIZE = 64
+
+# Size of the call deadline heap, over which entries of finished calls are
+# dropped.
+DEADLINES_PRUNE_SIZE = 1024
+
+# Source of CockpitClient.client_id values, which tell gauges and channels
+# of clients sharing a metrics object apart.
+CLIENT_IDS = itertools.count(1)
 
 
 class CockpitError(Exception):
@@ -39,21 +75,75 @@ class CockpitProtocolError(CockpitError):
     '''
 
 
+class CockpitAuthError(CockpitProtocolError):
+    '''
+    Raised, when cockpit-ws refuses a session cookie.
+    '''
+
+
 class CockpitClient(object):
     '''
     Cockpit client class which implements (part of) Cockpit protocol.
     '''
 
-    def __init__(self, url, no_verification=False, debug=False):
+    # Class of channel objects returned by open_dbus_channel().
+    dbus_channel_class = DBusChannel
+
+    def __init__(self, url, no_verification=False, debug=False,
+                 session_store=None, metrics=None, tracer=None):
         sslopt = {}
         if no_verification:
             sslopt['cert_reqs'] = ssl.CERT_NONE
+        # Heap of (deadline, seq, call) of calls with a timeout; see
+        # CockpitClient.expire_calls().
+        self.call_deadlines = []
+        self.call_deadlines_prune_size = DEADLINES_PRUNE_SIZE
+        self.call_deadlines_seq = itertools.count()
         self.channel_seed = 0
+        self.channels = {}
+        self.client_id = next(CLIENT_IDS)
+        self.control_handlers = {}
+        self.connection_error = None
+        self.cookie = None
         self.creds = None
+        self.deadlines_lock = threading.Lock()
         self.debug = debug
+        self.dispatcher = None
+        self.http_connection = None
+        self.metrics = metrics
+        self.send_lock = threading.Lock()
+        self.send_queue = None
+        self.sender = None
+        self.session_store = session_store
+        if tracer is None and debug:
+            # Debug mode traces whole frames to stdout.
+            tracer = StreamTracer(sys.stdout, max_payload=sys.maxint)
+        self.tracer = tracer
         self.url = url
+        # Pipe waking up the dispatcher thread for a new earliest deadline.
+        self.wakeup_pipe = None
         self.ws = WebSocket(sslopt=sslopt)
 
+        self.add_control_handler('close', self.handle_close_message)
+
+        if metrics is not None:
+            # Registered until disconnect(); see remove_gauges().
+            labels = self.gauge_labels
+            metrics.add_gauge(
+                'send_queue_depth', labels,
+                lambda: self.send_queue_depth)
+            metrics.add_gauge(
+                'calls_in_flight', labels,
+                lambda: sum(len(getattr(channel, 'pending', ()))
+                            for channel in self.channels.values()))
+
+    @property
+    def gauge_labels(self):
+        '''
+        Property returning labels of the gauges of this client.
+        '''
+        return {'url': self.url, 'client': self.client_id}
+
     @property
     def is_connected(self):
         '''
@@ -61,27 +151,146 @@ class CockpitClient(object):
         '''
         return self.ws.sock is not None
 
-    def connect(self, username, password):
+    @property
+    def send_queue_depth(self):
+        '''
+        Property returning the number of frames waiting for the sender thread.
+        '''
+        if self.send_queue is None:
+            return 0
+        return len(self.send_queue)
+
+    @property
+    def is_dispatching(self):
+        '''
+        Property returning whether a dispatcher thread is running.
+        '''
+        return self.dispatcher is not None and self.dispatcher.is_alive()
+
+    def connect(self, username, password, timeout=None):
         '''
         Connects to a cockpit-ws. Performs /login and WebSockets handshake.
         Verifies, if init command was issued. When an unsuccessful login is
-        issued, CockpitProtocolError is raised.
+        issued, CockpitProtocolError is raised. With a session store, a stored
+        cookie is tried first and /login is done only when it's refused. A
+        timeout (seconds) bounds every socket operation until the connection
+        is set up; socket.timeout is raised when it expires.
+        '''
+        if timeout is None:
+            return self.connect_session(username, password)
+
+        previous = self.ws.gettimeout()
+        self.ws.settimeout(timeout)
+        try:
+            resp = self.connect_session(username, password)
+            self.ws.sock.settimeout(previous)
+            return resp
+        finally:
+            self.ws.settimeout(previous)
+
+    def connect_session(self, username, password):
+        '''
+        Body of CockpitClient.connect() with the timeout set.
+        '''
+        started = time.time()
+        cookie = None
+        if self.session_store is not None:
+            cookie = self.session_store.get(self.url, username)
+
+        if cookie is not None:
+            try:
+                self.ws.connect(self.url)
+                resp = self.upgrade(cookie)
+            except CockpitAuthError:
+                # The session expired or was logged out; do a fresh /login.
+                self.session_store.remove(self.url, username)
+                self.ws.close()
+            else:
+                self.cookie = cookie
+                self.creds = (username, password)
+                self.session_store.put(self.url, username, cookie)
+                self.observe_duration('connect', started)
+                return resp
+
+        # Connect to cockpit-ws and do a /login, retrieve a cookie.
+        cookie = self.connect_http(username, password)
+
+        # Perform a WebSocket handshake and the init exchange.
+        resp = self.upgrade(cookie)
+        self.observe_duration('connect', started)
+        return resp
+
+    def connect_http(self, username, password):
+        '''
+        Connects to a cockpit-ws and performs /login. Returns a cookie. The
+        connection stays in HTTP mode, so CockpitClient.http_request() can be
+        used before CockpitClient.upgrade().
         '''
         # Connect to cockpit-ws.
         self.ws.connect(self.url)
 
+        # All the HTTP exchanges share one buffered connection.
+        self.http_connection = http.HTTPConnection(self.ws.sock)
+
         # Do a /login, retrieve a cookie.
-        cookie = self.login(username, password)
+        started = time.time()
+        self.cookie = self.login(username, password)
+        self.observe_duration('login', started)
+
+        return self.cookie
 
+    def http_request(self, method, uri, headers=None, body=''):
+        '''
+        Performs an HTTP request authenticated by the session cookie on the
+        connection before its upgrade. Returns a response HTTPMessage.
+        '''
+        assert self.http_connection is not None, \
+            'connect_http() must precede a http_request()'
+
+        request_headers = {
+            'Host': '%s:%s' % (self.ws.hostname, self.ws.port),
+            'Cookie': 'cockpit=%s' % self.cookie,
+            'Connection': 'keep-alive',
+        }
+        if body:
+            request_headers[http.HEADER_NAME_CONTENT_LENGTH] = str(len(body))
+        request_headers.update(headers or {})
+
+        return self.http_connection.request(
+            http.HTTPMessage(
+                http.HTTPRequestLine(method, uri, http.HTTP_1_1),
+                request_headers,
+                body))
+
+    def upgrade(self, cookie=None):
+        '''
+        Performs a WebSocket handshake on the HTTP connection and the init
+        exchange. Returns the init message.
+        '''
         # Perform a WebSocket handshake.
-        self.ws.handshake(header=['Cookie: cockpit=%s' % cookie])
+        started = time.time()
+        try:
+            self.ws.handshake(
+                connection=self.http_connection,
+                header=['Cookie: cockpit=%s' % (cookie or self.cookie)])
+        except WebSocketHandshakeError as e:
+            if e.status_code in (401, 403):
+                raise CockpitAuthError(e.status_code, 'Session cookie refused')
+            raise
+        finally:
+            self.http_connection = None
+        self.observe_duration('handshake', started)
 
         # Check for init command. This is the first and required command sent
         # by cockpit-ws, which opens the session.
-        chan_id, resp = self.recv_message()
-        resp = util.read_json(resp)
+        chan_id, resp = util.read_frame(self.ws.recv_payload())
         if chan_id not in ('', '0') or resp['command'] != 'init':
             raise CockpitProtocolError(-1, 'Missing init message from cockpit-ws')
+        if 'problem' in resp:
+            self.ws.close()
+            if resp['problem'] in ('no-session', 'authentication-failed'):
+                raise CockpitAuthError(-1, resp['problem'])
+            raise CockpitProtocolError(-1, resp['problem'])
 
         # Store channel seed, which will be used later for channel opening.
         self.channel_seed = int(resp['channel-seed'])
@@ -93,13 +302,36 @@ class CockpitClient(object):
 
     def disconnect(self):
         '''
-        Logs out and Disconnects from cockpit-ws.
+        Logs out and Disconnects from cockpit-ws. A session kept in a session
+        store is not logged out, so the next connect() can reuse it.
         '''
         # Send logout command.
-        self.logout()
+        if self.session_store is None:
+            self.logout()
+
+        # Let the sender thread write everything queued so far.
+        self.stop_sender()
+
+        # Wake up and wait for the dispatcher thread, so it doesn't race with
+        # the closing handshake.
+        if self.is_dispatching:
+            self.ws.sock.shutdown(socket.SHUT_RDWR)
+            if self.dispatcher is not threading.current_thread():
+                self.dispatcher.join()
 
         # Disconnect from cockpit-ws.
         self.ws.close()
+        self.remove_gauges()
+
+    def remove_gauges(self):
+        '''
+        Unregisters the gauges of this client, so a metrics object shared by
+        short-lived clients doesn't keep them.
+        '''
+        if self.metrics is not None:
+            labels = self.gauge_labels
+            self.metrics.remove_gauge('send_queue_depth', labels)
+            self.metrics.remove_gauge('calls_in_flight', labels)
 
     def login(self, username, password):
         '''
@@ -107,37 +339,52 @@ class CockpitClient(object):
         '''
         assert self.is_connected, 'connect() must precede a login()'
 
-        sock = self.ws.sock
+        if self.http_connection is None:
+            self.http_connection = http.HTTPConnection(self.ws.sock)
 
-        # Send a /login request.
-        http.send_message(
-            http.HTTPMessage(
-                http.HTTPRequestLine('GET', '/login', http.HTTP_1_1), {
-                    'Host':  '%s:%s' % (self.ws.hostname, self.ws.port),
-                    'Cookie': 'cockpit=%s' % util.make_auth_cookie(),
-                    'Authorization': 'Basic %s' % util.make_auth_credentials(
-                        username, password),
-                    'Connection': 'keep-alive',
-                }),
-            sock)
-
-        # Receive a /login response.
-        msg_login_resp = http.recv_message(sock)
+        # Send a /login request and receive a /login response.
+        msg_login_resp = self.http_connection.request(
+            self.make_login_request(username, password))
+        cookie = self.get_login_cookie(msg_login_resp)
+
+        # After a successful login, store current credentials.
+        self.creds = (username, password)
+
+        if self.session_store is not None:
+            self.session_store.put(
+                self.url, username, cookie,
+                session.get_cookie_expiry(msg_login_resp['Set-Cookie']))
+
+        return cookie
+
+    def make_login_request(self, username, password):
+        '''
+        Returns a /login request HTTPMessage.
+        '''
+        return http.HTTPMessage(
+            http.HTTPRequestLine('GET', '/login', http.HTTP_1_1), {
+                'Host':  '%s:%s' % (self.ws.hostname, self.ws.port),
+                'Cookie': 'cockpit=%s' % util.make_auth_cookie(),
+                'Authorization': 'Basic %s' % util.make_auth_credentials(
+                    username, password),
+                'Connection': 'keep-alive',
+            })
+
+    def get_login_cookie(self, msg_login_resp):
+        '''
+        Returns a Cockpit cookie from a /login response HTTPMessage. Raises
+        HTTPError, if the login failed.
+        '''
         if not http.is_success(msg_login_resp):
             http.raise_from_message(msg_login_resp)
 
         # Extract a cookie
         try:
             cookie_header = msg_login_resp['Set-Cookie']
-            cookie = cookie_header.split('cockpit=', 1)[1].split(';', 1)[0]
+            return cookie_header.split('cockpit=', 1)[1].split(';', 1)[0]
         except (KeyError, TypeError, IndexError):
             raise http.HTTPError(-1, 'Missing Cockpit cookie')
 
-        # After a successful login, store current credentials.
-        self.creds = (username, password)
-
-        return cookie
-
     def logout(self, close_connection=True):
         '''
         Logs out from cockpit-ws. If close_connection is True, websocket will
@@ -158,7 +405,7 @@ class CockpitClient(object):
         '''
         Sends a ping command.
         '''
-        self.send_control_message(util.make_json(command='ping'))
+        self.send_control_message(PING_MESSAGE)
 
     def get_next_channel_id(self):
         '''
@@ -181,16 +428,44 @@ class CockpitClient(object):
         '''
         Sends a message via channel_id.
         '''
-        frame = '%s\n%s' % (str(channel_id), data)
+        frame = self.make_frame(channel_id, data)
 
-        if self.debug:
-            print '-' * 80
-            print 'Channel:', channel_id if channel_id else 'control'
-            print 'Payload:', data
-            print '-' * 80
-            print
+        if self.send_queue is not None:
+            self.send_queue.put_many([frame])
+            return
 
-        self.ws.send(frame.encode('utf8'))
+        with self.send_lock:
+            self.ws.send(frame)
+
+    def send_messages(self, messages):
+        '''
+        Sends a list of (channel_id, data) messages with as few writes as
+        possible.
+        '''
+        frames = [self.make_frame(channel_id, data)
+                  for channel_id, data in messages]
+
+        if self.send_queue is not None:
+            self.send_queue.put_many(frames)
+            return
+
+        with self.send_lock:
+            self.ws.send_many(frames)
+
+    def make_frame(self, channel_id, data):
+        '''
+        Returns an encoded Cockpit frame of a message via channel_id.
+        '''
+        frame = ('%s\n%s' % (str(channel_id), data)).encode('utf8')
+
+        if self.metrics is not None:
+            self.metrics.observe_frame(
+                channel_id, DIRECTION_OUT, len(frame), self.client_id)
+
+        if self.tracer is not None:
+            self.tracer.trace(DIRECTION_OUT, frame)
+
+        return frame
 
     def send_control_message(self, payload):
         '''
@@ -200,9 +475,315 @@ class CockpitClient(object):
 
     def recv_message(self):
         '''
-        Receives a message. Returns a channel ID and a message.
+        Receives a message. Returns a channel ID and the undecoded message.
+        Deprecated; CockpitClient.receive_message() returns the message
+        decoded without splitting the frame first.
+        '''
+        warnings.warn('recv_message() is deprecated, use receive_message()',
+                      DeprecationWarning, stacklevel=2)
+        payload = self.ws.recv_payload()
+        pos = payload.index('\n')
+        return [payload[:pos], payload[pos + 1:]]
+
+    def process_message(self, timeout=None):
+        '''
+        Receives a message and routes it (see CockpitClient.route_message()).
+        Returns a channel ID and a decoded message, or None, if nothing
+        arrived within timeout seconds or before the earliest call deadline.
+        Calls past their deadlines are cancelled (see
+        CockpitClient.expire_calls()).
+        '''
+        result = self.receive_message(self.get_deadline_timeout(timeout))
+        if result is not None:
+            self.route_message(*result)
+        self.expire_calls()
+        return result
+
+    def add_call_deadline(self, call):
+        '''
+        Registers a call with a deadline. Once the deadline passes, the call
+        is cancelled with CallTimeoutError by CockpitClient.process_message()
+        or the dispatcher thread, even if nobody waits for it.
+        '''
+        with self.deadlines_lock:
+            deadlines = self.call_deadlines
+            if len(deadlines) >= self.call_deadlines_prune_size:
+                # Finished calls are dropped only here, not one by one.
+                deadlines[:] = [entry for entry in deadlines
+                                if not entry[2].done]
+                heapq.heapify(deadlines)
+                self.call_deadlines_prune_size = max(
+                    DEADLINES_PRUNE_SIZE, 2 * len(deadlines))
+            heapq.heappush(
+                deadlines,
+                (call.deadline, next(self.call_deadlines_seq), call))
+            if deadlines[0][2] is call and self.wakeup_pipe is not None:
+                # The dispatcher may be waiting past the new deadline.
+                try:
+                    os.write(self.wakeup_pipe[1], '\0')
+                except OSError as e:
+                    # A full pipe wakes the dispatcher up anyway.
+                    if e.errno != errno.EAGAIN:
+                        raise
+
+    def get_deadline_timeout(self, timeout=None):
+        '''
+        Returns timeout (seconds, None for no timeout) shortened to the
+        earliest call deadline.
+        '''
+        with self.deadlines_lock:
+            if not self.call_deadlines:
+                return timeout
+            delay = max(self.call_deadlines[0][0] - time.time(), 0)
+        return delay if timeout is None else min(timeout, delay)
+
+    def expire_calls(self):
+        '''
+        Cancels calls past their deadlines with CallTimeoutError, which
+        frees their in-flight slots.
+        '''
+        now = time.time()
+        expired = []
+        with self.deadlines_lock:
+            deadlines = self.call_deadlines
+            while deadlines and deadlines[0][0] <= now:
+                expired.append(heapq.heappop(deadlines)[2])
+        for call in expired:
+            if not call.done:
+                call.cancel(CallTimeoutError('Call timed out'))
+
+    def receive_message(self, timeout=None):
+        '''
+        Receives and decodes a message. Returns a channel ID and the message,
+        or None, if nothing arrived within timeout seconds.
+        '''
+        if timeout is not None and not self.ws.wait_readable(timeout):
+            return None
+
+        payload = self.ws.recv_payload()
+        channel_id, message = util.read_frame(payload)
+        if self.metrics is not None:
+            self.metrics.observe_frame(
+                channel_id, DIRECTION_IN, len(payload), self.client_id)
+        if self.tracer is not None:
+            self.tracer.trace(DIRECTION_IN, payload, message)
+        return channel_id, message
+
+    def observe_duration(self, operation, started):
+        '''
+        Reports a duration of operation started at started to the metrics.
+        '''
+        if self.metrics is not None:
+            self.metrics.observe_duration(operation, time.time() - started)
+
+    def route_message(self, channel_id, message):
+        '''
+        Routes a received decoded message. Control messages are passed to
+        handlers registered for their command. Other messages are passed to a
+        registered channel object. Messages nobody asked for are dropped.
+        '''
+        if channel_id in ('', '0'):
+            handlers = self.control_handlers.get(message.get('command'), ())
+            for handler in handlers:
+                handler(message)
+
+        channel = self.channels.get(channel_id)
+        if channel is not None:
+            channel.dispatch(message)
+
+    def start_dispatcher(self):
+        '''
+        Starts a background thread, which receives and routes all messages.
+        Channels are then served independently of each other. Nobody else may
+        call CockpitClient.receive_message() while the dispatcher runs.
+        '''
+        assert self.is_connected, 'connect() must precede a start_dispatcher()'
+
+        if self.dispatcher is not None and self.dispatcher.is_alive():
+            return
+
+        self.open_wakeup_pipe()
+        self.dispatcher = threading.Thread(
+            target=self.dispatch_loop,
+            name='cockpit-dispatcher')
+        self.dispatcher.daemon = True
+        self.dispatcher.start()
+
+    def dispatch_loop(self):
+        '''
+        Dispatcher thread body. Runs until the connection fails or is closed;
+        then CockpitClient.handle_connection_lost() is called. Errors of
+        message handlers are logged and don't stop the dispatching.
         '''
-        return self.ws.recv().split('\n', 1)
+        self.connection_error = None
+        wakeup_fd = self.wakeup_pipe[0]
+        try:
+            while True:
+                if self.ws.wait_readable(self.get_deadline_timeout(),
+                                         wakeup_fd):
+                    channel_id, message = self.receive_message()
+                    try:
+                        self.route_message(channel_id, message)
+                    except Exception:
+                        # A failing handler or listener spoils only its
+                        # message.
+                        logger.exception(
+                            'Error handling a message of channel %r',
+                            channel_id)
+                self.drain_wakeup_pipe()
+                try:
+                    self.expire_calls()
+                except Exception:
+                    logger.exception('Error cancelling expired calls')
+        except Exception as e:
+            # Pending calls fail with the error, which broke the connection.
+            self.connection_error = e
+        finally:
+            self.close_wakeup_pipe()
+            self.handle_connection_lost()
+
+    def open_wakeup_pipe(self):
+        with self.deadlines_lock:
+            if self.wakeup_pipe is None:
+                self.wakeup_pipe = os.pipe()
+                for fd in self.wakeup_pipe:
+                    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+                    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def drain_wakeup_pipe(self):
+        try:
+            os.read(self.wakeup_pipe[0], 4096)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close_wakeup_pipe(self):
+        with self.deadlines_lock:
+            if self.wakeup_pipe is not None:
+                for fd in self.wakeup_pipe:
+                    os.close(fd)
+                self.wakeup_pipe = None
+
+    def start_sender(self, high_watermark=1024, low_watermark=256,
+                     timeout=None):
+        '''
+        Starts a background thread, which writes all messages. Senders then
+        only append to a bounded SendQueue; see SendQueue for the watermarks
+        and timeout.
+        '''
+        assert self.is_connected, 'connect() must precede a start_sender()'
+
+        if self.sender is not None and self.sender.is_alive():
+            return
+
+        self.send_queue = flow.SendQueue(
+            high_watermark, low_watermark, timeout)
+        self.sender = threading.Thread(
+            target=self.send_loop,
+            args=(self.send_queue,),
+            name='cockpit-sender')
+        self.sender.daemon = True
+        self.sender.start()
+
+    def stop_sender(self):
+        '''
+        Stops the sender thread, once it has written the queued messages.
+        Messages are written directly again.
+        '''
+        if self.sender is None:
+            return
+
+        self.send_queue.close()
+        if self.sender is not threading.current_thread():
+            self.sender.join()
+        self.send_queue = None
+        self.sender = None
+
+    def send_loop(self, send_queue):
+        '''
+        Sender thread body. Writes queued frames in batches until the queue is
+        closed.
+        '''
+        while True:
+            frames = send_queue.get_many(SEND_BATCH_SIZE)
+            if not frames:
+                return
+            try:
+                with self.send_lock:
+                    self.ws.send_many(frames)
+            except Exception:
+                # A broken connection is reported by the receiving side; the
+                # frames can't be delivered anyway.
+                pass
+
+    def handle_connection_lost(self):
+        '''
+        Closes all the channels.
+        '''
+        if self.send_queue is not None:
+            self.send_queue.clear()
+        for channel in self.channels.values():
+            channel.closed('disconnected', self.connection_error)
+
+    def add_control_handler(self, command, handler):
+        '''
+        Registers a handler called with every decoded control message of the
+        command type.
+        '''
+        self.control_handlers.setdefault(command, []).append(handler)
+
+    def remove_control_handler(self, command, handler):
+        '''
+        Unregisters a control message handler.
+        '''
+        handlers = self.control_handlers.get(command, [])
+        if handler in handlers:
+            handlers.remove(handler)
+
+    def handle_close_message(self, message):
+        '''
+        Handles a close command sent by cockpit-ws for one of our channels.
+        '''
+        channel = self.channels.pop(message.get('channel'), None)
+        if channel is not None:
+            channel.closed(message.get('problem') or message.get('reason', ''))
+
+    def get_channel_queue(self, channel_id):
+        '''
+        Returns a queue receiving messages of channel_id, which has no channel
+        object registered. A QueueChannel is registered on the first use.
+        '''
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.register_channel(QueueChannel(self, channel_id))
+        return channel.queue
+
+    def recv_channel_message(self, channel_id, timeout=None):
+        '''
+        Receives a decoded message of a channel_id from its queue. Returns
+        None, when the channel or the connection has been closed.
+        '''
+        queue = self.get_channel_queue(channel_id)
+        if self.is_dispatching:
+            return queue.get(timeout=timeout)
+
+        while queue.empty():
+            self.process_message()
+        return queue.get_nowait()
+
+    def register_channel(self, channel):
+        '''
+        Registers a channel object, which will receive its messages from
+        CockpitClient.process_message().
+        '''
+        self.channels[channel.channel_id] = channel
+        return channel
+
+    def unregister_channel(self, channel_id):
+        '''
+        Unregisters a channel object.
+        '''
+        self.channels.pop(channel_id, None)
 
     def open_channel(self, *args, **kwargs):
         '''
@@ -218,8 +799,13 @@ class CockpitClient(object):
                              password=None, host=None, host_key=None,
                              **kwargs):
         '''
-        Opens a new channel with channel_id and payload_type.
+        Opens a new channel with channel_id and payload_type. Unless a channel
+        object is registered for channel_id already, a QueueChannel is, so no
+        message arriving before CockpitClient.recv_channel_message() is lost.
         '''
+        if channel_id not in self.channels:
+            self.register_channel(QueueChannel(self, channel_id))
+
         self.send_control_message(
             util.make_json(
                 command='open',
@@ -260,6 +846,30 @@ class CockpitClient(object):
 
         return channel_id
 
+    def open_dbus_channel(self, bus, service, max_in_flight=None, **kwargs):
+        '''
+        Opens a new dbus-json3 channel and returns a registered DBusChannel
+        object for it. At most max_in_flight calls wait for their replies at
+        once, if given (see DBusChannel.wait_in_flight()).
+        '''
+        channel = self.dbus_channel_class(self, self.get_next_channel_id())
+        channel.open_options = dict(kwargs, bus=bus, service=service)
+        channel.max_in_flight = max_in_flight
+
+        # The channel is registered first, so the dispatcher can't drop any
+        # message sent right after the open request.
+        self.register_channel(channel)
+        try:
+            self.open_channel_dbus_json3_with_id(
+                channel.channel_id,
+                bus=bus,
+                service=service,
+                **kwargs)
+        except:
+            self.unregister_channel(channel.channel_id)
+            raise
+        return channel
+
     def close_channel_with_id(self, channel_id, closing_reason=''):
         '''
         Closes a channel_id channel with closing_reason.
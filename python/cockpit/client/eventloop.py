@@ -0,0 +1,394 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Minimal single-threaded event loop with futures and generator based
+coroutines. One loop can drive any number of non-blocking connections.
+'''
+
+import collections
+import errno
+import fcntl
+import functools
+import heapq
+import itertools
+import os
+import select
+import threading
+import time
+import types
+
+# Poll event masks.
+EVENT_READ = select.POLLIN | select.POLLPRI
+EVENT_WRITE = select.POLLOUT
+EVENT_ERROR = select.POLLERR | select.POLLHUP | select.POLLNVAL
+
+
+class Return(Exception):
+    '''
+    Raised by a coroutine to return a value (generators can't return values
+    in Python 2).
+    '''
+
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+
+class Future(object):
+    '''
+    Result of an operation, which finishes later.
+    '''
+    __slots__ = ('callbacks', 'done', 'value', 'error')
+
+    def __init__(self):
+        self.callbacks = []
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def result(self):
+        '''
+        Returns the result or raises the exception of a finished future.
+        '''
+        assert self.done, 'future is not finished yet'
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def exception(self):
+        '''
+        Returns the exception of a finished future, or None.
+        '''
+        assert self.done, 'future is not finished yet'
+        return self.error
+
+    def set_result(self, value):
+        '''
+        Finishes the future with a value.
+        '''
+        self.value = value
+        self.finish()
+
+    def set_exception(self, error):
+        '''
+        Finishes the future with an exception.
+        '''
+        self.error = error
+        self.finish()
+
+    def finish(self):
+        assert not self.done, 'future is already finished'
+        self.done = True
+        callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        '''
+        Calls callback with the future, when it's finished. Finished futures
+        call it immediately.
+        '''
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+
+class Task(object):
+    '''
+    Drives a generator, which yields futures. The result of each future is
+    sent back into the generator.
+    '''
+
+    def __init__(self, gen, future):
+        self.gen = gen
+        self.future = future
+
+    def step(self, value=None, error=None):
+        while True:
+            try:
+                if error is not None:
+                    yielded = self.gen.throw(error)
+                else:
+                    yielded = self.gen.send(value)
+            except Return as e:
+                self.future.set_result(e.value)
+                return
+            except StopIteration:
+                self.future.set_result(None)
+                return
+            except Exception as e:
+                self.future.set_exception(e)
+                return
+
+            if not yielded.done:
+                yielded.add_done_callback(self.wakeup)
+                return
+
+            # Finished futures are resumed in a loop, not recursively.
+            value, error = yielded.value, yielded.error
+
+    def wakeup(self, future):
+        self.step(future.value, future.error)
+
+
+def coroutine(func):
+    '''
+    Decorator turning a generator function into a function returning a
+    Future. The generator yields futures and raises Return with its result.
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        future = Future()
+        try:
+            result = func(*args, **kwargs)
+        except Return as e:
+            future.set_result(e.value)
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            if isinstance(result, types.GeneratorType):
+                Task(result, future).step()
+            else:
+                future.set_result(result)
+        return future
+    return wrapper
+
+
+def gather(futures):
+    '''
+    Returns a Future of a list of results of futures. Fails with the first
+    exception.
+    '''
+    futures = list(futures)
+    gathered = Future()
+    remaining = [len(futures)]
+
+    def finished(future):
+        if gathered.done:
+            return
+        if future.error is not None:
+            gathered.set_exception(future.error)
+            return
+        remaining[0] -= 1
+        if not remaining[0]:
+            gathered.set_result([f.value for f in futures])
+
+    if not futures:
+        gathered.set_result([])
+    for future in futures:
+        future.add_done_callback(finished)
+
+    return gathered
+
+
+class Timer(object):
+    '''
+    Scheduled callback. See EventLoop.call_later().
+    '''
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Waker(object):
+    '''
+    Pipe, which wakes up an EventLoop waiting in poll(). See
+    EventLoop.call_soon_threadsafe().
+    '''
+
+    def __init__(self):
+        self.fds = os.pipe()
+        for fd in self.fds:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def wake(self):
+        try:
+            os.write(self.fds[1], '\0')
+        except OSError as e:
+            # A full pipe wakes the loop up anyway.
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def handle_events(self, events):
+        try:
+            os.read(self.fds[0], 4096)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def close(self):
+        for fd in self.fds:
+            os.close(fd)
+
+
+class EventLoop(object):
+    '''
+    poll() based event loop. Registered handlers get handle_events(events)
+    called with poll events of their file descriptors.
+    '''
+
+    def __init__(self):
+        self.handlers = {}
+        self.poller = select.poll()
+        self.ready = collections.deque()
+        self.running = False
+        self.timer_seq = itertools.count()
+        self.timers = []
+        self.waker = Waker()
+        self.register(self.waker.fds[0], self.waker, EVENT_READ)
+
+    def register(self, fd, handler, events):
+        '''
+        Starts watching fd for events.
+        '''
+        self.handlers[fd] = handler
+        self.poller.register(fd, events)
+
+    def modify(self, fd, events):
+        '''
+        Changes events watched on fd.
+        '''
+        self.poller.modify(fd, events)
+
+    def unregister(self, fd):
+        '''
+        Stops watching fd.
+        '''
+        if self.handlers.pop(fd, None) is not None:
+            self.poller.unregister(fd)
+
+    def call_soon(self, callback, *args):
+        '''
+        Calls callback with args in the next loop iteration.
+        '''
+        self.ready.append((callback, args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        '''
+        Like EventLoop.call_soon(), but may be called from other threads. The
+        loop is woken up, if it's waiting for events.
+        '''
+        self.ready.append((callback, args))
+        self.waker.wake()
+
+    def run_in_thread(self, func, *args):
+        '''
+        Calls func with args in a new thread, so a blocking call (e.g.
+        socket.getaddrinfo()) doesn't stall the loop. Returns a Future of its
+        result, which is finished in the loop.
+        '''
+        future = Future()
+
+        def run():
+            try:
+                result = func(*args)
+            except Exception as e:
+                self.call_soon_threadsafe(future.set_exception, e)
+            else:
+                self.call_soon_threadsafe(future.set_result, result)
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def call_later(self, delay, callback, *args):
+        '''
+        Calls callback with args after delay seconds. Returns a Timer object,
+        which can be cancelled.
+        '''
+        timer = Timer(time.time() + delay, callback, args)
+        heapq.heappush(
+            self.timers,
+            (timer.deadline, next(self.timer_seq), timer))
+        return timer
+
+    def run_once(self, timeout=None):
+        '''
+        Waits for events at most timeout seconds and handles them together
+        with due timers and ready callbacks.
+        '''
+        if self.ready:
+            timeout = 0
+        elif self.timers:
+            delay = max(self.timers[0][0] - time.time(), 0)
+            timeout = delay if timeout is None else min(timeout, delay)
+
+        poll_timeout = -1 if timeout is None else int(timeout * 1000)
+        for fd, events in self.poller.poll(poll_timeout):
+            handler = self.handlers.get(fd)
+            if handler is not None:
+                handler.handle_events(events)
+
+        now = time.time()
+        while self.timers and self.timers[0][0] <= now:
+            timer = heapq.heappop(self.timers)[2]
+            if not timer.cancelled:
+                self.ready.append((timer.callback, timer.args))
+
+        for _ in xrange(len(self.ready)):
+            callback, args = self.ready.popleft()
+            callback(*args)
+
+    def run_until_complete(self, future):
+        '''
+        Runs the loop until future is finished. Returns its result.
+        '''
+        while not future.done:
+            self.run_once()
+        return future.result()
+
+    def run_forever(self):
+        '''
+        Runs the loop until EventLoop.stop() is called.
+        '''
+        self.running = True
+        while self.running:
+            self.run_once()
+
+    def stop(self):
+        '''
+        Stops EventLoop.run_forever().
+        '''
+        self.running = False
+
+    def close(self):
+        '''
+        Releases the wakeup pipe. The loop can't be used afterwards.
+        '''
+        self.unregister(self.waker.fds[0])
+        self.waker.close()
+
+
+def get_event_loop():
+    '''
+    Returns a default event loop.
+    '''
+    if not hasattr(get_event_loop, 'loop'):
+        get_event_loop.loop = EventLoop()
+    return get_event_loop.loop
@@ -0,0 +1,123 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Flow control of outgoing Cockpit messages.
+'''
+
+import threading
+import time
+from collections import deque
+
+
+class FlowControlError(Exception):
+    '''
+    Raised, when a send queue or a channel stays saturated for too long.
+    '''
+
+
+def get_remaining(deadline):
+    '''
+    Returns seconds left until deadline (None for no deadline). Raises
+    FlowControlError, if the deadline passed.
+    '''
+    if deadline is None:
+        return None
+    remaining = deadline - time.time()
+    if remaining <= 0:
+        raise FlowControlError('Timed out waiting for a free slot')
+    return remaining
+
+
+class SendQueue(object):
+    '''
+    Bounded queue of encoded frames waiting for a sender thread. When it holds
+    high_watermark frames, it's saturated, until the sender drains it down to
+    low_watermark. Putting into a saturated queue waits up to timeout seconds
+    (forever, if None; not at all, if 0) and then raises FlowControlError.
+    '''
+
+    def __init__(self, high_watermark=1024, low_watermark=256, timeout=None):
+        assert low_watermark < high_watermark, \
+            'low_watermark must be lower than high_watermark'
+        self.closed = False
+        self.cond = threading.Condition()
+        self.frames = deque()
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.max_depth = 0
+        self.saturated = False
+        self.timeout = timeout
+
+    def __len__(self):
+        return len(self.frames)
+
+    def put_many(self, frames):
+        '''
+        Appends frames at once, so they're sent in one write, if possible.
+        '''
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+
+        with self.cond:
+            while self.saturated and not self.closed:
+                self.cond.wait(get_remaining(deadline))
+            if self.closed:
+                raise FlowControlError('Send queue is closed')
+
+            self.frames.extend(frames)
+            depth = len(self.frames)
+            if depth >= self.high_watermark:
+                self.saturated = True
+            self.max_depth = max(self.max_depth, depth)
+            self.cond.notify_all()
+
+    def get_many(self, max_count):
+        '''
+        Waits for frames and removes up to max_count of them. Returns an empty
+        list, when the queue is closed and empty.
+        '''
+        with self.cond:
+            while not self.frames and not self.closed:
+                self.cond.wait()
+
+            count = min(max_count, len(self.frames))
+            frames = [self.frames.popleft() for _ in xrange(count)]
+            if self.saturated and len(self.frames) <= self.low_watermark:
+                self.saturated = False
+                self.cond.notify_all()
+            return frames
+
+    def clear(self):
+        '''
+        Drops all the queued frames, e.g. when the connection is lost.
+        '''
+        with self.cond:
+            self.frames.clear()
+            self.saturated = False
+            self.cond.notify_all()
+
+    def close(self):
+        '''
+        Closes the queue. The sender still gets the frames queued so far.
+        '''
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
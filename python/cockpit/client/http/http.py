@@ -45,6 +45,12 @@ CRLF = '\r\n'
 # RFC 2616 doesn't define chunk size limit. Let's pick one.
 CHUNK_MAX = 4 * 1024
 
+# Size of blocks read by HTTPReader.
+READ_BLOCK_SIZE = 64 * 1024
+
+# Maximum size of data joined into one write by HTTPSender.
+WRITE_BUFFER_MAX = 64 * 1024
+
 
 class HTTPError(Exception):
     '''
@@ -53,6 +59,8 @@ class HTTPError(Exception):
 
 
 class HTTPInitialLine(object):
+    __slots__ = ('http_version',)
+
     def __init__(self, http_version):
         self.http_version = http_version
 
@@ -61,6 +69,8 @@ class HTTPRequestLine(HTTPInitialLine):
     '''
     HTTP request line object.
     '''
+    __slots__ = ('method', 'uri')
+
     def __init__(self, method, uri, http_version):
         super(HTTPRequestLine, self).__init__(http_version)
         self.method = method
@@ -74,6 +84,8 @@ class HTTPResponseLine(HTTPInitialLine):
     '''
     HTTP respone line object.
     '''
+    __slots__ = ('status_code', 'reason_phrase')
+
     def __init__(self, http_version, status_code, reason_phrase=''):
         super(HTTPResponseLine, self).__init__(http_version)
         self.status_code = status_code
@@ -91,12 +103,16 @@ class HTTPResponseLine(HTTPInitialLine):
 
 class HTTPMessage(object):
     '''
-    HTTP message class.
+    HTTP message class. An OrderedDict of headers is used as is, other
+    mappings are copied.
     '''
+    __slots__ = ('init_line', 'headers', 'body')
 
     def __init__(self, init_line, headers=None, body=None):
+        if not isinstance(headers, OrderedDict):
+            headers = OrderedDict(headers or {})
         self.init_line = init_line
-        self.headers = OrderedDict(headers or {})
+        self.headers = headers
         self.body = body or ''
 
     def __getitem__(self, name):
@@ -128,20 +144,33 @@ class HTTPMessage(object):
 
 class HTTPSender(object):
     '''
-    Helper class for HTTP message sending
+    Helper class for HTTP message sending. Data is collected and written by
+    HTTPSender.flush(): small pieces are joined into few writes, large body
+    pieces are written to sockets as memoryview slices without copying.
     '''
 
-    def __init__(self, message, wfile):
+    def __init__(self, message, wfile, chunk_size=CHUNK_MAX):
         self.message = message
+        self.chunk_size = chunk_size
+        self.parts = []
 
         if isinstance(wfile, socket.socket):
-            self.wfile = wfile.makefile()
+            self.write = wfile.sendall
         else:
-            self.wfile = wfile
+            self.write = self.write_file
+        self.wfile = wfile
 
-    def send_data(self, data):
+    def write_file(self, data):
+        '''
+        Writes data to a file object, which may not accept memoryviews.
+        '''
+        if isinstance(data, memoryview):
+            data = data.tobytes()
         self.wfile.write(data)
 
+    def send_data(self, data):
+        self.parts.append(data)
+
     def send_crlf(self):
         '''
         Sends CRLF symbols.
@@ -152,29 +181,25 @@ class HTTPSender(object):
         '''
         Sends a one chunk of the message.
         '''
-        self.send_data('%x' % len(chunk))
-        self.send_data(CRLF)
-        self.send_data(chunk)
+        self.send_data('%x%s' % (len(chunk), CRLF))
+        if chunk:
+            self.send_data(chunk)
         self.send_data(CRLF)
 
     def send_message_body(self):
         '''
         Sends a response body.
         '''
+        body = self.message.body
         if not self.message.is_chunked or \
                 self.message.http_version != HTTP_1_1:
-            self.send_data(self.message.body)
+            if body:
+                self.send_data(body)
         else:
-            pos = 0
-            msg_len = len(self.message.body)
-            while pos < msg_len:
-                if msg_len - pos >= CHUNK_MAX:
-                    to_send = CHUNK_MAX
-                else:
-                    to_send = msg_len - pos
+            view = memoryview(body)
+            for pos in xrange(0, len(body), self.chunk_size):
                 # Send a chunk of data.
-                self.send_chunk(self.message.body[pos:pos+to_send])
-                pos += to_send
+                self.send_chunk(view[pos:pos + self.chunk_size])
 
             # Terminating chunk
             self.send_chunk()
@@ -185,8 +210,7 @@ class HTTPSender(object):
         '''
         if self.message.http_version == HTTP_0_9:
             return
-        self.send_data('%s: %s' % (name, value))
-        self.send_crlf()
+        self.send_data('%s: %s%s' % (name, value, CRLF))
 
     def send_end_headers(self):
         '''
@@ -208,8 +232,54 @@ class HTTPSender(object):
         '''
         Sends a HTTP response status line.
         '''
-        self.send_data(str(self.message.init_line))
-        self.send_crlf()
+        self.send_data('%s%s' % (self.message.init_line, CRLF))
+
+    def flush(self):
+        '''
+        Writes collected data. Pieces smaller than WRITE_BUFFER_MAX are joined
+        into writes of up to WRITE_BUFFER_MAX bytes; larger pieces are written
+        straight from their buffers.
+        '''
+        parts, self.parts = self.parts, []
+        small = []
+        small_len = 0
+        for part in parts:
+            if len(part) >= WRITE_BUFFER_MAX:
+                self.write_joined(small, small_len)
+                small = []
+                small_len = 0
+                self.write(part)
+                continue
+            small.append(part)
+            small_len += len(part)
+            if small_len >= WRITE_BUFFER_MAX:
+                self.write_joined(small, small_len)
+                small = []
+                small_len = 0
+        self.write_joined(small, small_len)
+
+        if hasattr(self.wfile, 'flush'):
+            self.wfile.flush()
+
+    def write_joined(self, parts, size):
+        '''
+        Writes parts of size bytes in total with one write. Python 2 sockets
+        have no sendmsg(), so several parts are copied once into a single
+        buffer; a lone part is written straight from its buffer.
+        '''
+        if len(parts) == 1:
+            self.write(parts[0])
+        elif parts:
+            data = bytearray(size)
+            pos = 0
+            for part in parts:
+                if isinstance(part, unicode):
+                    # Header values may be unicode; str.join() would encode
+                    # them the same way.
+                    part = part.encode('ascii')
+                data[pos:pos + len(part)] = part
+                pos += len(part)
+            self.write(data)
 
     def send(self):
         '''
@@ -218,13 +288,15 @@ class HTTPSender(object):
         self.send_message_init_line()
         self.send_message_headers()
         self.send_message_body()
+        self.flush()
 
 
 class HTTPReader(object):
     '''
-    HTTP message reader.
+    HTTP message reader. Bodies larger than max_body_size bytes are refused.
     '''
-    def __init__(self, rfile):
+    def __init__(self, rfile, max_body_size=None):
+        self.max_body_size = max_body_size
         if isinstance(rfile, socket.socket):
             self.rfile = rfile.makefile()
         else:
@@ -262,12 +334,12 @@ class HTTPReader(object):
 
     def recv_headers(self):
         '''
-        Reads HTTP headers. Returns a dict containing those headers.
+        Reads HTTP headers. Returns an OrderedDict containing those headers.
         '''
         def get_next_header_line():
             return self.recv_data_line().rstrip(CRLF)
 
-        headers = {}
+        headers = OrderedDict()
         while True:
             header_line = get_next_header_line()
             if not header_line:
@@ -278,61 +350,206 @@ class HTTPReader(object):
 
         return headers
 
-    def recv_body_chunked(self):
+    def iter_body_chunked(self):
         '''
-        Reads a chunked HTTP body.
+        Yields chunks of a chunked HTTP body.
         '''
-        def get_next_chunk():
-            chunk_size = int(self.recv_data_line().rstrip(CRLF), base=16)
-            chunk = self.recv_data(chunk_size)
+        while True:
+            chunk_line = self.recv_data_line()
+            if not chunk_line:
+                raise HTTPError(-1, 'Truncated chunked body')
+            # Chunk extensions are ignored.
+            chunk_size = int(chunk_line.split(';', 1)[0].strip(), base=16)
+            if not chunk_size:
+                break
+            for block in self.iter_data(chunk_size):
+                yield block
             self.recv_data(2)  # Read the last CRLF before next chunk.
-            return chunk
 
-        message = ''
+        # Skip trailer headers up to the terminating empty line.
+        while self.recv_data_line().rstrip(CRLF):
+            pass
+
+    def iter_data(self, length):
+        '''
+        Yields exactly length bytes in blocks of at most READ_BLOCK_SIZE.
+        '''
+        while length > 0:
+            block = self.recv_data(min(length, READ_BLOCK_SIZE))
+            if not block:
+                raise HTTPError(-1, 'Truncated body')
+            length -= len(block)
+            yield block
+
+    def iter_data_until_eof(self):
+        '''
+        Yields blocks of data until the connection is closed.
+        '''
         while True:
-            buf = get_next_chunk()
-            if not buf:
+            block = self.recv_data(READ_BLOCK_SIZE)
+            if not block:
                 break
-            message += buf
-
-        return message
+            yield block
 
-    def recv_body(self, headers):
+    def iter_body(self, headers, init_line=None):
         '''
-        Reads a HTTP body.
+        Yields blocks of a HTTP body, so large bodies can be consumed
+        incrementally. Raises HTTPError, when the body exceeds max_body_size.
         '''
-        content_length = int(headers.get(HEADER_NAME_CONTENT_LENGTH, '0'))
-        chunked = is_chunked(headers)
+        content_length = get_content_length(headers)
 
-        if content_length:
-            return self.rfile.read(content_length)
-        elif chunked:
-            return self.recv_body_chunked()
+        if content_length is not None:
+            blocks = self.iter_data(content_length)
+        elif is_chunked(headers):
+            blocks = self.iter_body_chunked()
+        elif isinstance(init_line, HTTPResponseLine) and \
+                init_line.status_code >= 200 and \
+                init_line.status_code not in (204, 304):
+            # A response without a length is delimited by closing.
+            blocks = self.iter_data_until_eof()
         else:
-            block_size = 1024
-            def get_next_block():
-                return self.rfile.read(block_size)
+            # A request without a length has no body.
+            blocks = ()
+
+        received = 0
+        for block in blocks:
+            received += len(block)
+            if self.max_body_size is not None and \
+                    received > self.max_body_size:
+                raise HTTPError(-1, 'HTTP body exceeds %d bytes' %
+                                self.max_body_size)
+            yield block
+
+    def recv_body_chunked(self):
+        '''
+        Reads a chunked HTTP body.
+        '''
+        return ''.join(self.iter_body_chunked())
 
-            message = ''
-            while True:
-                buf = get_next_block()
-                if len(buf) != block_size:
-                    break
-                message += buf
+    def recv_body(self, headers, init_line=None):
+        '''
+        Reads a HTTP body.
+        '''
+        return ''.join(self.iter_body(headers, init_line))
 
-        return message
+    def recv_head(self):
+        '''
+        Reads a initial line and headers of a HTTP message. The body can be
+        read then by HTTPReader.iter_body() or HTTPReader.recv_body().
+        '''
+        init_line = self.recv_init_line()
+        headers = self.recv_headers()
+        return init_line, headers
 
     def recv(self):
         '''
         Reads a HTTP message and returns a HTTPMessage object.
         '''
-        init_line = self.recv_init_line()
-        headers = self.recv_headers()
-        body = self.recv_body(headers)
+        init_line, headers = self.recv_head()
+        body = self.recv_body(headers, init_line)
 
         return HTTPMessage(init_line, headers, body)
 
 
+class BufferedSocketReader(object):
+    '''
+    File-like buffered reader of a socket. Unlike socket.makefile(), data read
+    ahead can be taken out by BufferedSocketReader.detach().
+    '''
+
+    def __init__(self, sock, bufsize=READ_BLOCK_SIZE):
+        self.sock = sock
+        self.bufsize = bufsize
+        self.buf = bytearray()
+        # Offset of unread data in buf. Data read already is dropped only
+        # when it's at least half of buf, so reads don't move data left
+        # every time.
+        self.pos = 0
+
+    def fill(self):
+        '''
+        Receives more data into the buffer. Returns False on EOF.
+        '''
+        data = self.sock.recv(self.bufsize)
+        if self.pos and self.pos * 2 >= len(self.buf):
+            del self.buf[:self.pos]
+            self.pos = 0
+        self.buf += data
+        return bool(data)
+
+    def read(self, length):
+        '''
+        Reads length bytes; less only on EOF.
+        '''
+        while len(self.buf) - self.pos < length and self.fill():
+            pass
+        data = str(self.buf[self.pos:self.pos + length])
+        self.pos += len(data)
+        return data
+
+    def readline(self):
+        '''
+        Reads a line including the line terminator.
+        '''
+        # Length of unread data searched already.
+        searched = 0
+        while True:
+            pos = self.buf.find('\n', self.pos + searched)
+            if pos >= 0:
+                return self.read(pos + 1 - self.pos)
+            searched = len(self.buf) - self.pos
+            if not self.fill():
+                return self.read(searched)
+
+    def detach(self):
+        '''
+        Returns data read ahead and empties the buffer.
+        '''
+        data = str(self.buf[self.pos:])
+        self.buf = bytearray()
+        self.pos = 0
+        return data
+
+
+class HTTPConnection(object):
+    '''
+    Persistent HTTP/1.1 connection. One buffered reader is used for the
+    whole lifetime of the socket, so several request/response exchanges and
+    a final protocol upgrade don't lose any data read ahead.
+    '''
+
+    def __init__(self, sock, max_body_size=None):
+        self.sock = sock
+        self.rfile = BufferedSocketReader(sock)
+        self.reader = HTTPReader(self.rfile, max_body_size)
+
+    def send(self, message):
+        '''
+        Sends a HTTP message.
+        '''
+        send_message(message, self.sock)
+
+    def recv(self):
+        '''
+        Receives a HTTP message.
+        '''
+        return self.reader.recv()
+
+    def request(self, message):
+        '''
+        Sends a request and returns the response HTTPMessage.
+        '''
+        self.send(message)
+        return self.recv()
+
+    def detach(self):
+        '''
+        Ends HTTP use of the socket (e.g. after an upgrade). Returns data
+        received after the last response.
+        '''
+        return self.rfile.detach()
+
+
 def parse_url(url):
     '''
     Returns a tuple containing scheme, hostname, port, resource and boolean
@@ -376,6 +593,17 @@ def parse_url(url):
     return scheme, hostname, port, resource, is_secure
 
 
+def get_content_length(headers):
+    '''
+    Returns a value of Content-Length header, or None.
+    '''
+    value = headers.get(HEADER_NAME_CONTENT_LENGTH,
+                        headers.get(HEADER_NAME_CONTENT_LENGTH.lower()))
+    if value is None:
+        return None
+    return int(value)
+
+
 def is_chunked(headers):
     return headers.get(
         HEADER_NAME_TRANSFER_ENCODING) == \
@@ -394,20 +622,20 @@ def is_success(message):
     return status_code >= 200 and status_code < 300
 
 
-def send_message(message, wfile):
+def send_message(message, wfile, chunk_size=CHUNK_MAX):
     '''
-    Sends a HTTP message.
+    Sends a HTTP message. Chunked bodies are split into chunk_size chunks.
     '''
-    sender = HTTPSender(message, wfile)
+    sender = HTTPSender(message, wfile, chunk_size)
     sender.send()
 
 
 
-def recv_message(rfile):
+def recv_message(rfile, max_body_size=None):
     '''
     Receives a HTTP message.
     '''
-    reader = HTTPReader(rfile)
+    reader = HTTPReader(rfile, max_body_size)
     return reader.recv()
 
 
@@ -0,0 +1,315 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Metrics of Cockpit clients: call latencies, traffic, connection setup
+durations and queue depths.
+'''
+
+import bisect
+import re
+import socket
+import threading
+import time
+
+
+# Upper bounds (in seconds) of latency histogram buckets.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+DIRECTION_IN = 'in'
+DIRECTION_OUT = 'out'
+
+
+class MetricsHooks(object):
+    '''
+    Receiver of client metrics. All the hooks do nothing; subclasses override
+    those they're interested in. Hooks are called from any client thread.
+    '''
+
+    def observe_call(self, interface, method, seconds, failed):
+        '''
+        Reports a finished D-Bus call, which took seconds. Failed is True for
+        errors and cancelled calls.
+        '''
+
+    def observe_frame(self, channel_id, direction, size, client_id=None):
+        '''
+        Reports a frame of size bytes sent (DIRECTION_OUT) or received
+        (DIRECTION_IN) via channel_id of a client. Channel IDs are unique
+        only within a client, see CockpitClient.client_id.
+        '''
+
+    def observe_duration(self, operation, seconds):
+        '''
+        Reports a duration of a connection setup operation (connect, login,
+        handshake).
+        '''
+
+    def add_gauge(self, name, labels, callback):
+        '''
+        Registers a callable returning a current value of a gauge (e.g. a
+        queue depth), which is read on export.
+        '''
+
+    def remove_gauge(self, name, labels):
+        '''
+        Unregisters a gauge added by MetricsHooks.add_gauge().
+        '''
+
+
+class Histogram(object):
+    '''
+    Histogram of observed values with fixed bucket upper bounds.
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def iter_cumulative(self):
+        '''
+        Yields (upper bound, cumulative count) pairs; the last bound is
+        float('inf').
+        '''
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsCollector(MetricsHooks):
+    '''
+    In-memory collector of client metrics. It only updates counters and
+    histograms, so it's cheap enough to stay enabled. See format_prometheus().
+    '''
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.bytes = {}
+        self.call_errors = {}
+        self.calls = {}
+        self.durations = {}
+        self.frames = {DIRECTION_IN: 0, DIRECTION_OUT: 0}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def observe_call(self, interface, method, seconds, failed):
+        key = (interface, method)
+        with self.lock:
+            histogram = self.calls.get(key)
+            if histogram is None:
+                histogram = self.calls[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+            if failed:
+                self.call_errors[key] = self.call_errors.get(key, 0) + 1
+
+    def observe_frame(self, channel_id, direction, size, client_id=None):
+        key = (client_id, channel_id or 'control', direction)
+        with self.lock:
+            self.bytes[key] = self.bytes.get(key, 0) + size
+            self.frames[direction] += 1
+
+    def observe_duration(self, operation, seconds):
+        with self.lock:
+            histogram = self.durations.get(operation)
+            if histogram is None:
+                histogram = self.durations[operation] = \
+                    Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def add_gauge(self, name, labels, callback):
+        self.gauges[(name, tuple(sorted(labels.items())))] = callback
+
+    def remove_gauge(self, name, labels):
+        self.gauges.pop((name, tuple(sorted(labels.items()))), None)
+
+    def frames_per_second(self, direction=DIRECTION_IN):
+        '''
+        Returns an average rate of frames in direction since the collector
+        was created.
+        '''
+        return self.frames[direction] / max(time.time() - self.started, 1e-9)
+
+    def read_gauges(self):
+        '''
+        Returns a list of (name, labels, value) of all the gauges.
+        '''
+        return [(name, labels, callback())
+                for (name, labels), callback in sorted(self.gauges.items())]
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (
+            name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels)
+
+
+def format_histogram(lines, name, labels, histogram):
+    for bound, count in histogram.iter_cumulative():
+        le = '+Inf' if bound == float('inf') else repr(bound)
+        lines.append('%s_bucket%s %d' % (
+            name, format_labels(labels + (('le', le),)), count))
+    lines.append('%s_sum%s %r' % (name, format_labels(labels), histogram.sum))
+    lines.append('%s_count%s %d' % (
+        name, format_labels(labels), histogram.count))
+
+
+def format_prometheus(collector, prefix='cockpit'):
+    '''
+    Returns metrics of a MetricsCollector in the Prometheus text exposition
+    format.
+    '''
+    lines = []
+    with collector.lock:
+        lines.append('# TYPE %s_call_duration_seconds histogram' % prefix)
+        for (interface, method), histogram in sorted(collector.calls.items()):
+            format_histogram(
+                lines, '%s_call_duration_seconds' % prefix,
+                (('interface', interface), ('method', method)), histogram)
+
+        lines.append('# TYPE %s_call_errors_total counter' % prefix)
+        for (interface, method), count in sorted(
+                collector.call_errors.items()):
+            lines.append('%s_call_errors_total%s %d' % (
+                prefix,
+                format_labels((('interface', interface), ('method', method))),
+                count))
+
+        lines.append('# TYPE %s_bytes_total counter' % prefix)
+        for (client_id, channel_id, direction), count in \
+                sorted(collector.bytes.items()):
+            labels = (('channel', channel_id), ('direction', direction))
+            if client_id is not None:
+                labels = (('client', client_id),) + labels
+            lines.append('%s_bytes_total%s %d' % (
+                prefix, format_labels(labels), count))
+
+        lines.append('# TYPE %s_frames_total counter' % prefix)
+        for direction, count in sorted(collector.frames.items()):
+            lines.append('%s_frames_total%s %d' % (
+                prefix, format_labels((('direction', direction),)), count))
+
+        lines.append('# TYPE %s_operation_duration_seconds histogram' % prefix)
+        for operation, histogram in sorted(collector.durations.items()):
+            format_histogram(
+                lines, '%s_operation_duration_seconds' % prefix,
+                (('operation', operation),), histogram)
+
+    last_name = None
+    for name, labels, value in collector.read_gauges():
+        if name != last_name:
+            lines.append('# TYPE %s_%s gauge' % (prefix, name))
+            last_name = name
+        lines.append('%s_%s%s %r' % (
+            prefix, name, format_labels(labels), value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def make_statsd_name(*parts):
+    return '.'.join(re.sub(r'[^\w-]', '_', str(part)) for part in parts)
+
+
+class StatsdExporter(MetricsHooks):
+    '''
+    MetricsHooks sending metrics to a statsd daemon over UDP. Lines are
+    batched into datagrams of at most max_packet bytes; gauges are sent by
+    StatsdExporter.flush(), which should be called periodically.
+    '''
+
+    def __init__(self, address=('127.0.0.1', 8125), prefix='cockpit',
+                 max_packet=1432):
+        self.address = address
+        self.buffer = []
+        self.buffer_size = 0
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.max_packet = max_packet
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setblocking(False)
+
+    def observe_call(self, interface, method, seconds, failed):
+        name = make_statsd_name(self.prefix, 'call', interface, method)
+        self.write('%s:%.3f|ms' % (name, seconds * 1000))
+        if failed:
+            self.write('%s.errors:1|c' % name)
+
+    def observe_frame(self, channel_id, direction, size, client_id=None):
+        parts = [self.prefix]
+        if client_id is not None:
+            parts.extend(('client', client_id))
+        parts.extend(('channel', channel_id or 'control', direction))
+        name = make_statsd_name(*parts)
+        self.write('%s.frames:1|c' % name)
+        self.write('%s.bytes:%d|c' % (name, size))
+
+    def observe_duration(self, operation, seconds):
+        self.write('%s:%.3f|ms' % (
+            make_statsd_name(self.prefix, operation), seconds * 1000))
+
+    def add_gauge(self, name, labels, callback):
+        self.gauges[self.make_gauge_name(name, labels)] = callback
+
+    def remove_gauge(self, name, labels):
+        self.gauges.pop(self.make_gauge_name(name, labels), None)
+
+    def make_gauge_name(self, name, labels):
+        parts = [self.prefix, name]
+        parts.extend(value for _, value in sorted(labels.items()))
+        return make_statsd_name(*parts)
+
+    def write(self, line):
+        with self.lock:
+            if self.buffer_size + len(line) + 1 > self.max_packet:
+                self.send_buffer()
+            self.buffer.append(line)
+            self.buffer_size += len(line) + 1
+
+    def send_buffer(self):
+        if not self.buffer:
+            return
+        try:
+            self.sock.sendto('\n'.join(self.buffer), self.address)
+        except socket.error:
+            # Metrics are best effort; never slow down or break the client.
+            pass
+        self.buffer = []
+        self.buffer_size = 0
+
+    def flush(self):
+        '''
+        Sends gauges and all the buffered lines.
+        '''
+        for name, callback in self.gauges.items():
+            self.write('%s:%r|g' % (name, callback()))
+        with self.lock:
+            self.send_buffer()
@@ -0,0 +1,231 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from cockpit.client.client import CockpitClient
+from cockpit.client.client import CockpitError
+
+
+class PoolError(CockpitError):
+    '''
+    CockpitClientPool exception class.
+    '''
+
+
+class PooledClient(object):
+    '''
+    CockpitClientPool entry. Only a salted digest of the password is kept.
+    '''
+
+    def __init__(self, client, password):
+        self.client = client
+        self.salt = os.urandom(16)
+        self.digest = self.get_digest(password)
+        self.last_used = time.time()
+        # Number of get_client() callers, which haven't released it yet.
+        self.leases = 0
+
+    def get_digest(self, password):
+        '''
+        Returns a salted digest of a (byte or unicode) password.
+        '''
+        if isinstance(password, unicode):
+            password = password.encode('utf8')
+        return hmac.new(self.salt, password, hashlib.sha256).digest()
+
+    def check_password(self, password):
+        '''
+        Returns True, if password matches the one the client logged in with.
+        '''
+        return hmac.compare_digest(self.digest, self.get_digest(password))
+
+    @property
+    def is_idle(self):
+        '''
+        Returns True, if the client is not leased and no channel is opened on
+        it.
+        '''
+        return not self.leases and not self.client.channels
+
+
+class CockpitClientPool(object):
+    '''
+    Pool of connected and logged in CockpitClient objects keyed by (url,
+    username). Channels opened by several users share one session and one
+    socket; each pooled client runs a dispatcher thread.
+    '''
+
+    def __init__(self, max_size=16, idle_timeout=300, no_verification=False,
+                 debug=False, session_store=None, metrics=None, tracer=None):
+        self.debug = debug
+        self.entries = OrderedDict()
+        self.idle_timeout = idle_timeout
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.metrics = metrics
+        self.no_verification = no_verification
+        self.retired = []
+        self.session_store = session_store
+        self.tracer = tracer
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_client(self, url, username, password):
+        '''
+        Returns a connected CockpitClient for url and username. A pooled
+        session is reused, if it's healthy and the password matches; a new
+        one is connected otherwise. The client is leased to the caller and
+        not evicted until it's given back by release().
+        '''
+        key = (url, username)
+
+        self.evict_idle()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.check_password(password) and \
+                    self.is_healthy(entry.client):
+                entry.last_used = time.time()
+                entry.leases += 1
+                self.entries[key] = self.entries.pop(key)
+                return entry.client
+
+        # Connect outside of the lock, so sessions to different hosts are
+        # established concurrently.
+        client = CockpitClient(
+            url, self.no_verification, self.debug, self.session_store,
+            self.metrics, self.tracer)
+        client.connect(username, password)
+        client.start_dispatcher()
+
+        try:
+            with self.lock:
+                old_entry = self.entries.pop(key, None)
+                if old_entry is not None:
+                    self.retired.append(old_entry)
+                if len(self.entries) >= self.max_size:
+                    self.evict_lru()
+                entry = PooledClient(client, password)
+                entry.leases += 1
+                self.entries[key] = entry
+        except PoolError:
+            disconnect_quietly(client)
+            raise
+
+        self.evict_idle()
+
+        return client
+
+    def open_dbus_channel(self, url, username, password, bus, service,
+                          **kwargs):
+        '''
+        Opens a new dbus-json3 channel on a pooled client. Returns a
+        DBusChannel object.
+        '''
+        client = self.get_client(url, username, password)
+        try:
+            return client.open_dbus_channel(bus=bus, service=service, **kwargs)
+        finally:
+            # The open channel keeps the client in use.
+            self.release(client)
+
+    def release(self, client):
+        '''
+        Gives back a client leased by get_client() and marks it as recently
+        used. Should be called after closing its channels, so the idle
+        timeout starts from now.
+        '''
+        with self.lock:
+            for entry in self.entries.values() + self.retired:
+                if entry.client is client:
+                    entry.last_used = time.time()
+                    if entry.leases:
+                        entry.leases -= 1
+
+    def is_healthy(self, client):
+        '''
+        Returns True, if the client is connected and a ping can be sent.
+        '''
+        if not client.is_connected or not client.is_dispatching:
+            return False
+        try:
+            client.ping()
+        except Exception:
+            return False
+        return True
+
+    def evict_lru(self):
+        '''
+        Evicts the least recently used idle client. Raises PoolError, when all
+        the pooled clients are leased or have open channels. Must be called
+        with the lock held.
+        '''
+        for key, entry in self.entries.iteritems():
+            if entry.is_idle:
+                del self.entries[key]
+                self.retired.append(entry)
+                return
+        raise PoolError(-1, 'All %d pooled clients are in use' % self.max_size)
+
+    def evict_idle(self):
+        '''
+        Disconnects clients idle for longer than the idle timeout and retired
+        clients, which have no open channels left.
+        '''
+        now = time.time()
+        with self.lock:
+            for key, entry in self.entries.items():
+                if entry.is_idle and now - entry.last_used > self.idle_timeout:
+                    del self.entries[key]
+                    self.retired.append(entry)
+
+            to_close = [e for e in self.retired if e.is_idle]
+            self.retired = [e for e in self.retired if not e.is_idle]
+
+        for entry in to_close:
+            disconnect_quietly(entry.client)
+
+    def close(self):
+        '''
+        Disconnects all the clients.
+        '''
+        with self.lock:
+            entries = self.entries.values() + self.retired
+            self.entries.clear()
+            self.retired = []
+
+        for entry in entries:
+            disconnect_quietly(entry.client)
+
+
+def disconnect_quietly(client):
+    '''
+    Disconnects a client ignoring errors of already broken connections.
+    '''
+    try:
+        client.disconnect()
+    except Exception:
+        pass
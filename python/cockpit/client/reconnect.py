@@ -0,0 +1,215 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+CockpitClient restoring a lost connection.
+'''
+
+import random
+import socket
+import threading
+import time
+
+from cockpit.client.client import CockpitClient
+
+
+class ReconnectingCockpitClient(CockpitClient):
+    '''
+    CockpitClient supervising its connection. The connection is lost, when
+    reading fails or nothing (not even a cockpit-ws ping) arrives for
+    ping_timeout seconds. It's restored with an exponential backoff: the init
+    exchange is done again and every dbus-json3 channel is reopened under its
+    channel ID, so DBusChannel objects stay valid. Pending idempotent calls
+    are sent again, if replay is True; the other ones fail with ChannelError.
+
+    Messages are always received by the dispatcher thread.
+    '''
+
+    def __init__(self, url, no_verification=False, debug=False,
+                 session_store=None, ping_interval=5, ping_timeout=30,
+                 backoff_initial=0.5, backoff_max=30, replay=True,
+                 metrics=None, tracer=None):
+        super(ReconnectingCockpitClient, self).__init__(
+            url, no_verification, debug, session_store, metrics, tracer)
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.closing = False
+        self.connection_lost = False
+        self.last_received = 0
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.reconnects = 0
+        self.replay = replay
+        self.supervisor = None
+        self.wakeup = threading.Event()
+
+    @property
+    def is_dispatching(self):
+        '''
+        Property returning whether messages are received by the dispatcher
+        thread; that's true also while the connection is being restored.
+        '''
+        if self.supervisor is not None and self.supervisor.is_alive():
+            return True
+        return super(ReconnectingCockpitClient, self).is_dispatching
+
+    def connect(self, username, password, timeout=None):
+        '''
+        Connects to a cockpit-ws (see CockpitClient.connect()) and starts the
+        dispatcher and supervisor threads.
+        '''
+        resp = super(ReconnectingCockpitClient, self).connect(
+            username, password, timeout)
+
+        self.closing = False
+        self.connection_lost = False
+        self.last_received = time.time()
+        self.start_dispatcher()
+
+        self.supervisor = threading.Thread(
+            target=self.supervise,
+            name='cockpit-supervisor')
+        self.supervisor.daemon = True
+        self.supervisor.start()
+
+        return resp
+
+    def disconnect(self):
+        '''
+        Stops the supervisor, logs out and disconnects from cockpit-ws.
+        '''
+        self.closing = True
+        self.wakeup.set()
+        if self.supervisor is not None and \
+                self.supervisor is not threading.current_thread():
+            self.supervisor.join()
+        self.supervisor = None
+
+        if self.connection_lost:
+            # Nothing to log out from; just close the channels.
+            self.stop_sender()
+            self.ws.abort()
+            self.handle_connection_lost()
+            self.remove_gauges()
+        else:
+            super(ReconnectingCockpitClient, self).disconnect()
+
+    def receive_message(self, timeout=None):
+        result = super(ReconnectingCockpitClient, self).receive_message(
+            timeout)
+        if result is not None:
+            self.last_received = time.time()
+        return result
+
+    def handle_connection_lost(self):
+        '''
+        Suspends the channels and wakes up the supervisor. After disconnect(),
+        the channels are closed instead.
+        '''
+        if self.closing:
+            super(ReconnectingCockpitClient, self).handle_connection_lost()
+            return
+
+        self.connection_lost = True
+        if self.send_queue is not None:
+            # Frames of the old connection must not reach the new one.
+            self.send_queue.clear()
+        for channel in self.channels.values():
+            channel.suspend('disconnected', self.replay)
+        self.wakeup.set()
+
+    def supervise(self):
+        '''
+        Supervisor thread body. Pings cockpit-ws every ping_interval seconds
+        and restores a lost connection.
+        '''
+        while not self.closing:
+            self.wakeup.wait(self.ping_interval)
+            self.wakeup.clear()
+            if self.closing:
+                break
+
+            if self.connection_lost:
+                self.dispatcher.join()
+                self.restore()
+            elif time.time() - self.last_received > self.ping_timeout:
+                # Wake up the dispatcher thread, so it reports a lost
+                # connection.
+                self.abort_connection()
+            else:
+                try:
+                    self.ping()
+                except Exception:
+                    self.abort_connection()
+
+    def abort_connection(self):
+        try:
+            self.ws.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def restore(self):
+        '''
+        Connects again, until it succeeds or disconnect() is called, and
+        reopens the channels.
+        '''
+        started = time.time()
+        username, password = self.creds
+        channel_seed = self.channel_seed
+        delay = self.backoff_initial
+        # A peer, which stops responding during the login or handshake, must
+        # not hang the supervisor thread; the timeout applies only until the
+        # connection is restored.
+        timeout = self.ws.gettimeout()
+        self.ws.settimeout(self.ping_timeout)
+        try:
+            while not self.closing:
+                self.ws.abort()
+                try:
+                    super(ReconnectingCockpitClient, self).connect(
+                        username, password)
+                    break
+                except Exception:
+                    # Randomized, so a fleet of clients doesn't reconnect at
+                    # once.
+                    self.wakeup.wait(delay * random.uniform(0.5, 1.0))
+                    delay = min(delay * 2, self.backoff_max)
+            else:
+                return
+            self.ws.sock.settimeout(timeout)
+        finally:
+            self.ws.settimeout(timeout)
+
+        # Channel IDs of the reopened channels must not be handed out again.
+        self.channel_seed = max(self.channel_seed, channel_seed)
+        self.connection_lost = False
+        self.last_received = time.time()
+        self.reconnects += 1
+        self.observe_duration('reconnect', started)
+
+        for channel in self.channels.values():
+            if not channel.open_options:
+                self.unregister_channel(channel.channel_id)
+                channel.closed('disconnected')
+                continue
+            self.open_channel_dbus_json3_with_id(
+                channel.channel_id, **channel.open_options)
+            channel.resume()
+
+        self.start_dispatcher()
@@ -0,0 +1,176 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Stores of Cockpit session cookies, so a client can skip /login.
+'''
+
+import cookielib
+import errno
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+# Default lifetime of a stored cookie in seconds. cockpit-ws drops idle
+# sessions after 15 minutes by default.
+DEFAULT_SESSION_TTL = 15 * 60
+
+
+def get_cookie_expiry(set_cookie, now=None):
+    '''
+    Returns the time a cookie of a Set-Cookie header value expires at, or
+    None for a session cookie. Max-Age takes precedence over Expires.
+    '''
+    if now is None:
+        now = time.time()
+    expires = None
+    for attr in set_cookie.split(';')[1:]:
+        name, _, value = attr.partition('=')
+        name = name.strip().lower()
+        if name == 'max-age':
+            try:
+                return now + int(value)
+            except ValueError:
+                continue
+        elif name == 'expires':
+            expires = cookielib.http2time(value.strip())
+    return expires
+
+
+class SessionStore(object):
+    '''
+    In-memory store of Cockpit session cookies keyed by URL and user name.
+    Every entry expires after ttl seconds, or earlier, if the cookie itself
+    expires earlier (Max-Age or Expires of its Set-Cookie header).
+    '''
+
+    def __init__(self, ttl=DEFAULT_SESSION_TTL):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.ttl = ttl
+
+    def make_key(self, url, username):
+        return '%s %s' % (username, url)
+
+    def get(self, url, username):
+        '''
+        Returns a stored cookie, or None, if there's none or it expired.
+        '''
+        key = self.make_key(url, username)
+        with self.lock:
+            self.load()
+            entry = self.sessions.get(key)
+            if entry is None:
+                return None
+            cookie, expires = entry[:2]
+            if expires <= time.time():
+                del self.sessions[key]
+                self.save()
+                return None
+            return cookie
+
+    def put(self, url, username, cookie, cookie_expires=None):
+        '''
+        Stores a cookie, which expires at cookie_expires (see
+        get_cookie_expiry()). Putting the same cookie again renews its
+        expiry, but never past the cookie_expires stored with it.
+        '''
+        key = self.make_key(url, username)
+        with self.lock:
+            self.load()
+            entry = self.sessions.get(key)
+            if cookie_expires is None and entry is not None and \
+                    entry[0] == cookie and len(entry) > 2:
+                cookie_expires = entry[2]
+            expires = time.time() + self.ttl
+            if cookie_expires is not None:
+                expires = min(expires, cookie_expires)
+            self.sessions[key] = (cookie, expires, cookie_expires)
+            self.save()
+
+    def remove(self, url, username):
+        '''
+        Removes a cookie, e.g. after cockpit-ws refused it.
+        '''
+        with self.lock:
+            self.load()
+            if self.sessions.pop(self.make_key(url, username), None):
+                self.save()
+
+    def clear(self):
+        with self.lock:
+            self.sessions = {}
+            self.save()
+
+    def load(self):
+        '''
+        Reloads the entries from a backing storage. Called with lock held.
+        '''
+
+    def save(self):
+        '''
+        Writes the entries to a backing storage. Called with lock held.
+        '''
+
+
+class FileSessionStore(SessionStore):
+    '''
+    SessionStore persisted to a JSON file readable by its owner only, so the
+    cookies outlive the process. The file is reread before every access, so
+    several processes can share it.
+    '''
+
+    def __init__(self, path, ttl=DEFAULT_SESSION_TTL):
+        super(FileSessionStore, self).__init__(ttl)
+        self.path = os.path.expanduser(path)
+
+    def load(self):
+        try:
+            with open(self.path) as fp:
+                sessions = json.load(fp)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            sessions = {}
+        except ValueError:
+            # Corrupted file; the cookies will be obtained again.
+            sessions = {}
+        self.sessions = dict(
+            (key, tuple(entry)) for key, entry in sessions.iteritems())
+
+    def save(self):
+        now = time.time()
+        sessions = dict(
+            (key, entry) for key, entry in self.sessions.iteritems()
+            if entry[1] > now)
+
+        # Write a private temporary file and rename it over the store, so a
+        # reader never sees a partial file.
+        fd, tmp_path = tempfile.mkstemp(
+            prefix='.cockpit-sessions-', dir=os.path.dirname(self.path) or '.')
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                json.dump(sessions, fp)
+            os.rename(tmp_path, self.path)
+        except:
+            os.unlink(tmp_path)
+            raise
@@ -17,4 +17,6 @@
 #
 # ##### END LICENSE BLOCK #####
 
+from async_websock import AsyncWebSocket
 from websock import WebSocket
+from websock import WebSocketHandshakeError
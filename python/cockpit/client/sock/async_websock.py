@@ -0,0 +1,489 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import base64
+import collections
+import errno
+import hashlib
+import os
+import socket
+import ssl
+import struct
+import websocket
+
+from cockpit.client.eventloop import EVENT_ERROR
+from cockpit.client.eventloop import EVENT_READ
+from cockpit.client.eventloop import EVENT_WRITE
+from cockpit.client.eventloop import Future
+from cockpit.client.http import parse_url
+
+# Magic value of Sec-WebSocket-Accept computation, see RFC 6455.
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Socket states.
+STATE_CLOSED, STATE_RESOLVING, STATE_CONNECTING, STATE_TLS, STATE_OPEN = \
+    range(5)
+
+RECV_SIZE = 64 * 1024
+
+
+class AsyncWebSocket(object):
+    '''
+    Non-blocking WebSocket driven by an EventLoop. Before the handshake it
+    works as a plain buffered stream (see AsyncWebSocket.read_until()), which
+    is used also for the /login request. After the handshake, received
+    messages are passed to a message handler or queued for
+    AsyncWebSocket.recv().
+    '''
+
+    def __init__(self, loop, sslopt=None):
+        self.loop = loop
+        self.sslopt = sslopt or {}
+        self.sock = None
+        self.state = STATE_CLOSED
+        self.connect_future = None
+        self.read_request = None
+        self.rbuf = bytearray()
+        self.wbuf = bytearray()
+        self.framing = False
+        self.cont_data = None
+        self.messages = collections.deque()
+        self.recv_futures = collections.deque()
+        self.message_handler = None
+        self.close_handler = None
+
+    def connect(self, url):
+        '''
+        Connects to url. Returns a Future finished, when the connection (and
+        TLS handshake) is established. No WebSocket handshake is performed.
+        '''
+        self.scheme,       \
+            self.hostname, \
+            self.port,     \
+            self.resource, \
+            self.is_secure = parse_url(url)
+
+        self.connect_future = Future()
+
+        # getaddrinfo() blocks, so it's called in a helper thread.
+        self.state = STATE_RESOLVING
+        resolved = self.loop.run_in_thread(
+            socket.getaddrinfo, self.hostname, self.port, 0, 0, socket.SOL_TCP)
+        resolved.add_done_callback(self.start_connect)
+
+        return self.connect_future
+
+    def start_connect(self, resolved):
+        '''
+        Starts connecting to the first address resolved by
+        AsyncWebSocket.connect().
+        '''
+        if self.state != STATE_RESOLVING:
+            # Closed meanwhile.
+            return
+        if resolved.error is not None:
+            self.close(resolved.error)
+            return
+        if not resolved.value:
+            self.close(websocket.WebSocketException(
+                'Host not found.: %s:%s' % (self.hostname, self.port)))
+            return
+
+        family = resolved.value[0][0]
+        address = resolved.value[0][4]
+        self.sock = socket.socket(family)
+        self.sock.setblocking(0)
+        for opts in websocket.DEFAULT_SOCKET_OPTION:
+            self.sock.setsockopt(*opts)
+
+        err = self.sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.close(socket.error(err, os.strerror(err)))
+            return
+
+        self.state = STATE_CONNECTING
+        self.loop.register(self.sock.fileno(), self, EVENT_WRITE | EVENT_ERROR)
+
+    def handshake(self, header=None):
+        '''
+        Performs a WebSocket handshake. Returns a Future finished, when the
+        connection is upgraded.
+        '''
+        key = base64.b64encode(os.urandom(16))
+        hostport = self.hostname
+        if self.port != 80:
+            hostport = '%s:%d' % (self.hostname, self.port)
+
+        lines = [
+            'GET %s HTTP/1.1' % self.resource,
+            'Upgrade: websocket',
+            'Connection: Upgrade',
+            'Host: %s' % hostport,
+            'Origin: %s://%s:%s' % (self.scheme, self.hostname, self.port),
+            'Sec-WebSocket-Key: %s' % key,
+            'Sec-WebSocket-Version: %s' % websocket.VERSION,
+        ]
+        lines.extend(header or [])
+        self.write('\r\n'.join(lines + ['', '']))
+
+        future = Future()
+        expected_accept = base64.b64encode(
+            hashlib.sha1(key + WEBSOCKET_GUID).digest())
+
+        def upgraded(head):
+            if head.error is not None:
+                future.set_exception(head.error)
+                return
+
+            status_line, _, header_lines = head.value.partition('\r\n')
+            headers = {}
+            for line in header_lines.split('\r\n'):
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if status_line.split(' ', 2)[1:2] != ['101']:
+                self.close()
+                future.set_exception(websocket.WebSocketException(
+                    'Handshake Status %s' % status_line))
+            elif headers.get('sec-websocket-accept') != expected_accept:
+                self.close()
+                future.set_exception(websocket.WebSocketException(
+                    'Invalid WebSocket Header'))
+            else:
+                self.framing = True
+                self.parse_frames()
+                future.set_result(None)
+
+        self.read_until('\r\n\r\n').add_done_callback(upgraded)
+        return future
+
+    def write(self, data):
+        '''
+        Buffers data and writes as much as possible without blocking.
+        '''
+        self.wbuf += data
+        if self.state == STATE_OPEN:
+            self.flush()
+
+    def send(self, payload, opcode=websocket.ABNF.OPCODE_TEXT):
+        '''
+        Sends a WebSocket message.
+        '''
+        self.write(websocket.ABNF.create_frame(payload, opcode).format())
+
+    def send_many(self, payloads, opcode=websocket.ABNF.OPCODE_TEXT):
+        '''
+        Sends several WebSocket messages with a single write.
+        '''
+        for payload in payloads:
+            self.wbuf += websocket.ABNF.create_frame(payload, opcode).format()
+        if self.state == STATE_OPEN:
+            self.flush()
+
+    def read_until(self, delimiter):
+        '''
+        Returns a Future of data up to and excluding the delimiter.
+        '''
+        return self.request_read(delimiter, None)
+
+    def read_exactly(self, length):
+        '''
+        Returns a Future of length bytes.
+        '''
+        return self.request_read(None, length)
+
+    def request_read(self, delimiter, length):
+        assert self.read_request is None, 'only one read can be pending'
+        future = Future()
+        if self.state == STATE_CLOSED:
+            future.set_exception(
+                websocket.WebSocketConnectionClosedException())
+            return future
+        self.read_request = (delimiter, length, future)
+        self.process_read_request()
+        return future
+
+    def process_read_request(self):
+        if self.read_request is None:
+            return
+
+        delimiter, length, future = self.read_request
+        if delimiter is not None:
+            pos = self.rbuf.find(delimiter)
+            if pos < 0:
+                return
+            data = str(self.rbuf[:pos])
+            del self.rbuf[:pos + len(delimiter)]
+        else:
+            if len(self.rbuf) < length:
+                return
+            data = str(self.rbuf[:length])
+            del self.rbuf[:length]
+
+        self.read_request = None
+        future.set_result(data)
+
+    def recv(self):
+        '''
+        Returns a Future of a next received message. Used only, when there's
+        no message handler set.
+        '''
+        future = Future()
+        if self.messages:
+            future.set_result(self.messages.popleft())
+        elif self.state == STATE_CLOSED:
+            future.set_exception(
+                websocket.WebSocketConnectionClosedException())
+        else:
+            self.recv_futures.append(future)
+        return future
+
+    def set_message_handler(self, handler):
+        '''
+        Sets a callable, which gets every received message. Messages queued so
+        far are passed to it immediately.
+        '''
+        self.message_handler = handler
+        while self.messages and handler is not None:
+            handler(self.messages.popleft())
+
+    def close(self, error=None):
+        '''
+        Closes the connection. Pending reads fail with error, which defaults
+        to a WebSocketConnectionClosedException.
+        '''
+        if self.state == STATE_CLOSED:
+            return
+
+        if self.state == STATE_OPEN and self.framing:
+            # Best effort: flush pending messages (e.g. logout) and send a
+            # close frame without waiting for the reply.
+            try:
+                self.flush()
+                self.sock.send(websocket.ABNF.create_frame(
+                    struct.pack('!H', websocket.STATUS_NORMAL),
+                    websocket.ABNF.OPCODE_CLOSE).format())
+            except (socket.error, ssl.SSLError):
+                pass
+
+        self.state = STATE_CLOSED
+        if self.sock is not None:
+            self.loop.unregister(self.sock.fileno())
+            self.sock.close()
+
+        if error is None:
+            error = websocket.WebSocketConnectionClosedException()
+        if self.connect_future is not None and not self.connect_future.done:
+            self.connect_future.set_exception(error)
+        if self.read_request is not None:
+            future = self.read_request[2]
+            self.read_request = None
+            future.set_exception(error)
+        while self.recv_futures:
+            self.recv_futures.popleft().set_exception(error)
+        if self.close_handler is not None:
+            self.close_handler()
+
+    def fail(self, error):
+        self.close(error)
+
+    def update_events(self):
+        events = EVENT_READ | EVENT_ERROR
+        if self.wbuf:
+            events |= EVENT_WRITE
+        self.loop.modify(self.sock.fileno(), events)
+
+    def handle_events(self, events):
+        '''
+        EventLoop callback.
+        '''
+        try:
+            if self.state == STATE_CONNECTING:
+                self.finish_connect()
+            elif self.state == STATE_TLS:
+                self.do_tls_handshake()
+            else:
+                if events & (EVENT_READ | EVENT_ERROR):
+                    self.handle_read()
+                if self.state == STATE_OPEN and events & EVENT_WRITE:
+                    self.flush()
+        except Exception as e:
+            # Also covers errors raised by the message handler: only this
+            # connection fails, other connections on the loop keep running.
+            self.fail(e)
+
+    def finish_connect(self):
+        err = self.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise socket.error(err, os.strerror(err))
+
+        if not self.is_secure:
+            self.set_open()
+            return
+
+        sslopt = dict(
+            cert_reqs=ssl.CERT_REQUIRED,
+            ca_certs=os.path.join(
+                os.path.dirname(websocket.__file__), 'cacert.pem'))
+        sslopt.update(self.sslopt)
+        self.sock = ssl.wrap_socket(
+            self.sock, do_handshake_on_connect=False, **sslopt)
+        self.state = STATE_TLS
+        self.do_tls_handshake()
+
+    def do_tls_handshake(self):
+        try:
+            self.sock.do_handshake()
+        except ssl.SSLError as e:
+            if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                self.loop.modify(self.sock.fileno(), EVENT_READ | EVENT_ERROR)
+                return
+            if e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                self.loop.modify(self.sock.fileno(), EVENT_WRITE | EVENT_ERROR)
+                return
+            raise
+
+        if self.sslopt.get('cert_reqs', ssl.CERT_REQUIRED) != ssl.CERT_NONE:
+            websocket.match_hostname(self.sock.getpeercert(), self.hostname)
+        self.set_open()
+
+    def set_open(self):
+        self.state = STATE_OPEN
+        self.flush()
+        self.update_events()
+        self.connect_future.set_result(None)
+
+    def flush(self):
+        while self.wbuf:
+            try:
+                sent = self.sock.send(self.wbuf)
+            except ssl.SSLError as e:
+                if e.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                    break
+                raise
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            del self.wbuf[:sent]
+        self.update_events()
+
+    def handle_read(self):
+        eof = False
+        while True:
+            try:
+                chunk = self.sock.recv(RECV_SIZE)
+            except ssl.SSLError as e:
+                if e.args[0] == ssl.SSL_ERROR_WANT_READ:
+                    break
+                raise
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                eof = True
+                break
+            self.rbuf += chunk
+
+        # Data received before EOF is still delivered.
+        if self.framing:
+            self.parse_frames()
+        else:
+            self.process_read_request()
+        if eof:
+            self.close()
+
+    def parse_frames(self):
+        '''
+        Parses all complete frames from the read buffer. Each payload is
+        copied out of the buffer once and the consumed data is dropped after
+        the loop, not after every frame.
+        '''
+        rbuf = self.rbuf
+        end = len(rbuf)
+        start = 0
+        frames = []
+        view = memoryview(rbuf)
+        while end - start >= 2:
+            fin = rbuf[start] >> 7
+            opcode = rbuf[start] & 0xf
+            masked = rbuf[start + 1] >> 7
+            length = rbuf[start + 1] & 0x7f
+            pos = start + 2
+            if length == 0x7e:
+                if end - start < 4:
+                    break
+                length = struct.unpack_from('!H', rbuf, pos)[0]
+                pos += 2
+            elif length == 0x7f:
+                if end - start < 10:
+                    break
+                length = struct.unpack_from('!Q', rbuf, pos)[0]
+                pos += 8
+
+            mask_key = None
+            if masked:
+                mask_key = view[pos:pos + 4].tobytes()
+                pos += 4
+
+            if end < pos + length:
+                break
+
+            payload = view[pos:pos + length].tobytes()
+            if mask_key is not None:
+                payload = websocket.ABNF.mask(mask_key, payload)
+            frames.append((fin, opcode, payload))
+            start = pos + length
+
+        # The buffer can't be resized while a view of it exists.
+        del view
+        del rbuf[:start]
+
+        for frame in frames:
+            if self.state == STATE_CLOSED:
+                break
+            self.handle_frame(*frame)
+
+    def handle_frame(self, fin, opcode, payload):
+        if opcode in (websocket.ABNF.OPCODE_TEXT,
+                      websocket.ABNF.OPCODE_BINARY,
+                      websocket.ABNF.OPCODE_CONT):
+            if opcode == websocket.ABNF.OPCODE_CONT:
+                if self.cont_data is None:
+                    raise websocket.WebSocketException('Illegal frame')
+                self.cont_data.append(payload)
+            else:
+                self.cont_data = [payload]
+            if fin:
+                message = ''.join(self.cont_data)
+                self.cont_data = None
+                self.deliver_message(message)
+        elif opcode == websocket.ABNF.OPCODE_PING:
+            self.send(payload, websocket.ABNF.OPCODE_PONG)
+        elif opcode == websocket.ABNF.OPCODE_CLOSE:
+            self.close()
+
+    def deliver_message(self, message):
+        if self.message_handler is not None:
+            self.message_handler(message)
+        elif self.recv_futures:
+            self.recv_futures.popleft().set_result(message)
+        else:
+            self.messages.append(message)
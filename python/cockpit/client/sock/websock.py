@@ -17,14 +17,32 @@
 #
 # ##### END LICENSE BLOCK #####
 
+import base64
+import hashlib
 import os
+import select
 import socket
 import ssl
 import sys
 import websocket
 
+from cockpit.client import http
 from cockpit.client.http import parse_url
 
+# Magic value of Sec-WebSocket-Accept computation, see RFC 6455.
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+
+class WebSocketHandshakeError(websocket.WebSocketException):
+    '''
+    WebSocket handshake exception carrying the HTTP status code.
+    '''
+
+    def __init__(self, status_code):
+        super(WebSocketHandshakeError, self).__init__(
+            'Handshake Status %d' % status_code)
+        self.status_code = status_code
+
 
 class WebSocket(websocket.WebSocket):
     '''
@@ -83,11 +101,111 @@ class WebSocket(websocket.WebSocket):
             else:
                 raise WebSocketException('SSL not available.')
 
-    def handshake(self, **options):
+    def abort(self):
+        '''
+        Closes the socket without the closing handshake, e.g. when the peer
+        stopped responding.
+        '''
+        self.connected = False
+        if self.sock is not None:
+            self.sock.close()
+        self.reset_frame_state()
+
+    def reset_frame_state(self):
+        '''
+        Drops a partially received frame and data read ahead, so the next
+        connection starts reading at a frame boundary.
+        '''
+        self._recv_buffer = []
+        self._frame_header = None
+        self._frame_length = None
+        self._frame_mask = None
+        self._cont_data = None
+
+    def handshake(self, connection=None, **options):
+        '''
+        Performs a WebSocket handshake. It's done via an HTTPConnection (the
+        one used for /login, if given), so data read ahead is passed over to
+        the WebSocket.
+        '''
         scheme = options.pop('scheme', self.scheme)
         hostname = options.pop('hostname', self.hostname)
         port = options.pop('port', self.port)
 
-        options['origin'] = '%s://%s:%s' % (scheme, hostname, port)
+        if connection is None:
+            connection = http.HTTPConnection(self.sock)
+        self.reset_frame_state()
+
+        key = base64.b64encode(os.urandom(16))
+        headers = [
+            ('Upgrade', 'websocket'),
+            ('Connection', 'Upgrade'),
+            ('Host', '%s:%s' % (hostname, port)),
+            ('Origin', '%s://%s:%s' % (scheme, hostname, port)),
+            ('Sec-WebSocket-Key', key),
+            ('Sec-WebSocket-Version', str(websocket.VERSION)),
+        ]
+        for header in options.get('header', []):
+            name, value = header.split(':', 1)
+            headers.append((name, value.strip()))
+
+        response = connection.request(
+            http.HTTPMessage(
+                http.HTTPRequestLine('GET', self.resource, http.HTTP_1_1),
+                headers))
+
+        headers = dict(
+            (name.lower(), value) for name, value in response.headers.items())
+        expected_accept = base64.b64encode(
+            hashlib.sha1(key + WEBSOCKET_GUID).digest())
+        if response.init_line.status_code != 101:
+            self.close()
+            raise WebSocketHandshakeError(response.init_line.status_code)
+        if headers.get('upgrade', '').lower() != 'websocket' or \
+                headers.get('connection', '').lower() != 'upgrade' or \
+                headers.get('sec-websocket-accept') != expected_accept:
+            self.close()
+            raise websocket.WebSocketException('Invalid WebSocket Header')
+
+        # Frames sent right after the handshake may be read ahead already.
+        self._recv_buffer = [connection.detach()]
+        self.connected = True
+
+    def recv_payload(self):
+        '''
+        Receives a message payload as bytes, which are not decoded to text.
+        '''
+        return self.recv_data()[1]
+
+    def wait_readable(self, timeout=None, wakeup_fd=None):
+        '''
+        Waits up to timeout seconds for received data. Returns True, if a
+        frame can be read. Data readable from wakeup_fd, if given, ends the
+        wait early.
+        '''
+        if any(self._recv_buffer):
+            return True
+        pending = getattr(self.sock, 'pending', None)
+        if pending is not None and pending():
+            # Decrypted data buffered by SSL isn't seen by select().
+            return True
+        rlist = [self.sock]
+        if wakeup_fd is not None:
+            rlist.append(wakeup_fd)
+        return self.sock in select.select(rlist, [], [], timeout)[0]
+
+    def send_many(self, payloads, opcode=websocket.ABNF.OPCODE_TEXT):
+        '''
+        Sends several messages. Their frames are written at once.
+        '''
+        frames = []
+        for payload in payloads:
+            frame = websocket.ABNF.create_frame(payload, opcode)
+            if self.get_mask_key:
+                frame.get_mask_key = self.get_mask_key
+            frames.append(frame.format())
 
-        self._handshake(hostname, port, self.resource, **options)
+        data = ''.join(frames)
+        while data:
+            sent = self._send(data)
+            data = data[sent:]
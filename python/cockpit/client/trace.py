@@ -0,0 +1,180 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+'''
+Sampled tracing of Cockpit frames in both directions.
+'''
+
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from collections import namedtuple
+
+
+# Call ID of an encoded dbus-json3 message; used only for sampled frames.
+CALL_ID_RE = re.compile(r'"id"\s*:\s*"([^"]*)"')
+
+
+# One traced frame. Payload is truncated to max_payload bytes of a Tracer;
+# size is the length of the whole frame.
+TraceRecord = namedtuple(
+    'TraceRecord',
+    ['timestamp', 'direction', 'channel_id', 'size', 'call_id', 'payload'])
+
+
+class Tracer(object):
+    '''
+    Base class of frame tracers. Only sample_rate (0 to 1) of the frames is
+    recorded; payloads are truncated to max_payload bytes. Tracer.record()
+    does nothing; subclasses override it.
+    '''
+
+    def __init__(self, sample_rate=1.0, max_payload=256):
+        self.max_payload = max_payload
+        self.sample_rate = sample_rate
+
+    def trace(self, direction, frame, message=None):
+        '''
+        Traces an encoded frame sent or received (see DIRECTION_OUT and
+        DIRECTION_IN of cockpit.client.metrics). A decoded message, if
+        available, spares searching the payload for the call ID.
+        '''
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return
+
+        frame = bytes(frame)
+        channel_id, _, payload = frame.partition('\n')
+        if message is not None:
+            call_id = message.get('id')
+        else:
+            match = CALL_ID_RE.search(payload)
+            call_id = match.group(1) if match else None
+
+        self.record(TraceRecord(
+            time.time(), direction, channel_id or 'control', len(frame),
+            call_id, payload[:self.max_payload]))
+
+    def record(self, record):
+        '''
+        Stores a sampled TraceRecord. Called from any client thread.
+        '''
+
+
+class RingBufferTracer(Tracer):
+    '''
+    Tracer keeping the last size records in memory.
+    '''
+
+    def __init__(self, size=1024, sample_rate=1.0, max_payload=256):
+        super(RingBufferTracer, self).__init__(sample_rate, max_payload)
+        self.buffer = deque(maxlen=size)
+
+    def record(self, record):
+        self.buffer.append(record)
+
+    def records(self):
+        '''
+        Returns a list of the recorded TraceRecords, oldest first.
+        '''
+        return list(self.buffer)
+
+    def clear(self):
+        self.buffer.clear()
+
+
+def format_record(record):
+    '''
+    Returns a single line description of a TraceRecord.
+    '''
+    return '%.6f %-3s channel=%s size=%d id=%s %s' % (
+        record.timestamp, record.direction, record.channel_id, record.size,
+        record.call_id or '-', record.payload)
+
+
+class StreamTracer(Tracer):
+    '''
+    Tracer writing a line per record to a stream (e.g. sys.stderr).
+    '''
+
+    def __init__(self, stream, sample_rate=1.0, max_payload=256):
+        super(StreamTracer, self).__init__(sample_rate, max_payload)
+        self.lock = threading.Lock()
+        self.stream = stream
+
+    def record(self, record):
+        line = format_record(record) + '\n'
+        with self.lock:
+            self.stream.write(line)
+
+
+class FileTracer(Tracer):
+    '''
+    Tracer appending JSON lines to a file. When the file grows over max_bytes,
+    it's rotated to path.1 (path.1 to path.2, ...); backup_count files are
+    kept.
+    '''
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backup_count=3,
+                 sample_rate=1.0, max_payload=256):
+        super(FileTracer, self).__init__(sample_rate, max_payload)
+        self.backup_count = backup_count
+        self.lock = threading.Lock()
+        self.max_bytes = max_bytes
+        self.path = path
+        self.fp = open(path, 'a')
+        self.size = self.fp.tell()
+
+    def record(self, record):
+        fields = record._asdict()
+        # Truncation may split a UTF-8 sequence.
+        fields['payload'] = record.payload.decode('utf8', 'replace')
+        line = json.dumps(fields) + '\n'
+        with self.lock:
+            if self.fp is None:
+                return
+            if self.size + len(line) > self.max_bytes and self.size:
+                self.rotate()
+            self.fp.write(line)
+            self.size += len(line)
+
+    def rotate(self):
+        self.fp.close()
+        for i in xrange(self.backup_count - 1, 0, -1):
+            src = '%s.%d' % (self.path, i)
+            if os.path.exists(src):
+                os.rename(src, '%s.%d' % (self.path, i + 1))
+        if self.backup_count > 0:
+            os.rename(self.path, self.path + '.1')
+        self.fp = open(self.path, 'w')
+        self.size = 0
+
+    def flush(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.flush()
+
+    def close(self):
+        with self.lock:
+            if self.fp is not None:
+                self.fp.close()
+                self.fp = None
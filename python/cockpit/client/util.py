@@ -24,6 +24,82 @@ import json
 import random
 
 
+class JSONCodec(object):
+    '''
+    JSON encoder and decoder pair used for Cockpit messages.
+    '''
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+    def loads_from(self, data, offset):
+        '''
+        Decodes JSON starting at offset of data. loads() can't start at an
+        offset (ujson can't), so the data after offset is copied once.
+        '''
+        return self.loads(data[offset:])
+
+
+class StdlibJSONCodec(JSONCodec):
+    '''
+    JSON codec of the standard library. Decodes in place, without copying
+    the data after offset.
+    '''
+
+    def __init__(self):
+        super(StdlibJSONCodec, self).__init__('json', json.dumps, json.loads)
+        self.decoder = json.JSONDecoder()
+
+    def loads_from(self, data, offset):
+        return self.decoder.raw_decode(data, offset)[0]
+
+
+def make_json_codec(name):
+    '''
+    Returns a JSONCodec by a module name (ujson or json). Raises ImportError,
+    if the module is not installed.
+    '''
+    if name == 'json':
+        return StdlibJSONCodec()
+    module = __import__(name)
+    return JSONCodec(name, module.dumps, module.loads)
+
+
+def set_json_codec(codec):
+    '''
+    Sets a JSONCodec (or a module name of one) used by make_json() and
+    read_json().
+    '''
+    global json_codec
+    if isinstance(codec, basestring):
+        codec = make_json_codec(codec)
+    json_codec = codec
+
+
+def find_json_codec():
+    '''
+    Returns the ujson codec, if ujson is installed, or the standard one.
+    '''
+    try:
+        return make_json_codec('ujson')
+    except ImportError:
+        return make_json_codec('json')
+
+
+# Codec used for all the messages.
+json_codec = find_json_codec()
+
+# JSON key names of make_json() keyword arguments. Keys of Cockpit commands
+# are known in advance; other ones are added on the first use.
+json_key_names = dict(
+    (key, key.replace('_', '-')) for key in (
+        'add_match', 'bus', 'call', 'channel', 'channel_seed', 'command',
+        'disconnect', 'host', 'id', 'name', 'payload', 'reason',
+        'remove_match', 'unwatch', 'user', 'version', 'watch'))
+
+
 # XXX: received unknown/invalid credential cookie
 def make_auth_cookie():
     '''
@@ -62,11 +138,31 @@ def make_json(**kw):
     '''
     Creates a JSON encoded string from kwargs.
     '''
-    keys = {k.replace('_', '-'): v for k, v in kw.iteritems() if v is not None}
-    return json.dumps(keys)
+    names = json_key_names
+    keys = {}
+    for key, value in kw.iteritems():
+        if value is not None:
+            name = names.get(key)
+            if name is None:
+                name = names[key] = key.replace('_', '-')
+            keys[name] = value
+    return json_codec.dumps(keys)
+
+
+def read_json(json_msg, offset=0):
+    '''
+    Returns decoded JSON object. Decoding starts at offset.
+    '''
+    if offset:
+        return json_codec.loads_from(json_msg, offset)
+    return json_codec.loads(json_msg)
+
 
-def read_json(json_msg):
+def read_frame(frame):
     '''
-    Returns decoded JSON object.
+    Returns a channel ID and a decoded message of a Cockpit frame. The
+    payload is decoded without splitting the frame first, if the codec
+    allows it.
     '''
-    return json.loads(json_msg)
+    pos = frame.index('\n')
+    return frame[:pos], read_json(frame, pos + 1)
@@ -18,3 +18,10 @@
 # ##### END LICENSE BLOCK #####
 
 from remote_dbus import *
+from signals import *
+from async_remote_dbus import *
+from property_cache import *
+from fleet import *
+from typed import *
+from proxy import *
+from object_tree import *
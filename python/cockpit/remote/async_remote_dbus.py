@@ -0,0 +1,181 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+from collections import deque
+
+from cockpit.client import AsyncCockpitClient
+from cockpit.client.eventloop import Future
+from cockpit.client.eventloop import Return
+from cockpit.client.eventloop import coroutine
+from cockpit.client.eventloop import gather
+from cockpit.remote.signals import POLICY_DROP_OLDEST
+from cockpit.remote.signals import Subscription
+
+
+class AsyncSubscription(Subscription):
+    '''
+    Subscription, whose AsyncSubscription.get() returns a Future of a next
+    SignalEvent (None, when closed). The event loop can't block, so
+    POLICY_BLOCK behaves like POLICY_DROP_OLDEST.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.waiters = deque()
+        super(AsyncSubscription, self).__init__(*args, **kwargs)
+
+    def put(self, event):
+        if self.waiters:
+            self.waiters.popleft().set_result(event)
+        else:
+            super(AsyncSubscription, self).put(event)
+
+    def get(self):
+        future = Future()
+        if self.events:
+            future.set_result(self.pop_event())
+        elif self.closed:
+            future.set_result(None)
+        else:
+            self.waiters.append(future)
+        return future
+
+    def set_closed(self):
+        super(AsyncSubscription, self).set_closed()
+        while self.waiters:
+            self.waiters.popleft().set_result(None)
+
+
+class AsyncRemoteService(object):
+    '''
+    Handle of a D-Bus service reached via its own channel of a shared
+    asynchronous connection. AsyncRemoteDBus makes its calls via a default
+    one; others are returned by AsyncRemoteDBus.get_service().
+    '''
+
+    def __init__(self, remote, channel, service, bus):
+        self.remote = remote
+        self.channel = channel
+        self.service = service
+        self.bus = bus
+
+    def close(self):
+        '''
+        Closes the service channel. The connection stays open.
+        '''
+        self.channel.close()
+        self.remote.services.pop((self.bus, self.service), None)
+
+    def call(self, path, interface, method, args, require_response=True,
+             timeout=None):
+        '''
+        Performs a remote D-Bus call. Returns a Future of the reply arguments,
+        or None, when no response is required. The future fails with
+        CallTimeoutError, if the reply doesn't arrive within timeout seconds.
+        '''
+        return self.channel.call(path, interface, method, args,
+                                 require_response, timeout=timeout)
+
+    def call_many(self, calls, timeout=None):
+        '''
+        Performs a list of (path, interface, method, args) calls sent with a
+        single write. Returns a Future of a list of reply arguments in the
+        order of calls.
+        '''
+        return gather(self.channel.call_many(calls, timeout=timeout))
+
+    def subscribe(self, match, max_size=1024, policy=POLICY_DROP_OLDEST):
+        '''
+        Subscribes for D-Bus signals described by match. Returns an
+        AsyncSubscription. See RemoteService.subscribe().
+        '''
+        return AsyncSubscription(self.channel, match, max_size, policy)
+
+
+class AsyncRemoteDBus(object):
+    '''
+    Class for asynchronous D-Bus remoting via Cockpit. One event loop can
+    drive any number of these objects from a single thread.
+    '''
+
+    def __init__(self, url, service, no_verification=False, bus='session',
+                 debug=False, loop=None, metrics=None, tracer=None):
+        self.client = AsyncCockpitClient(
+            url, no_verification, debug, loop, metrics, tracer)
+        self.service = service
+        self.bus = bus
+        self.channel = None
+        self.channel_id = None
+        self.default_service = None
+        self.services = {}
+
+    @coroutine
+    def connect(self, username, password):
+        '''
+        Connects to cockpit-ws and opens a channel. Returns a Future of this
+        object.
+        '''
+        yield self.client.connect(username, password)
+        self.channel = self.client.open_dbus_channel(
+            username=username, password=password,
+            bus=self.bus, service=self.service)
+        self.channel_id = self.channel.channel_id
+        # Calls of this object are made via the default service handle.
+        self.default_service = AsyncRemoteService(
+            self, self.channel, self.service, self.bus)
+        raise Return(self)
+
+    def close(self):
+        '''
+        Closes a channel and disconnects from cockpit-ws.
+        '''
+        for handle in self.services.values():
+            handle.close()
+        self.channel.close()
+        self.client.disconnect()
+
+    def get_service(self, service, bus=None):
+        '''
+        Returns an AsyncRemoteService handle for a D-Bus service on bus. See
+        RemoteDBus.get_service().
+        '''
+        bus = bus or self.bus
+        handle = self.services.get((bus, service))
+        if handle is None or handle.channel.problem is not None:
+            channel = self.client.open_dbus_channel(bus=bus, service=service)
+            handle = AsyncRemoteService(self, channel, service, bus)
+            self.services[(bus, service)] = handle
+        return handle
+
+    def call(self, *args, **kwargs):
+        '''
+        Performs a remote D-Bus call. See AsyncRemoteService.call().
+        '''
+        return self.default_service.call(*args, **kwargs)
+
+    def call_many(self, *args, **kwargs):
+        '''
+        Performs a list of calls. See AsyncRemoteService.call_many().
+        '''
+        return self.default_service.call_many(*args, **kwargs)
+
+    def subscribe(self, *args, **kwargs):
+        '''
+        Subscribes for D-Bus signals. See AsyncRemoteService.subscribe().
+        '''
+        return self.default_service.subscribe(*args, **kwargs)
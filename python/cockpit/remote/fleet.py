@@ -0,0 +1,196 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import Queue
+import threading
+import time
+from collections import namedtuple
+
+from cockpit.remote.remote_dbus import RemoteDBus
+
+# URL of a host given by its name only.
+DEFAULT_URL_TEMPLATE = 'wss://%s:9090/cockpit/socket'
+
+# Seconds a connect (including /login and the handshake) may stall.
+DEFAULT_CONNECT_TIMEOUT = 30
+
+
+class FleetResult(namedtuple(
+        'FleetResult', 'host reply error connect_time call_time')):
+    '''
+    Result of a call on one host. Reply is None, if error (an exception) is
+    set. Connect_time is 0 for a reused session; times are in seconds.
+    '''
+    __slots__ = ()
+
+
+class FleetExecutor(object):
+    '''
+    Runs the same D-Bus calls on many hosts. Hosts are names (turned into
+    URLs by url_template) or URLs. Sessions are opened by max_workers threads
+    with at most max_connecting connects in flight, and kept for further runs
+    until FleetExecutor.close(). A host not answering within connect_timeout
+    seconds fails and frees its connect slot. Other keyword arguments are
+    passed to RemoteDBus (e.g. no_verification, session_store, metrics).
+    '''
+
+    def __init__(self, hosts, username, password, service, bus='session',
+                 max_workers=32, max_connecting=8, timeout=None,
+                 url_template=DEFAULT_URL_TEMPLATE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, **remote_options):
+        self.bus = bus
+        self.connect_timeout = connect_timeout
+        self.connecting = threading.BoundedSemaphore(max_connecting)
+        self.hosts = list(hosts)
+        self.lock = threading.Lock()
+        self.max_workers = max_workers
+        self.password = password
+        self.remote_options = remote_options
+        self.remotes = {}
+        self.service = service
+        self.timeout = timeout
+        self.url_template = url_template
+        self.username = username
+
+    def get_url(self, host):
+        if '://' in host:
+            return host
+        return self.url_template % host
+
+    def get_remote(self, host):
+        '''
+        Returns a RemoteDBus session of host, connecting it if needed.
+        '''
+        with self.lock:
+            remote = self.remotes.get(host)
+        if remote is not None:
+            return remote
+
+        with self.connecting:
+            remote = RemoteDBus(
+                self.get_url(host), self.username, self.password,
+                self.service, bus=self.bus,
+                connect_timeout=self.connect_timeout, **self.remote_options)
+        with self.lock:
+            # Another thread may have connected the host meanwhile; its
+            # session wins and this one is closed.
+            winner = self.remotes.setdefault(host, remote)
+        if winner is not remote:
+            try:
+                remote.close()
+            except Exception:
+                pass
+        return winner
+
+    def drop_remote(self, host):
+        '''
+        Forgets a broken session of host; the next run connects again.
+        '''
+        with self.lock:
+            remote = self.remotes.pop(host, None)
+        if remote is not None:
+            try:
+                remote.close()
+            except Exception:
+                pass
+
+    def run_host(self, host, calls):
+        '''
+        Runs calls on host. Returns a FleetResult with a list of replies (or
+        DBusErrors of the failed calls).
+        '''
+        connect_time = 0
+        started = time.time()
+        try:
+            with self.lock:
+                connected = host in self.remotes
+            remote = self.get_remote(host)
+            if not connected:
+                connect_time = time.time() - started
+
+            started = time.time()
+            replies = remote.call_many(
+                calls, return_exceptions=True, timeout=self.timeout)
+            if remote.channel.problem is not None:
+                # The session is unusable (closed channel, lost connection),
+                # not just a call; timed out calls don't count.
+                self.drop_remote(host)
+            return FleetResult(
+                host, replies, None, connect_time, time.time() - started)
+        except Exception as e:
+            self.drop_remote(host)
+            return FleetResult(
+                host, None, e, connect_time, time.time() - started)
+
+    def run_many(self, calls, hosts=None):
+        '''
+        Runs a list of (path, interface, method, args) calls on every host
+        (or on hosts). Yields a FleetResult per host as soon as the host is
+        done; its reply is a list of reply arguments in the order of calls.
+        '''
+        calls = list(calls)
+        hosts = self.hosts if hosts is None else list(hosts)
+
+        pending = Queue.Queue()
+        for host in hosts:
+            pending.put(host)
+        results = Queue.Queue()
+
+        def work():
+            while True:
+                try:
+                    host = pending.get_nowait()
+                except Queue.Empty:
+                    return
+                results.put(self.run_host(host, calls))
+
+        for _ in xrange(min(self.max_workers, len(hosts))):
+            worker = threading.Thread(target=work, name='cockpit-fleet')
+            worker.daemon = True
+            worker.start()
+
+        for _ in hosts:
+            yield results.get()
+
+    def run(self, path, interface, method, args, hosts=None):
+        '''
+        Runs a single call on every host. Yields a FleetResult per host as
+        soon as the host is done; its reply is the reply arguments and a
+        failed call sets its error.
+        '''
+        for result in self.run_many([(path, interface, method, args)], hosts):
+            if result.error is None:
+                reply = result.reply[0]
+                if isinstance(reply, Exception):
+                    result = result._replace(reply=None, error=reply)
+                else:
+                    result = result._replace(reply=reply)
+            yield result
+
+    def close(self):
+        '''
+        Closes all the sessions.
+        '''
+        with self.lock:
+            remotes, self.remotes = self.remotes, {}
+        for remote in remotes.values():
+            try:
+                remote.close()
+            except Exception:
+                pass
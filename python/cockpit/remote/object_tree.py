@@ -0,0 +1,279 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import threading
+
+from cockpit.remote.typed import get_decoder
+
+# D-Bus interfaces the mirror is built from.
+OBJECT_MANAGER_INTERFACE = 'org.freedesktop.DBus.ObjectManager'
+PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+
+# Decoder of the interfaces and properties of one object (a{sa{sv}}).
+decode_interfaces = get_decoder('a{sa{sv}}')
+decode_properties = get_decoder('a{sv}')
+
+
+def freeze(value):
+    '''
+    Returns a hashable form of a property value for indexes.
+    '''
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, freeze(item)) for key, item in value.iteritems()))
+    return value
+
+
+class RemoteObjectTree(object):
+    '''
+    Local mirror of objects of a service implementing
+    org.freedesktop.DBus.ObjectManager at manager_path, read via a RemoteDBus
+    or a RemoteService. GetManagedObjects is called once; InterfacesAdded,
+    InterfacesRemoved and PropertiesChanged signals keep the mirror up to
+    date, so lookups don't make any calls. Values are decoded like replies of
+    TypedCaller (variants unwrapped, ay as str).
+
+    The mirror doesn't see changes made while a connection is down; call
+    reload() after a ReconnectingCockpitClient is restored.
+    '''
+
+    def __init__(self, remote, manager_path='/', timeout=None):
+        self.remote = remote
+        self.channel = remote.channel
+        self.manager_path = manager_path
+        self.lock = threading.RLock()
+        self.objects = {}
+        # Paths by interface.
+        self.interfaces = {}
+        # Paths by property value for (interface, name) keys; see
+        # add_index().
+        self.indexes = {}
+        # Signals received while loading; applied after the snapshot.
+        self.pending_signals = None
+        self.matches = [
+            {'path': manager_path, 'interface': OBJECT_MANAGER_INTERFACE},
+            {'path_namespace': manager_path, 'interface': PROPERTIES_INTERFACE,
+             'member': 'PropertiesChanged'},
+        ]
+
+        self.channel.add_listener(self.handle_message)
+        for match in self.matches:
+            self.channel.add_match(match, require_response=False)
+        self.reload(timeout)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def __contains__(self, path):
+        return path in self.objects
+
+    def reload(self, timeout=None):
+        '''
+        Replaces the mirror with a fresh GetManagedObjects snapshot.
+        '''
+        with self.lock:
+            self.pending_signals = []
+        try:
+            reply = self.remote(self.manager_path, OBJECT_MANAGER_INTERFACE,
+                                'GetManagedObjects', [], timeout=timeout)
+        except Exception:
+            with self.lock:
+                self.pending_signals = None
+            raise
+
+        with self.lock:
+            self.objects = {}
+            self.interfaces = {}
+            for key in self.indexes:
+                self.indexes[key] = {}
+            for path, interfaces in reply[0].iteritems():
+                self.add_interfaces(path, decode_interfaces(interfaces))
+            # Every change included in the snapshot was signalled before
+            # the reply, so applying them again in order gives the same
+            # state.
+            signals, self.pending_signals = self.pending_signals, None
+            for signal in signals:
+                self.apply_signal(*signal)
+
+    def add_index(self, interface, name):
+        '''
+        Indexes paths by values of a property, so find() with it doesn't
+        scan all the objects of interface.
+        '''
+        with self.lock:
+            index = self.indexes[(interface, name)] = {}
+            for path in self.interfaces.get(interface, ()):
+                properties = self.objects[path][interface]
+                if name in properties:
+                    index.setdefault(
+                        freeze(properties[name]), set()).add(path)
+
+    def index_add(self, path, interface, properties):
+        for name, value in properties.iteritems():
+            index = self.indexes.get((interface, name))
+            if index is not None:
+                index.setdefault(freeze(value), set()).add(path)
+
+    def index_remove(self, path, interface, properties):
+        for name, value in properties.iteritems():
+            index = self.indexes.get((interface, name))
+            if index is None:
+                continue
+            key = freeze(value)
+            paths = index.get(key)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del index[key]
+
+    def add_interfaces(self, path, interfaces):
+        obj = self.objects.setdefault(path, {})
+        for interface, properties in interfaces.iteritems():
+            old = obj.get(interface)
+            if old is not None:
+                self.index_remove(path, interface, old)
+            obj[interface] = properties
+            self.interfaces.setdefault(interface, set()).add(path)
+            self.index_add(path, interface, properties)
+
+    def remove_interfaces(self, path, interfaces):
+        obj = self.objects.get(path)
+        if obj is None:
+            return
+        for interface in interfaces:
+            properties = obj.pop(interface, None)
+            if properties is None:
+                continue
+            self.index_remove(path, interface, properties)
+            paths = self.interfaces.get(interface)
+            if paths is not None:
+                paths.discard(path)
+                if not paths:
+                    del self.interfaces[interface]
+        if not obj:
+            del self.objects[path]
+
+    def change_properties(self, path, interface, changed, invalidated):
+        properties = self.objects.get(path, {}).get(interface)
+        if properties is None:
+            return
+        names = set(changed).union(invalidated)
+        old = dict((name, properties[name])
+                   for name in names if name in properties)
+        self.index_remove(path, interface, old)
+        for name in invalidated:
+            properties.pop(name, None)
+        properties.update(changed)
+        self.index_add(path, interface, dict(
+            (name, properties[name]) for name in changed))
+
+    def apply_signal(self, path, interface, member, args):
+        '''
+        Applies an ObjectManager or Properties signal to the mirror.
+        '''
+        if interface == OBJECT_MANAGER_INTERFACE:
+            if path != self.manager_path:
+                return
+            if member == 'InterfacesAdded':
+                self.add_interfaces(args[0], decode_interfaces(args[1]))
+            elif member == 'InterfacesRemoved':
+                self.remove_interfaces(args[0], args[1])
+        elif interface == PROPERTIES_INTERFACE and \
+                member == 'PropertiesChanged':
+            changed_interface, changed, invalidated = args
+            self.change_properties(path, changed_interface,
+                                   decode_properties(changed), invalidated)
+
+    def handle_message(self, message):
+        '''
+        Channel listener.
+        '''
+        if 'signal' not in message:
+            return
+        with self.lock:
+            if self.pending_signals is not None:
+                self.pending_signals.append(message['signal'])
+            else:
+                self.apply_signal(*message['signal'])
+
+    def get(self, path, interface):
+        '''
+        Returns a copy of the properties of an object's interface, or None.
+        '''
+        with self.lock:
+            properties = self.objects.get(path, {}).get(interface)
+            if properties is not None:
+                return dict(properties)
+
+    def get_property(self, path, interface, name, default=None):
+        '''
+        Returns a property value, or default.
+        '''
+        with self.lock:
+            return self.objects.get(path, {}).get(interface, {}).get(
+                name, default)
+
+    def get_interfaces(self, path):
+        '''
+        Returns a list of interfaces of an object.
+        '''
+        with self.lock:
+            return sorted(self.objects.get(path, ()))
+
+    def get_paths(self, interface=None):
+        '''
+        Returns a sorted list of paths of all the objects, or of those
+        implementing interface.
+        '''
+        with self.lock:
+            if interface is None:
+                return sorted(self.objects)
+            return sorted(self.interfaces.get(interface, ()))
+
+    def find(self, interface, **values):
+        '''
+        Returns a sorted list of paths of objects implementing interface with
+        properties equal to values, e.g.
+        tree.find('org.freedesktop.UDisks2.Block', IdType='ext4').
+        '''
+        with self.lock:
+            paths = self.interfaces.get(interface, set())
+            scanned = {}
+            for name, value in values.iteritems():
+                index = self.indexes.get((interface, name))
+                if index is None:
+                    scanned[name] = value
+                else:
+                    paths = paths.intersection(index.get(freeze(value), ()))
+            return sorted(
+                path for path in paths
+                if all(name in self.objects[path][interface] and
+                       self.objects[path][interface][name] == value
+                       for name, value in scanned.iteritems()))
+
+    def close(self):
+        '''
+        Stops following changes. The mirror keeps its last state.
+        '''
+        self.channel.remove_listener(self.handle_message)
+        if self.channel.problem is None:
+            for match in self.matches:
+                self.channel.remove_match(match)
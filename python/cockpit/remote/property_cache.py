@@ -0,0 +1,242 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import threading
+import time
+from collections import OrderedDict
+
+# D-Bus properties interface.
+PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+
+
+def unwrap_variant(value):
+    '''
+    Returns a value of a dbus-json3 variant ({"t": ..., "v": ...}).
+    '''
+    if isinstance(value, dict) and set(value) == set(('t', 'v')):
+        return value['v']
+    return value
+
+
+class PropertyCache(object):
+    '''
+    Opt-in cache of D-Bus property values read via a RemoteDBus or a
+    RemoteService. Entries are keyed by (path, interface, property), expire
+    after ttl seconds and the least recently used ones are evicted over
+    max_size. Every cached (path, interface) is watched, so changes notified
+    by cockpit-ws update the cache; the watch stops with its last entry.
+    '''
+
+    def __init__(self, remote, ttl=60, max_size=1024):
+        self.remote = remote
+        self.channel = remote.channel
+        # Property names of (path, interface) pairs cached by GetAll.
+        self.complete = {}
+        # Number of entries of every cached (path, interface).
+        self.counts = {}
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.watched = set()
+
+        self.channel.add_listener(self.handle_message)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path, interface, name):
+        '''
+        Returns a property value. Properties.Get is called on a cache miss.
+        '''
+        key = (path, interface, name)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] > time.time():
+                self.entries[key] = self.entries.pop(key)
+                return entry[0]
+
+        self.watch(path, interface)
+        try:
+            value = unwrap_variant(self.remote(
+                path, PROPERTIES_INTERFACE, 'Get', [interface, name])[0])
+        except Exception:
+            with self.lock:
+                self.stop_watch((path, interface))
+            raise
+        self.store(path, interface, {name: value})
+        return value
+
+    def get_all(self, path, interface):
+        '''
+        Returns a dict of all the properties of an interface. Values cached by
+        an earlier get_all() are returned while watched and not expired;
+        otherwise Properties.GetAll is called and its result cached.
+        '''
+        with self.lock:
+            values = self.lookup_all(path, interface)
+        if values is not None:
+            return values
+
+        self.watch(path, interface)
+        try:
+            values = self.remote(
+                path, PROPERTIES_INTERFACE, 'GetAll', [interface])[0]
+        except Exception:
+            with self.lock:
+                self.stop_watch((path, interface))
+            raise
+        values = dict((name, unwrap_variant(value))
+                      for name, value in values.iteritems())
+        self.store(path, interface, values, complete=True)
+        return values
+
+    def lookup_all(self, path, interface):
+        '''
+        Returns cached values of all the properties of an interface, or None.
+        The lock must be held.
+        '''
+        names = self.complete.get((path, interface))
+        if names is None or (path, interface) not in self.watched:
+            return None
+        now = time.time()
+        values = {}
+        for name in names:
+            entry = self.entries.get((path, interface, name))
+            if entry is None or entry[1] <= now:
+                return None
+            values[name] = entry[0]
+        for name in names:
+            key = (path, interface, name)
+            self.entries[key] = self.entries.pop(key)
+        return values
+
+    def store(self, path, interface, values, complete=False,
+              watched_only=False):
+        '''
+        Stores a dict of property values of an interface. If complete, values
+        hold all of its properties. With watched_only, values of an unwatched
+        interface are ignored; otherwise the interface is watched again.
+        '''
+        expires = time.time() + self.ttl
+        pair = (path, interface)
+        with self.lock:
+            if pair not in self.watched:
+                if watched_only:
+                    return
+                # The watch stopped, while the values were being read.
+                self.start_watch(pair)
+            for name, value in values.iteritems():
+                key = (path, interface, name)
+                if self.entries.pop(key, None) is None:
+                    self.counts[pair] = self.counts.get(pair, 0) + 1
+                self.entries[key] = (value, expires)
+            if complete and values:
+                self.complete[pair] = set(values)
+            elif pair in self.complete:
+                self.complete[pair].update(values)
+            while len(self.entries) > self.max_size:
+                self.forget(self.entries.popitem(last=False)[0])
+
+    def invalidate(self, path=None, interface=None, name=None):
+        '''
+        Drops cached values matching path, interface and name. None matches
+        anything.
+        '''
+        with self.lock:
+            for key in self.entries.keys():
+                if (path is None or key[0] == path) and \
+                        (interface is None or key[1] == interface) and \
+                        (name is None or key[2] == name):
+                    del self.entries[key]
+                    self.forget(key)
+
+    def forget(self, key):
+        '''
+        Accounts for a dropped entry. The last entry of a (path, interface)
+        stops its watch. The lock must be held.
+        '''
+        pair = key[:2]
+        self.complete.pop(pair, None)
+        self.counts[pair] -= 1
+        if self.counts[pair] == 0:
+            del self.counts[pair]
+            self.stop_watch(pair)
+
+    def watch(self, path, interface):
+        '''
+        Starts watching path and interface, if not watched yet.
+        '''
+        with self.lock:
+            self.start_watch((path, interface))
+
+    def start_watch(self, pair):
+        '''
+        Starts watching a (path, interface), if not watched yet. The lock must
+        be held.
+        '''
+        if pair not in self.watched:
+            self.watched.add(pair)
+            self.channel.watch(*pair, require_response=False)
+
+    def stop_watch(self, pair):
+        '''
+        Stops watching a (path, interface) without cached values. The lock
+        must be held.
+        '''
+        if pair in self.watched and pair not in self.counts:
+            self.watched.remove(pair)
+            self.channel.unwatch(*pair)
+
+    def handle_message(self, message):
+        '''
+        Channel listener. Applies notify messages and PropertiesChanged
+        signals.
+        '''
+        if 'notify' in message:
+            for path, interfaces in message['notify'].iteritems():
+                for interface, values in interfaces.iteritems():
+                    if values is None:
+                        self.invalidate(path, interface)
+                    else:
+                        self.store(path, interface, values, watched_only=True)
+        elif 'signal' in message:
+            path, interface, member, args = message['signal']
+            if interface == PROPERTIES_INTERFACE and \
+                    member == 'PropertiesChanged':
+                changed_interface, changed, invalidated = args
+                self.store(path, changed_interface, dict(
+                    (name, unwrap_variant(value))
+                    for name, value in changed.iteritems()),
+                    watched_only=True)
+                for name in invalidated:
+                    self.invalidate(path, changed_interface, name)
+
+    def close(self):
+        '''
+        Stops watching and drops all the cached values.
+        '''
+        self.channel.remove_listener(self.handle_message)
+        with self.lock:
+            for path, interface in self.watched:
+                self.channel.unwatch(path, interface)
+            self.watched.clear()
+            self.complete.clear()
+            self.counts.clear()
+            self.entries.clear()
@@ -0,0 +1,154 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+from cockpit.remote.typed import TypedPendingCall
+from cockpit.remote.typed import Variant
+from cockpit.remote.typed import get_decoder
+from cockpit.remote.typed import get_encoder
+
+# D-Bus properties interface.
+PROPERTIES_INTERFACE = 'org.freedesktop.DBus.Properties'
+
+# Generated proxy classes by interface name and method signatures. These
+# are shared by all objects (and hosts) with the same interface.
+proxy_classes = {}
+
+
+class ProxyInterface(object):
+    '''
+    Base class of generated interface proxies. Every D-Bus method becomes a
+    method, which takes the arguments as plain Python values (and optionally
+    a timeout keyword) and returns a TypedPendingCall without waiting. See
+    ProxyObject.get_interface().
+    '''
+    __slots__ = ('channel', 'path', 'info')
+
+    def __init__(self, channel, path, info):
+        self.channel = channel
+        self.path = path
+        self.info = info
+
+    def get_property(self, name, timeout=None):
+        '''
+        Returns a property value.
+        '''
+        pending = self.channel.call(
+            self.path, PROPERTIES_INTERFACE, 'Get', [self.info.name, name],
+            timeout=timeout, signature='ss')
+        return get_decoder('v')(pending.wait()[0])
+
+    def set_property(self, name, value, timeout=None):
+        '''
+        Sets a property. The value is encoded as its introspected type.
+        '''
+        signature = self.info.properties.get(name)
+        if signature is None:
+            raise AttributeError(
+                '%s has no property %s' % (self.info.name, name))
+        self.channel.call(
+            self.path, PROPERTIES_INTERFACE, 'Set',
+            [self.info.name, name,
+             get_encoder('v')(Variant(signature, value))],
+            timeout=timeout, signature='ssv').wait()
+
+    def __repr__(self):
+        return '<%s %s>' % (self.info.name, self.path)
+
+
+def make_method_stub(method_info):
+    '''
+    Returns a proxy method of a D-Bus method. Everything but the arguments is
+    bound in advance.
+    '''
+    name = method_info.name
+    signature = method_info.in_signature
+    encode_args = method_info.encode_args
+
+    def stub(self, *args, **kwargs):
+        timeout = kwargs.pop('timeout', None)
+        if kwargs:
+            raise TypeError('%s() got an unexpected keyword argument %r' % (
+                name, kwargs.keys()[0]))
+        pending = self.channel.call(
+            self.path, self.info.name, name, encode_args(args),
+            timeout=timeout, signature=signature)
+        return TypedPendingCall(pending, method_info)
+
+    stub.__name__ = str(name)
+    stub.__doc__ = '%s(%s) -> (%s)' % (
+        name, signature, method_info.out_signature)
+    return stub
+
+
+def get_proxy_class(info):
+    '''
+    Returns a (cached) ProxyInterface subclass of an InterfaceInfo.
+    '''
+    key = (info.name, tuple(sorted(
+        (m.name, m.in_signature, m.out_signature)
+        for m in info.methods.itervalues())))
+    cls = proxy_classes.get(key)
+    if cls is None:
+        members = {'__slots__': ()}
+        for method_info in info.methods.itervalues():
+            if hasattr(ProxyInterface, method_info.name):
+                # Never shadow the proxy's own attributes.
+                continue
+            members[str(method_info.name)] = make_method_stub(method_info)
+        cls = type(str(info.name.replace('.', '_')), (ProxyInterface,),
+                   members)
+        cls = proxy_classes.setdefault(key, cls)
+    return cls
+
+
+class ProxyObject(object):
+    '''
+    Proxy of a remote D-Bus object. See RemoteDBus.get_object().
+    '''
+
+    def __init__(self, remote, path, cache):
+        self.remote = remote
+        self.path = path
+        self.cache = cache
+        self.interfaces = {}
+
+    def get_interface(self, interface, timeout=None):
+        '''
+        Returns a ProxyInterface, whose methods call methods of interface.
+        Raises MarshalError, if the object doesn't implement it.
+        '''
+        proxy = self.interfaces.get(interface)
+        if proxy is None:
+            info = self.cache.get_interface(
+                self.remote, self.path, interface, timeout)
+            proxy = get_proxy_class(info)(self.remote.channel, self.path, info)
+            self.interfaces[interface] = proxy
+        return proxy
+
+    def get_children(self, timeout=None):
+        '''
+        Returns ProxyObject objects of child nodes.
+        '''
+        children = self.cache.get_object(self.remote, self.path, timeout)[1]
+        prefix = self.path.rstrip('/')
+        return [ProxyObject(self.remote, '%s/%s' % (prefix, child), self.cache)
+                for child in children]
+
+    def __repr__(self):
+        return '<ProxyObject %s>' % self.path
@@ -17,7 +17,111 @@
 # ##### END LICENSE BLOCK #####
 
 from cockpit.client import CockpitClient
-from cockpit.client import util
+from cockpit.client import ReconnectingCockpitClient
+from cockpit.client.channel import CallTimeoutError
+from cockpit.client.channel import DBusError
+from cockpit.client.channel import iter_completed
+from cockpit.client.channel import wait_all
+from cockpit.remote.proxy import ProxyObject
+from cockpit.remote.signals import BLOCK_TIMEOUT
+from cockpit.remote.signals import POLICY_DROP_OLDEST
+from cockpit.remote.signals import Subscription
+from cockpit.remote.typed import IntrospectionCache
+
+
+class RemoteService(object):
+    '''
+    Handle of a D-Bus service reached via its own channel of a shared
+    connection. RemoteDBus makes its calls via a default one; others are
+    returned by RemoteDBus.get_service().
+    '''
+
+    def __init__(self, remote, channel, service, bus):
+        self.remote = remote
+        self.channel = channel
+        self.service = service
+        self.bus = bus
+
+    def close(self):
+        '''
+        Closes the service channel. The connection stays open.
+        '''
+        self.channel.close()
+        self.remote.services.pop((self.bus, self.service), None)
+
+    def __call__(self, path, interface, method, args, require_response=True,
+                 idempotent=False, timeout=None):
+        '''
+        Performs a remote D-Bus call. Returns the reply arguments. A call
+        without a reply within timeout seconds raises CallTimeoutError; the
+        connection stays usable.
+        '''
+        pending = self.send_call(path, interface, method, args,
+                                 require_response, idempotent, timeout)
+        if pending is not None:
+            return pending.wait()
+
+    def send_call(self, path, interface, method, args, require_response=True,
+                  idempotent=False, timeout=None):
+        '''
+        Sends a remote D-Bus call without waiting for its reply. Returns a
+        PendingCall object (see PendingCall.wait()), or None, when no response
+        is required. Several calls can be sent before waiting for any of them.
+        Idempotent calls are sent again, if a reconnecting session is restored
+        before their reply arrives. A call with a timeout is cancelled, if its
+        reply doesn't arrive in time (see PendingCall.wait()).
+        '''
+        return self.channel.call(path, interface, method, args,
+                                 require_response, idempotent, timeout)
+
+    def send_many(self, calls, idempotent=False, timeout=None):
+        '''
+        Sends a list of (path, interface, method, args) calls with as few
+        writes as possible. Returns a list of PendingCall objects; see also
+        cockpit.client.channel.iter_completed().
+        '''
+        return self.channel.call_many(calls, idempotent, timeout)
+
+    def call_many(self, calls, return_exceptions=False, idempotent=False,
+                  timeout=None):
+        '''
+        Performs a list of (path, interface, method, args) calls. All of them
+        are sent at once, then the replies are gathered. Returns a list of
+        reply arguments in the order of calls. If return_exceptions is True,
+        errors are returned in place of replies instead of being raised.
+        Calls, which don't finish within timeout seconds, fail with
+        CallTimeoutError.
+        '''
+        return wait_all(
+            self.send_many(calls, idempotent, timeout), return_exceptions)
+
+    def subscribe(self, match, max_size=1024, policy=POLICY_DROP_OLDEST,
+                  block_timeout=BLOCK_TIMEOUT):
+        '''
+        Subscribes for D-Bus signals described by match, a dict (keys path,
+        path_namespace, interface, member, arg0) or a match rule string.
+        Returns a Subscription, which iterates over SignalEvent objects. See
+        Subscription for buffer policies and block_timeout.
+        '''
+        return Subscription(
+            self.channel, match, max_size, policy, block_timeout)
+
+    def get_object(self, path, cache=None):
+        '''
+        Returns a ProxyObject of path. Its interfaces have methods generated
+        from introspection, which return TypedPendingCall objects:
+
+            obj = remote.get_object('/org/freedesktop/hostname1')
+            hostname = obj.get_interface('org.freedesktop.hostname1')
+            pending = hostname.SetHostname('box', False)
+            pending.wait()
+
+        Introspection is cached by cache, an IntrospectionCache, which can be
+        shared by many remotes; each RemoteDBus has its own by default.
+        '''
+        if cache is None:
+            cache = self.remote.introspection_cache
+        return ProxyObject(self, path, cache)
 
 
 class RemoteDBus(object):
@@ -26,30 +130,100 @@ class RemoteDBus(object):
     '''
 
     def __init__(self, url, username, password, service, no_verification=False,
-                 bus='session', debug=False):
-        self.client = CockpitClient(url, no_verification, debug)
-        self.client.connect(username, password)
-        self.channel_id = self.client.open_channel_dbus_json3(
-            username=username, password=password,
-            bus=bus, service=service)
+                 bus='session', debug=False, pool=None, session_store=None,
+                 reconnect=False, metrics=None, tracer=None,
+                 connect_timeout=None):
+        if pool is not None:
+            # Reuse a pooled session; no_verification, debug, metrics and
+            # tracer are set by the pool, connect_timeout doesn't apply.
+            self.client = pool.get_client(url, username, password)
+        elif reconnect:
+            # The session survives cockpit-ws restarts; see
+            # ReconnectingCockpitClient.
+            self.client = ReconnectingCockpitClient(
+                url, no_verification, debug, session_store, metrics=metrics,
+                tracer=tracer)
+            self.client.connect(username, password, connect_timeout)
+        else:
+            self.client = CockpitClient(
+                url, no_verification, debug, session_store, metrics, tracer)
+            self.client.connect(username, password, connect_timeout)
+        self.bus = bus
+        self.service = service
+        self.pool = pool
+        self.introspection_cache = IntrospectionCache()
+        self.services = {}
+        try:
+            self.channel = self.client.open_dbus_channel(
+                username=username, password=password,
+                bus=bus, service=service)
+        except Exception:
+            if pool is not None:
+                pool.release(self.client)
+            raise
+        self.channel_id = self.channel.channel_id
+        # Calls of this object are made via the default service handle.
+        self.default_service = RemoteService(self, self.channel, service, bus)
 
     def close(self):
         '''
-        Closes a channel and disconnects from cockpit-ws.
+        Closes a channel and disconnects from cockpit-ws. A pooled session is
+        returned to its pool instead.
+        '''
+        for handle in self.services.values():
+            handle.close()
+        self.channel.close()
+        if self.pool is not None:
+            self.pool.release(self.client)
+        else:
+            self.client.disconnect()
+
+    def get_service(self, service, bus=None):
+        '''
+        Returns a RemoteService handle for a D-Bus service on bus (the bus of
+        this object by default). Every service gets its own channel on the
+        same connection, opened on the first use.
+        '''
+        bus = bus or self.bus
+        handle = self.services.get((bus, service))
+        if handle is None or handle.channel.problem is not None:
+            channel = self.client.open_dbus_channel(bus=bus, service=service)
+            handle = RemoteService(self, channel, service, bus)
+            self.services[(bus, service)] = handle
+        return handle
+
+    def __call__(self, *args, **kwargs):
+        '''
+        Performs a remote D-Bus call. See RemoteService.__call__().
         '''
-        self.client.close_channel_with_id(self. channel_id)
-        self.client.disconnect()
+        return self.default_service(*args, **kwargs)
 
-    def __call__(self, path, interface, method, args, require_response=True):
+    def send_call(self, *args, **kwargs):
         '''
-        Performs a remote D-Bus call.
+        Sends a remote D-Bus call. See RemoteService.send_call().
         '''
-        self.client.send_message(
-            self.channel_id,
-            util.make_json(
-                call=[path, interface, method, args],
-                id='cookie' if require_response else None))
+        return self.default_service.send_call(*args, **kwargs)
 
-        if require_response:
-            # TODO: implement
-            return self.client.recv_message()
+    def send_many(self, *args, **kwargs):
+        '''
+        Sends a list of calls. See RemoteService.send_many().
+        '''
+        return self.default_service.send_many(*args, **kwargs)
+
+    def call_many(self, *args, **kwargs):
+        '''
+        Performs a list of calls. See RemoteService.call_many().
+        '''
+        return self.default_service.call_many(*args, **kwargs)
+
+    def subscribe(self, *args, **kwargs):
+        '''
+        Subscribes for D-Bus signals. See RemoteService.subscribe().
+        '''
+        return self.default_service.subscribe(*args, **kwargs)
+
+    def get_object(self, *args, **kwargs):
+        '''
+        Returns a ProxyObject of a path. See RemoteService.get_object().
+        '''
+        return self.default_service.get_object(*args, **kwargs)
@@ -0,0 +1,237 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from collections import deque
+from collections import namedtuple
+
+# Backpressure policies of a full Subscription buffer.
+POLICY_DROP_OLDEST = 'drop-oldest'
+POLICY_BLOCK = 'block'
+POLICY_COALESCE = 'coalesce'
+
+# Default number of seconds POLICY_BLOCK blocks the dispatcher thread.
+BLOCK_TIMEOUT = 1.0
+
+# Match rule keys supported by dbus-json3.
+MATCH_KEYS = ('path', 'path_namespace', 'interface', 'member', 'arg0')
+
+
+class SignalEvent(namedtuple('SignalEvent', 'path interface member args')):
+    '''
+    Received D-Bus signal.
+    '''
+    __slots__ = ()
+
+
+def parse_match_rule(match_rule):
+    '''
+    Returns a match dict from a D-Bus match rule string, e.g.
+    "type='signal',interface='org.foo',member='Bar'".
+    '''
+    match = {}
+    for key, value in re.findall(r"(\w+)='([^']*)'", match_rule):
+        if key in MATCH_KEYS:
+            match[key] = value
+        elif key != 'type':
+            raise ValueError('unsupported match key %s' % key)
+    return match
+
+
+class Subscription(object):
+    '''
+    Stream of D-Bus signals matching a match rule. Received signals are kept
+    in a buffer of max_size events. When it's full, the policy decides:
+    POLICY_DROP_OLDEST drops the oldest event, POLICY_BLOCK blocks the
+    dispatcher thread until there's room, POLICY_COALESCE keeps only the
+    newest event of each (path, interface, member) and drops the oldest one
+    otherwise.
+
+    POLICY_BLOCK stalls the whole client: the dispatcher thread serves all
+    of its channels, so no reply or signal of any of them is received while
+    it's blocked. It blocks at most block_timeout seconds (None waits for
+    the consumer indefinitely) and drops the oldest event then; without a
+    dispatcher it drops the oldest event right away.
+    '''
+
+    def __init__(self, channel, match, max_size=1024,
+                 policy=POLICY_DROP_OLDEST, block_timeout=BLOCK_TIMEOUT):
+        if policy not in (POLICY_DROP_OLDEST, POLICY_BLOCK, POLICY_COALESCE):
+            raise ValueError('unknown policy %s' % policy)
+
+        if isinstance(match, basestring):
+            match = parse_match_rule(match)
+
+        self.channel = channel
+        self.closed = False
+        self.block_timeout = block_timeout
+        self.cond = threading.Condition()
+        self.dropped = 0
+        self.match = dict(match)
+        self.max_size = max_size
+        self.policy = policy
+        if policy == POLICY_COALESCE:
+            self.events = OrderedDict()
+        else:
+            self.events = deque()
+
+        self.channel.add_listener(self.handle_message)
+        self.channel.add_match(self.match, require_response=False)
+
+    def __iter__(self):
+        while True:
+            event = self.get()
+            if event is None:
+                return
+            yield event
+
+    def matches(self, event):
+        '''
+        Returns True, if the event matches the match rule. Several
+        subscriptions can share one channel, so signals are filtered also on
+        the client side.
+        '''
+        match = self.match
+        if 'path' in match and event.path != match['path']:
+            return False
+        if 'path_namespace' in match:
+            namespace = match['path_namespace'].rstrip('/')
+            if event.path != namespace and \
+                    not event.path.startswith(namespace + '/'):
+                return False
+        if 'interface' in match and event.interface != match['interface']:
+            return False
+        if 'member' in match and event.member != match['member']:
+            return False
+        if 'arg0' in match and \
+                (not event.args or event.args[0] != match['arg0']):
+            return False
+        return True
+
+    def handle_message(self, message):
+        '''
+        Channel listener.
+        '''
+        if 'closed' in message:
+            self.set_closed()
+            return
+
+        if 'signal' not in message:
+            return
+
+        event = SignalEvent(*message['signal'])
+        if self.matches(event):
+            self.put(event)
+
+    def put(self, event):
+        '''
+        Buffers an event according to the policy.
+        '''
+        with self.cond:
+            if self.closed:
+                return
+
+            if self.policy == POLICY_COALESCE:
+                key = event[:3]
+                if key in self.events:
+                    del self.events[key]
+                    self.dropped += 1
+                elif len(self.events) >= self.max_size:
+                    self.events.popitem(last=False)
+                    self.dropped += 1
+                self.events[key] = event
+            else:
+                if len(self.events) >= self.max_size and \
+                        self.policy == POLICY_BLOCK and \
+                        self.channel.client.is_dispatching:
+                    self.wait_for_room()
+                if len(self.events) >= self.max_size:
+                    self.events.popleft()
+                    self.dropped += 1
+                self.events.append(event)
+
+            self.cond.notify_all()
+
+    def wait_for_room(self):
+        '''
+        Waits up to block_timeout seconds for room in the buffer. The
+        condition must be held.
+        '''
+        deadline = None
+        if self.block_timeout is not None:
+            deadline = time.time() + self.block_timeout
+        while len(self.events) >= self.max_size and not self.closed:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return
+            self.cond.wait(remaining)
+
+    def pop_event(self):
+        if self.policy == POLICY_COALESCE:
+            return self.events.popitem(last=False)[1]
+        return self.events.popleft()
+
+    def get(self, timeout=None):
+        '''
+        Returns a next SignalEvent. Returns None, when the subscription is
+        closed or the timeout expires.
+        '''
+        client = self.channel.client
+        deadline = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+        while True:
+            with self.cond:
+                if self.events:
+                    event = self.pop_event()
+                    self.cond.notify_all()
+                    return event
+                if self.closed:
+                    return None
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                if client.is_dispatching:
+                    self.cond.wait(remaining)
+                    continue
+
+            client.process_message(remaining)
+
+    def set_closed(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def close(self):
+        '''
+        Unsubscribes. Buffered events can still be read.
+        '''
+        if self.closed:
+            return
+        self.set_closed()
+        self.channel.remove_listener(self.handle_message)
+        if self.channel.problem is None:
+            self.channel.remove_match(self.match)
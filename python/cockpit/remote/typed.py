@@ -0,0 +1,544 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import base64
+import re
+import threading
+import xml.etree.ElementTree as ElementTree
+from collections import OrderedDict
+from collections import namedtuple
+
+# D-Bus introspection interface.
+INTROSPECTABLE_INTERFACE = 'org.freedesktop.DBus.Introspectable'
+
+# Value ranges of D-Bus integer types.
+INTEGER_RANGES = {
+    'y': (0, 2 ** 8 - 1),
+    'n': (-2 ** 15, 2 ** 15 - 1),
+    'q': (0, 2 ** 16 - 1),
+    'i': (-2 ** 31, 2 ** 31 - 1),
+    'u': (0, 2 ** 32 - 1),
+    'x': (-2 ** 63, 2 ** 63 - 1),
+    't': (0, 2 ** 64 - 1),
+    # A file descriptor is passed as its index in the message.
+    'h': (0, 2 ** 32 - 1),
+}
+
+BASIC_TYPES = frozenset('ynqiuxtdbsogh')
+
+OBJECT_PATH_RE = re.compile(r'^/([A-Za-z0-9_]+(/[A-Za-z0-9_]+)*)?$')
+
+
+class MarshalError(ValueError):
+    '''
+    Raised, when a value doesn't match its D-Bus signature, or a signature is
+    invalid or unknown.
+    '''
+
+
+class Variant(namedtuple('Variant', 'signature value')):
+    '''
+    Value of a D-Bus variant with an explicit signature. Variants of other
+    values get a signature guessed from their Python type.
+    '''
+    __slots__ = ()
+
+
+def get_type_end(signature, start):
+    '''
+    Returns an index past the complete type starting at start.
+    '''
+    try:
+        code = signature[start]
+    except IndexError:
+        raise MarshalError('Incomplete signature: %r' % signature)
+
+    if code in BASIC_TYPES or code == 'v':
+        return start + 1
+    if code == 'a':
+        return get_type_end(signature, start + 1)
+    if code in '({':
+        close = ')' if code == '(' else '}'
+        pos = start + 1
+        while True:
+            if pos >= len(signature):
+                raise MarshalError('Incomplete signature: %r' % signature)
+            if signature[pos] == close:
+                return pos + 1
+            pos = get_type_end(signature, pos)
+    raise MarshalError('Invalid signature: %r' % signature)
+
+
+def split_signature(signature):
+    '''
+    Returns a list of complete types of a signature.
+    '''
+    types = []
+    pos = 0
+    while pos < len(signature):
+        end = get_type_end(signature, pos)
+        types.append(signature[pos:end])
+        pos = end
+    return types
+
+
+def guess_signature(value):
+    '''
+    Returns a D-Bus signature of a Python value for a variant.
+    '''
+    if isinstance(value, Variant):
+        return 'v'
+    if isinstance(value, bool):
+        return 'b'
+    if isinstance(value, (int, long)):
+        low, high = INTEGER_RANGES['i']
+        return 'i' if low <= value <= high else 'x'
+    if isinstance(value, float):
+        return 'd'
+    if isinstance(value, basestring):
+        return 's'
+    if isinstance(value, tuple):
+        return '(%s)' % ''.join(guess_signature(member) for member in value)
+    if isinstance(value, list):
+        return 'av'
+    if isinstance(value, dict):
+        return 'a{sv}'
+    raise MarshalError('Can\'t guess a D-Bus type of %r' % (value,))
+
+
+def make_integer_encoder(code):
+    low, high = INTEGER_RANGES[code]
+
+    def encode(value):
+        if isinstance(value, bool) or not isinstance(value, (int, long)):
+            raise MarshalError(
+                'Expected an integer (%s), got %r' % (code, value))
+        if not low <= value <= high:
+            raise MarshalError(
+                '%r out of range of D-Bus type %s' % (value, code))
+        return value
+    return encode
+
+
+def encode_double(value):
+    if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+        raise MarshalError('Expected a number (d), got %r' % (value,))
+    return float(value)
+
+
+def encode_boolean(value):
+    if not isinstance(value, bool):
+        raise MarshalError('Expected a boolean (b), got %r' % (value,))
+    return value
+
+
+def encode_string(value):
+    if not isinstance(value, basestring):
+        raise MarshalError('Expected a string (s), got %r' % (value,))
+    return value
+
+
+def encode_object_path(value):
+    if not isinstance(value, basestring) or not OBJECT_PATH_RE.match(value):
+        raise MarshalError('Expected an object path (o), got %r' % (value,))
+    return value
+
+
+def encode_signature(value):
+    if not isinstance(value, basestring):
+        raise MarshalError('Expected a signature (g), got %r' % (value,))
+    split_signature(value)
+    return value
+
+
+def encode_variant(value):
+    if isinstance(value, Variant):
+        signature, value = value
+    else:
+        signature = guess_signature(value)
+    return {'t': signature, 'v': get_encoder(signature)(value)}
+
+
+def encode_bytes(value):
+    if isinstance(value, bytearray):
+        value = bytes(value)
+    if not isinstance(value, str):
+        raise MarshalError('Expected bytes (ay), got %r' % (value,))
+    return base64.b64encode(value)
+
+
+def encode_dict_key(code):
+    encode = get_encoder(code)
+    if code == 'b':
+        return lambda key: 'true' if encode(key) else 'false'
+    if code in 'sog':
+        return encode
+    return lambda key: str(encode(key))
+
+
+BASIC_ENCODERS = {
+    'd': encode_double,
+    'b': encode_boolean,
+    's': encode_string,
+    'o': encode_object_path,
+    'g': encode_signature,
+    'v': encode_variant,
+}
+
+
+def compile_encoder(signature):
+    '''
+    Returns a function encoding a Python value of a single complete type to
+    its dbus-json3 form.
+    '''
+    code = signature[0]
+    if code in INTEGER_RANGES:
+        return make_integer_encoder(code)
+    if code in BASIC_ENCODERS:
+        return BASIC_ENCODERS[code]
+    if signature == 'ay':
+        return encode_bytes
+    if code == 'a' and signature[1] == '{':
+        key_type, value_type = split_signature(signature[2:-1])
+        encode_key = encode_dict_key(key_type)
+        encode_value = get_encoder(value_type)
+
+        def encode_dict(value):
+            if not isinstance(value, dict):
+                raise MarshalError(
+                    'Expected a dict (%s), got %r' % (signature, value))
+            return dict((encode_key(key), encode_value(item))
+                        for key, item in value.iteritems())
+        return encode_dict
+    if code == 'a':
+        encode_item = get_encoder(signature[1:])
+
+        def encode_array(value):
+            if isinstance(value, (basestring, dict)) or \
+                    not hasattr(value, '__iter__'):
+                raise MarshalError(
+                    'Expected a sequence (%s), got %r' % (signature, value))
+            return [encode_item(item) for item in value]
+        return encode_array
+    if code == '(':
+        encoders = [get_encoder(member)
+                    for member in split_signature(signature[1:-1])]
+
+        def encode_struct(value):
+            if not isinstance(value, (tuple, list)) or \
+                    len(value) != len(encoders):
+                raise MarshalError(
+                    'Expected a %d-tuple (%s), got %r' % (
+                        len(encoders), signature, value))
+            return [encode(member)
+                    for encode, member in zip(encoders, value)]
+        return encode_struct
+    raise MarshalError('Unsupported D-Bus type: %s' % signature)
+
+
+def decode_variant(value):
+    return get_decoder(value['t'])(value['v'])
+
+
+def identity(value):
+    return value
+
+
+def decode_dict_key(code):
+    if code in INTEGER_RANGES:
+        return int
+    if code == 'd':
+        return float
+    if code == 'b':
+        return lambda key: key == 'true'
+    return identity
+
+
+def compile_decoder(signature):
+    '''
+    Returns a function decoding a dbus-json3 value of a single complete type
+    to a Python value. Variants are unwrapped; structs become tuples.
+    '''
+    code = signature[0]
+    if code in BASIC_TYPES:
+        return identity
+    if code == 'v':
+        return decode_variant
+    if signature == 'ay':
+        return base64.b64decode
+    if code == 'a' and signature[1] == '{':
+        key_type, value_type = split_signature(signature[2:-1])
+        decode_key = decode_dict_key(key_type)
+        decode_value = get_decoder(value_type)
+        if decode_key is identity and decode_value is identity:
+            return identity
+        return lambda value: dict(
+            (decode_key(key), decode_value(item))
+            for key, item in value.iteritems())
+    if code == 'a':
+        decode_item = get_decoder(signature[1:])
+        if decode_item is identity:
+            return identity
+        return lambda value: [decode_item(item) for item in value]
+    if code == '(':
+        decoders = [get_decoder(member)
+                    for member in split_signature(signature[1:-1])]
+        return lambda value: tuple(
+            decode(member) for decode, member in zip(decoders, value))
+    raise MarshalError('Unsupported D-Bus type: %s' % signature)
+
+
+# Compiled encoders and decoders by signature. There are few distinct
+# signatures, so these are never evicted.
+encoders = {}
+decoders = {}
+
+
+def get_encoder(signature):
+    '''
+    Returns a (cached) encoder of a single complete type.
+    '''
+    encoder = encoders.get(signature)
+    if encoder is None:
+        encoder = encoders[signature] = compile_encoder(signature)
+    return encoder
+
+
+def get_decoder(signature):
+    '''
+    Returns a (cached) decoder of a single complete type.
+    '''
+    decoder = decoders.get(signature)
+    if decoder is None:
+        decoder = decoders[signature] = compile_decoder(signature)
+    return decoder
+
+
+class MethodInfo(object):
+    '''
+    Introspected D-Bus method with encoders of its arguments and decoders of
+    its reply. They are compiled on the first call, so a signature, which
+    can't be marshalled, breaks only its own method.
+    '''
+
+    def __init__(self, name, in_types, out_types):
+        self.name = name
+        self.in_types = in_types
+        self.out_types = out_types
+        self.in_signature = ''.join(in_types)
+        self.out_signature = ''.join(out_types)
+        self.encoders = None
+        self.decoders = None
+
+    def encode_args(self, args):
+        '''
+        Returns arguments in dbus-json3 form. Raises MarshalError, if they
+        don't match the signature.
+        '''
+        if self.encoders is None:
+            self.encoders = [get_encoder(t) for t in self.in_types]
+        if len(args) != len(self.encoders):
+            raise MarshalError('%s takes %d arguments (%s), %d given' % (
+                self.name, len(self.encoders), self.in_signature, len(args)))
+        return [encode(arg) for encode, arg in zip(self.encoders, args)]
+
+    def decode_reply(self, reply):
+        '''
+        Returns Python values of reply arguments: None for no value, the value
+        itself for one and a tuple for more of them.
+        '''
+        if self.decoders is None:
+            self.decoders = [get_decoder(t) for t in self.out_types]
+        values = [decode(value) for decode, value in zip(self.decoders, reply)]
+        if not values:
+            return None
+        if len(values) == 1:
+            return values[0]
+        return tuple(values)
+
+
+class InterfaceInfo(object):
+    '''
+    Introspected D-Bus interface: methods by name, property signatures by
+    name and signal signatures by name.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.methods = {}
+        self.properties = {}
+        self.signals = {}
+
+
+def parse_introspection(data):
+    '''
+    Parses D-Bus introspection XML. Returns a tuple of a dict of
+    InterfaceInfo objects by name and a list of child node names.
+    '''
+    root = ElementTree.fromstring(
+        data.encode('utf8') if isinstance(data, unicode) else data)
+    interfaces = {}
+    for element in root.findall('interface'):
+        info = InterfaceInfo(element.get('name'))
+        for method in element.findall('method'):
+            in_types = []
+            out_types = []
+            for arg in method.findall('arg'):
+                if arg.get('direction', 'in') == 'in':
+                    in_types.append(arg.get('type'))
+                else:
+                    out_types.append(arg.get('type'))
+            info.methods[method.get('name')] = MethodInfo(
+                method.get('name'), in_types, out_types)
+        for prop in element.findall('property'):
+            info.properties[prop.get('name')] = prop.get('type')
+        for signal in element.findall('signal'):
+            info.signals[signal.get('name')] = ''.join(
+                arg.get('type') for arg in signal.findall('arg'))
+        interfaces[info.name] = info
+    children = [node.get('name') for node in root.findall('node')
+                if node.get('name')]
+    return interfaces, children
+
+
+def get_remote_key(remote):
+    '''
+    Returns a (url, bus, service) tuple of a RemoteDBus or a RemoteService.
+    '''
+    return (remote.channel.client.url, remote.bus, remote.service)
+
+
+class IntrospectionCache(object):
+    '''
+    LRU cache of parsed introspection data keyed by (url, bus, service, path).
+    Every object is introspected once, until it's evicted over max_size. One
+    cache can be shared by many RemoteDBus and RemoteService objects.
+    '''
+
+    def __init__(self, max_size=256):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.max_size = max_size
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get_object(self, remote, path, timeout=None):
+        '''
+        Returns a tuple of a dict of InterfaceInfo objects and a list of child
+        node names of path, introspecting it via remote, if not cached.
+        '''
+        key = get_remote_key(remote) + (path,)
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.entries[key] = entry
+                return entry
+
+        reply = remote(path, INTROSPECTABLE_INTERFACE, 'Introspect', [],
+                       timeout=timeout)
+        entry = parse_introspection(reply[0])
+
+        with self.lock:
+            self.entries[key] = entry
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def get_interface(self, remote, path, interface, timeout=None):
+        '''
+        Returns an InterfaceInfo. Raises MarshalError, if path doesn't
+        implement interface.
+        '''
+        info = self.get_object(remote, path, timeout)[0].get(interface)
+        if info is None:
+            raise MarshalError('%s doesn\'t implement %s' % (path, interface))
+        return info
+
+    def get_method(self, remote, path, interface, method, timeout=None):
+        '''
+        Returns a MethodInfo. Raises MarshalError for unknown methods.
+        '''
+        info = self.get_interface(remote, path, interface, timeout)
+        method_info = info.methods.get(method)
+        if method_info is None:
+            raise MarshalError('%s has no method %s' % (interface, method))
+        return method_info
+
+    def invalidate(self, remote=None, path=None):
+        '''
+        Drops cached objects of remote (and path), or everything.
+        '''
+        with self.lock:
+            if remote is None:
+                self.entries.clear()
+                return
+            remote_key = get_remote_key(remote)
+            for key in list(self.entries):
+                if key[:3] == remote_key and (path is None or key[3] == path):
+                    del self.entries[key]
+
+
+class TypedPendingCall(object):
+    '''
+    PendingCall, whose reply is decoded by a MethodInfo.
+    '''
+    __slots__ = ('pending', 'method_info')
+
+    def __init__(self, pending, method_info):
+        self.pending = pending
+        self.method_info = method_info
+
+    def cancel(self, error=None):
+        return self.pending.cancel(error)
+
+    def wait(self, timeout=None):
+        return self.method_info.decode_reply(self.pending.wait(timeout))
+
+
+class TypedCaller(object):
+    '''
+    Makes D-Bus calls via a RemoteDBus or a RemoteService with arguments and
+    replies as plain Python values. Signatures come from introspection cached
+    by an IntrospectionCache, so arguments are checked before they're sent
+    and cockpit-ws doesn't have to introspect the method either.
+    '''
+
+    def __init__(self, remote, cache=None):
+        self.remote = remote
+        self.cache = cache if cache is not None else IntrospectionCache()
+
+    def send_call(self, path, interface, method, args, timeout=None):
+        '''
+        Sends a call. Returns a TypedPendingCall. Raises MarshalError, if args
+        don't match the method signature.
+        '''
+        method_info = self.cache.get_method(
+            self.remote, path, interface, method, timeout)
+        pending = self.remote.channel.call(
+            path, interface, method, method_info.encode_args(args),
+            timeout=timeout, signature=method_info.in_signature)
+        return TypedPendingCall(pending, method_info)
+
+    def call(self, path, interface, method, args, timeout=None):
+        '''
+        Performs a call. Returns None, a value, or a tuple of values, as the
+        method returns zero, one or more values.
+        '''
+        return self.send_call(path, interface, method, args, timeout).wait()
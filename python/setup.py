@@ -45,6 +45,7 @@ setup(
         'Environment :: Console',
     ],
     install_requires=['websocket-client >= 0.14.1'],
+    extras_require={'ujson': ['ujson']},
     namespace_packages=['cockpit'],
     packages=(
         [ 'cockpit'
@@ -0,0 +1,144 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import socket
+import threading
+import time
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client.client import CockpitAuthError
+from cockpit.client.client import CockpitProtocolError
+from cockpit.client.channel import ChannelError
+from cockpit.client.eventloop import EventLoop
+from cockpit.client.eventloop import Future
+from cockpit.remote import AsyncRemoteDBus
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class AsyncCockpitClientTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.loop = EventLoop()
+
+    def tearDown(self):
+        self.server.stop()
+        self.loop.close()
+
+    def connect(self):
+        remote = AsyncRemoteDBus(self.server.url, SERVICE, loop=self.loop)
+        return self.loop.run_until_complete(remote.connect('user', 'pass'))
+
+    def test_init_problem(self):
+        self.server.init_problem = 'authentication-failed'
+        self.assertRaises(CockpitAuthError, self.connect)
+        self.server.init_problem = 'internal-error'
+        self.assertRaises(CockpitProtocolError, self.connect)
+
+    def test_reply_before_eof(self):
+        # The reply and the end of the connection arrive together.
+        for i in range(10):
+            remote = self.connect()
+            self.assertEqual(self.loop.run_until_complete(
+                remote.call(PATH, SERVICE, 'Quit', [i])), [i])
+            remote.close()
+
+    def test_handler_error(self):
+        def broken_handler(message):
+            raise ValueError(message)
+
+        broken = self.connect()
+        remote = self.connect()
+        broken.client.ws.set_message_handler(broken_handler)
+        self.assertRaises(ChannelError, self.loop.run_until_complete,
+                          broken.call(PATH, SERVICE, 'Echo', [1]))
+        # Other connections on the loop are not affected.
+        self.assertEqual(self.loop.run_until_complete(
+            remote.call(PATH, SERVICE, 'Echo', [2])), [2])
+        remote.close()
+        broken.close()
+
+    def test_frames(self):
+        # Many frames arrive in one read, a large one across many reads.
+        remote = self.connect()
+        size = 4 * 1024 * 1024
+        calls = [remote.call(PATH, SERVICE, 'Echo', [i]) for i in range(100)]
+        calls.append(remote.call(PATH, SERVICE, 'Payload', [size]))
+        replies = [self.loop.run_until_complete(call) for call in calls]
+        self.assertEqual(replies[:100], [[i] for i in range(100)])
+        self.assertEqual(len(replies[100][0]), size)
+        remote.close()
+
+    def test_resolve_in_thread(self):
+        getaddrinfo = socket.getaddrinfo
+        ticks = []
+
+        def slow_getaddrinfo(*args):
+            time.sleep(0.2)
+            return getaddrinfo(*args)
+
+        def tick():
+            ticks.append(time.time())
+            self.loop.call_later(0.01, tick)
+
+        self.loop.call_soon(tick)
+        socket.getaddrinfo = slow_getaddrinfo
+        try:
+            remote = self.connect()
+        finally:
+            socket.getaddrinfo = getaddrinfo
+        # The loop kept running, while the host name was resolved.
+        self.assertGreater(len(ticks), 5)
+        remote.close()
+
+
+class EventLoopTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = EventLoop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_call_soon_threadsafe(self):
+        future = Future()
+        thread = threading.Thread(target=lambda: (
+            time.sleep(0.05),
+            self.loop.call_soon_threadsafe(future.set_result, 1)))
+        thread.start()
+        started = time.time()
+        # The pipe wakes up poll() long before its timeout.
+        while not future.done:
+            self.loop.run_once(10)
+        self.assertLess(time.time() - started, 5)
+        self.assertEqual(future.result(), 1)
+        thread.join()
+
+    def test_run_in_thread(self):
+        self.assertEqual(
+            self.loop.run_until_complete(self.loop.run_in_thread(max, 1, 2)),
+            2)
+        self.assertRaises(
+            ValueError, self.loop.run_until_complete,
+            self.loop.run_in_thread(int, 'x'))
+
+
+if __name__ == '__main__':
+    unittest.main()
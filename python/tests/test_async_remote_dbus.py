@@ -0,0 +1,60 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client.eventloop import EventLoop
+from cockpit.remote import AsyncRemoteDBus
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class AsyncRemoteServiceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.loop = EventLoop()
+        self.remote = AsyncRemoteDBus(self.server.url, SERVICE, loop=self.loop)
+        self.loop.run_until_complete(self.remote.connect('user', 'pass'))
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.stop()
+        self.loop.close()
+
+    def test_call(self):
+        service = self.remote.get_service('org.fake.Other')
+        self.assertEqual(self.loop.run_until_complete(
+            service.call(PATH, SERVICE, 'Echo', [1, 2])), [1, 2])
+
+    def test_call_many(self):
+        service = self.remote.get_service('org.fake.Other')
+        calls = [(PATH, SERVICE, 'Echo', [i]) for i in range(3)]
+        self.assertEqual(self.loop.run_until_complete(
+            service.call_many(calls)), [[0], [1], [2]])
+
+    def test_no_sync_api(self):
+        service = self.remote.get_service('org.fake.Other')
+        self.assertFalse(hasattr(service, 'get_service'))
+        self.assertFalse(callable(service))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,218 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import threading
+import time
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client import CockpitClient
+from cockpit.client import FlowControlError
+from cockpit.client.channel import CallTimeoutError
+from cockpit.client.channel import DBusChannel
+from cockpit.client.channel import DBusError
+from cockpit.client.channel import PendingCall
+from cockpit.client.channel import QueueChannel
+from cockpit.client.channel import iter_completed
+
+URL = 'ws://127.0.0.1:9/cockpit/socket'
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class PipelineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.client = CockpitClient(self.server.url)
+        self.client.connect('user', 'pass')
+        self.channel = self.client.open_dbus_channel('session', SERVICE)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.stop()
+
+    def test_replies_matched_by_id(self):
+        calls = [self.channel.call(PATH, SERVICE, 'Echo', [i])
+                 for i in range(5)]
+        self.assertEqual(len(set(call.call_id for call in calls)), 5)
+        # Waiting for the last call routes the earlier replies too.
+        self.assertEqual(calls[-1].wait(), [4])
+        self.assertTrue(all(call.done for call in calls))
+        self.assertEqual([call.wait() for call in calls],
+                         [[i] for i in range(5)])
+
+    def test_error(self):
+        failed = self.channel.call(PATH, SERVICE, 'Fail', [])
+        echo = self.channel.call(PATH, SERVICE, 'Echo', [1])
+        with self.assertRaises(DBusError) as cm:
+            failed.wait()
+        self.assertEqual(cm.exception.name, 'org.fake.Error')
+        self.assertEqual(echo.wait(), [1])
+
+    def test_no_response(self):
+        self.assertIsNone(self.channel.call(
+            PATH, SERVICE, 'Echo', [1], require_response=False))
+        call = self.channel.call(PATH, SERVICE, 'Echo', [2])
+        self.assertEqual(call.wait(), [2])
+
+
+class RacingPendingCall(PendingCall):
+    '''
+    PendingCall, which is finished by another thread right after its done
+    flag is first seen False.
+    '''
+    __slots__ = ('finished', 'finisher')
+
+    def __init__(self, channel, call_id):
+        self.finished = False
+        self.finisher = None
+        super(RacingPendingCall, self).__init__(channel, call_id)
+
+    @property
+    def done(self):
+        finished = self.finished
+        if not finished and self.finisher is None:
+            self.finisher = threading.Thread(
+                target=self.set_reply, args=([],))
+            self.finisher.start()
+            # Give it time to finish, unless it's blocked.
+            self.finisher.join(0.2)
+        return finished
+
+    @done.setter
+    def done(self, value):
+        self.finished = value
+
+
+class PendingCallTest(unittest.TestCase):
+    def setUp(self):
+        self.channel = DBusChannel(CockpitClient(URL), '1')
+
+    def test_done_callback_race(self):
+        call = RacingPendingCall(self.channel, '1')
+        called = []
+        call.add_done_callback(called.append)
+        call.finisher.join()
+        self.assertEqual(called, [call])
+
+    def test_slots(self):
+        call = PendingCall(self.channel, '1')
+        queue_channel = QueueChannel(self.channel.client, '2')
+        for obj in (call, self.channel, queue_channel):
+            self.assertFalse(hasattr(obj, '__dict__'))
+
+    def test_event_created_when_waited_for(self):
+        call = PendingCall(self.channel, '1')
+        call.set_reply([1])
+        self.assertEqual(call.wait(), [1])
+        self.assertIsNone(call.event)
+        # A finished call returns a set event.
+        self.assertTrue(call.get_event().is_set())
+
+        call = PendingCall(self.channel, '2')
+        event = call.get_event()
+        self.assertFalse(event.is_set())
+        call.set_reply([2])
+        self.assertTrue(event.is_set())
+
+
+class InFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.client = CockpitClient(self.server.url)
+        self.client.connect('user', 'pass')
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.stop()
+
+    def test_timeout_without_dispatcher(self):
+        channel = self.client.open_dbus_channel(
+            'session', 'org.fake.Service', max_in_flight=1)
+        channel.in_flight_timeout = 0.2
+        channel.call('/org/fake/Service', 'org.fake.Service', 'Hang', [])
+        started = time.time()
+        self.assertRaises(FlowControlError, channel.call, '/org/fake/Service',
+                          'org.fake.Service', 'Echo', [])
+        self.assertLess(time.time() - started, 2)
+
+
+class CallDeadlineTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.client = CockpitClient(self.server.url)
+        self.client.connect('user', 'pass')
+        self.channel = self.client.open_dbus_channel('session', SERVICE)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.stop()
+
+    def hang(self, timeout=0.05):
+        return self.channel.call(PATH, SERVICE, 'Hang', [], timeout=timeout)
+
+    def assertTimedOut(self, call):
+        self.assertTrue(call.done)
+        self.assertIsInstance(call.error, CallTimeoutError)
+
+    def test_expired_without_waiting(self):
+        self.client.start_dispatcher()
+        calls = [self.hang() for _ in range(5)]
+        time.sleep(0.3)
+        self.assertEqual(self.channel.in_flight, 0)
+        for call in calls:
+            self.assertTimedOut(call)
+
+    def test_expired_by_process_message(self):
+        call = self.hang()
+        started = time.time()
+        while self.channel.in_flight:
+            self.client.process_message(1)
+        self.assertLess(time.time() - started, 0.5)
+        self.assertTimedOut(call)
+
+    def test_slots_freed(self):
+        self.client.start_dispatcher()
+        self.channel.max_in_flight = 2
+        self.channel.in_flight_timeout = 1
+        self.hang()
+        self.hang()
+        self.assertEqual(
+            self.channel.call(PATH, SERVICE, 'Echo', [1]).wait(), [1])
+
+    def test_iter_completed(self):
+        calls = self.channel.call_many([(PATH, SERVICE, 'Echo', [1]),
+                                        (PATH, SERVICE, 'Hang', [])],
+                                       timeout=0.2)
+        started = time.time()
+        completed = list(iter_completed(calls))
+        self.assertLess(time.time() - started, 1)
+        self.assertEqual(completed[0].reply, [1])
+        self.assertTimedOut(completed[1])
+
+    def test_iter_completed_timeout(self):
+        self.client.start_dispatcher()
+        calls = [self.channel.call(PATH, SERVICE, 'Echo', [1]), self.hang(5)]
+        completed = list(iter_completed(calls, timeout=0.2))
+        self.assertEqual(completed[0].reply, [1])
+        self.assertTimedOut(completed[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,159 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import json
+import logging
+import unittest
+import warnings
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client import CockpitClient
+from cockpit.client.channel import ConnectionLostError
+from cockpit.client.channel import QueueChannel
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class RecordingHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class DispatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.client = CockpitClient(self.server.url)
+        self.client.connect('user', 'pass')
+        self.client.start_dispatcher()
+        self.log = RecordingHandler()
+        logging.getLogger('cockpit.client.client').addHandler(self.log)
+
+    def tearDown(self):
+        logging.getLogger('cockpit.client.client').removeHandler(self.log)
+        self.client.disconnect()
+        self.server.stop()
+
+    def test_handler_error(self):
+        def broken_handler(message):
+            raise ValueError(message)
+
+        self.client.add_control_handler('ready', broken_handler)
+        channel = self.client.open_dbus_channel('session', SERVICE)
+        self.assertEqual(channel.call(PATH, SERVICE, 'Echo', [1]).wait(), [1])
+        self.assertEqual(len(self.log.records), 1)
+        self.assertTrue(self.client.is_dispatching)
+
+    def test_connection_lost(self):
+        channel = self.client.open_dbus_channel('session', SERVICE)
+        call = channel.call(PATH, SERVICE, 'Hang', [])
+        self.server.stop()
+        with self.assertRaises(ConnectionLostError) as cm:
+            call.wait(5)
+        self.assertEqual(cm.exception.args[0], 'disconnected')
+        self.assertIs(cm.exception.cause, self.client.connection_error)
+        self.assertIsNotNone(cm.exception.cause)
+
+
+class ReceiveTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.client = CockpitClient(self.server.url)
+        self.client.connect('user', 'pass')
+        self.channel = self.client.open_dbus_channel('session', SERVICE)
+        channel_id, message = self.client.receive_message(5)
+        self.assertEqual(message['command'], 'ready')
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.stop()
+
+    def test_receive_message(self):
+        text = u'\u017elu\u0165ou\u010dk\xfd k\u016f\u0148'
+        call = self.channel.call(PATH, SERVICE, 'Echo', [text])
+        channel_id, message = self.client.receive_message(5)
+        self.assertEqual(channel_id, self.channel.channel_id)
+        self.assertEqual(message, {'id': call.call_id, 'reply': [[text]]})
+
+    def test_receive_timeout(self):
+        self.channel.call(PATH, SERVICE, 'Hang', [])
+        self.assertIsNone(self.client.receive_message(0.05))
+
+    def test_large_payload(self):
+        size = 4 * 1024 * 1024
+        call = self.channel.call(PATH, SERVICE, 'Payload', [size])
+        self.assertEqual(len(call.wait(5)[0]), size)
+
+    def test_recv_message(self):
+        call = self.channel.call(PATH, SERVICE, 'Echo', [1])
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            channel_id, payload = self.client.recv_message()
+        self.assertEqual(caught[0].category, DeprecationWarning)
+        self.assertEqual(channel_id, self.channel.channel_id)
+        # The payload is left undecoded, as bytes.
+        self.assertIsInstance(payload, str)
+        self.assertEqual(json.loads(payload),
+                         {'id': call.call_id, 'reply': [[1]]})
+
+
+class ConnectTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.client = CockpitClient(self.server.url)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.stop()
+
+    def test_timeout(self):
+        self.client.connect('user', 'pass', timeout=5)
+        # The timeout applies only to the connect.
+        self.assertIsNone(self.client.ws.gettimeout())
+        self.assertIsNone(self.client.ws.sock.gettimeout())
+        self.client.start_dispatcher()
+        channel = self.client.open_dbus_channel('session', SERVICE)
+        self.assertEqual(channel.call(PATH, SERVICE, 'Echo', [1]).wait(5),
+                         [1])
+
+
+class OpenChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.client = CockpitClient('ws://127.0.0.1:9/cockpit/socket')
+        self.registered = []
+        # Records the channels registered when each open request is sent.
+        self.client.send_control_message = \
+            lambda payload: self.registered.append(dict(self.client.channels))
+
+    def test_dbus_channel_registered_before_open(self):
+        channel = self.client.open_dbus_channel('session', SERVICE)
+        self.assertIs(self.registered[0][channel.channel_id], channel)
+
+    def test_raw_channel_registered_before_open(self):
+        channel_id = self.client.open_channel(
+            'dbus-json3', bus='session', name=SERVICE)
+        self.assertIsInstance(self.registered[0][channel_id], QueueChannel)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+
+from benchmarks import compare
+
+
+def make_results(**values):
+    return {'benchmarks': dict(
+        (name, {'median': value}) for name, value in values.iteritems())}
+
+
+class CompareTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_main(self, baseline, current):
+        paths = []
+        for name, results in (('baseline', baseline), ('current', current)):
+            path = os.path.join(self.directory, name + '.json')
+            with open(path, 'w') as fp:
+                json.dump(results, fp)
+            paths.append(path)
+        stdout, sys.stdout = sys.stdout, StringIO()
+        try:
+            status = compare.main(paths)
+            return status, sys.stdout.getvalue().splitlines()
+        finally:
+            sys.stdout = stdout
+
+    def test_compare(self):
+        rows = compare.compare(make_results(call=2.0, zero=0.0, old=1.0),
+                               make_results(call=3.0, zero=1.0, new=1.0))
+        self.assertEqual(sorted(rows), [
+            ('call', 2.0, 3.0, 50.0, '%11.6fs'),
+            ('zero', 0.0, 1.0, None, '%11.6fs'),
+        ])
+
+    def test_regression(self):
+        status, lines = self.run_main(make_results(call=2.0),
+                                      make_results(call=3.0))
+        self.assertEqual(status, 1)
+        self.assertTrue(lines[1].endswith('  +50.0% !'))
+
+    def test_zero_baseline(self):
+        status, lines = self.run_main(make_results(call=0.0),
+                                      make_results(call=1.0))
+        self.assertEqual(status, 0)
+        self.assertTrue(lines[1].endswith('     n/a'))
+
+    def test_memory_results(self):
+        baseline = {'benchmarks': {'call': {'bytes_per_object': 200.0}}}
+        current = {'benchmarks': {'call': {'bytes_per_object': 100.0}}}
+        self.assertEqual(compare.compare(baseline, current),
+                         [('call', 200.0, 100.0, -50.0, '%11.0fB')])
+
+
+if __name__ == '__main__':
+    unittest.main()
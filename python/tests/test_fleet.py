@@ -0,0 +1,97 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import socket
+import threading
+import time
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client.channel import CallTimeoutError
+from cockpit.remote import FleetExecutor
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class FleetExecutorTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.fleet = FleetExecutor(
+            [self.server.url], 'user', 'pass', SERVICE, timeout=0.2)
+
+    def tearDown(self):
+        self.fleet.close()
+        self.server.stop()
+
+    def test_run(self):
+        result, = self.fleet.run(PATH, SERVICE, 'Echo', [1])
+        self.assertIsNone(result.error)
+        self.assertEqual(result.reply, [1])
+
+    def test_timeout_keeps_session(self):
+        for _ in range(3):
+            result, = self.fleet.run(PATH, SERVICE, 'Hang', [])
+            self.assertIsInstance(result.error, CallTimeoutError)
+        self.assertEqual(self.server.logins, 1)
+
+    def test_concurrent_connect(self):
+        # Both connects overlap; one session is kept, the other one closed.
+        self.server.latency = 0.2
+        fleet = FleetExecutor([self.server.url], 'user', 'pass', SERVICE)
+        remotes = []
+
+        def connect():
+            remotes.append(fleet.get_remote(self.server.url))
+
+        threads = [threading.Thread(target=connect) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        try:
+            self.assertEqual(self.server.logins, 2)
+            self.assertIs(remotes[0], remotes[1])
+            self.assertEqual(fleet.remotes, {self.server.url: remotes[0]})
+            deadline = time.time() + 5
+            while len(self.server.connections) > 1 and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual(len(self.server.connections), 1)
+        finally:
+            fleet.close()
+
+    def test_connect_timeout(self):
+        # The host accepts the connection, but never answers the /login.
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(1)
+        url = 'ws://127.0.0.1:%d/cockpit/socket' % sock.getsockname()[1]
+        fleet = FleetExecutor(
+            [url], 'user', 'pass', SERVICE, connect_timeout=0.2)
+        try:
+            result, = fleet.run(PATH, SERVICE, 'Echo', [1])
+            self.assertIsInstance(result.error, socket.timeout)
+            self.assertEqual(fleet.remotes, {})
+        finally:
+            fleet.close()
+            sock.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,316 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import base64
+import hashlib
+import socket
+import threading
+import unittest
+from StringIO import StringIO
+from collections import OrderedDict
+
+from benchmarks.fakews import WEBSOCKET_GUID, make_ws_frame
+from cockpit.client import http
+from cockpit.client.sock.websock import WebSocket
+
+
+def make_request(body, chunked=False):
+    # Values read from JSON (e.g. a stored session cookie) are unicode.
+    headers = {'Host': 'localhost', 'Cookie': u'cockpit=session'}
+    if chunked:
+        headers['Transfer-Encoding'] = 'chunked'
+    return http.HTTPMessage(
+        http.HTTPRequestLine('POST', '/', http.HTTP_1_1), headers, body)
+
+
+class HTTPSenderTest(unittest.TestCase):
+    def send(self, sender):
+        writes = []
+        sender.write = writes.append
+        sender.send()
+        return writes
+
+    def wire(self, message, chunk_size=http.CHUNK_MAX):
+        wfile = StringIO()
+        http.send_message(message, wfile, chunk_size)
+        return wfile.getvalue()
+
+    def test_small_message_one_write(self):
+        message = make_request('x' * 100)
+        writes = self.send(http.HTTPSender(message, StringIO()))
+        self.assertEqual(len(writes), 1)
+        self.assertEqual(str(writes[0]), self.wire(message))
+
+    def test_large_parts_not_copied(self):
+        body = 'x' * (2 * http.WRITE_BUFFER_MAX)
+        message = make_request(body, chunked=True)
+        sender = http.HTTPSender(message, StringIO(), http.WRITE_BUFFER_MAX)
+        writes = self.send(sender)
+        views = [w for w in writes if isinstance(w, memoryview)]
+        self.assertEqual(len(views), 2)
+        for view in views:
+            self.assertEqual(len(view), http.WRITE_BUFFER_MAX)
+        self.assertEqual(''.join(bytes(bytearray(w)) for w in writes),
+                         self.wire(message, http.WRITE_BUFFER_MAX))
+
+    def test_lone_small_part_not_copied(self):
+        big = 'x' * http.WRITE_BUFFER_MAX
+        small = memoryview('y' * 10)
+        sender = http.HTTPSender(make_request(''), StringIO())
+        for part in (big, small, big):
+            sender.send_data(part)
+        writes = []
+        sender.write = writes.append
+        sender.flush()
+        self.assertEqual(writes, [big, small, big])
+        self.assertIs(writes[1], small)
+
+
+def make_response(body, headers):
+    head = ''.join('%s: %s\r\n' % header for header in headers)
+    return 'HTTP/1.1 200 OK\r\n%s\r\n%s' % (head, body)
+
+
+def make_chunked(chunks, trailers=''):
+    return ''.join(
+        '%x;ext=1\r\n%s\r\n' % (len(chunk), chunk) for chunk in chunks) + \
+        '0\r\n' + trailers + '\r\n'
+
+
+class HTTPReaderTest(unittest.TestCase):
+    def reader(self, data, max_body_size=None):
+        return http.HTTPReader(StringIO(data), max_body_size)
+
+    def test_content_length(self):
+        data = make_response('hello', [('Content-Length', '5')]) + 'next'
+        reader = self.reader(data)
+        message = reader.recv()
+        self.assertEqual(message.init_line.status_code, 200)
+        self.assertEqual(message.body, 'hello')
+        self.assertEqual(reader.recv_data(4), 'next')
+
+    def test_chunked(self):
+        data = make_response(
+            make_chunked(['hello', ' ', 'world'], 'Expires: never\r\n'),
+            [('Transfer-Encoding', 'chunked')]) + 'next'
+        reader = self.reader(data)
+        init_line, headers = reader.recv_head()
+        self.assertEqual(list(reader.iter_body(headers, init_line)),
+                         ['hello', ' ', 'world'])
+        # The trailers are consumed with the body.
+        self.assertEqual(reader.recv_data(4), 'next')
+
+    def test_chunked_truncated(self):
+        reader = self.reader(make_chunked(['hello'])[:-5])
+        self.assertRaises(http.HTTPError, reader.recv_body_chunked)
+
+    def test_until_eof(self):
+        body = 'x' * (2 * http.READ_BLOCK_SIZE + 10)
+        message = self.reader(make_response(body, [])).recv()
+        self.assertEqual(message.body, body)
+
+    def test_until_eof_short_reads(self):
+        # Short reads don't end a body delimited by closing.
+        reader = self.reader(make_response('hello world', []))
+        recv_data = reader.recv_data
+        reader.recv_data = lambda length: recv_data(min(length, 3))
+        init_line, headers = reader.recv_head()
+        self.assertEqual(
+            reader.recv_body(headers, init_line), 'hello world')
+
+    def test_no_body(self):
+        request = 'GET / HTTP/1.1\r\nHost: localhost\r\n\r\nnext'
+        reader = self.reader(request)
+        self.assertEqual(reader.recv().body, '')
+        self.assertEqual(reader.recv_data(4), 'next')
+        reader = self.reader('HTTP/1.1 204 No Content\r\n\r\nnext')
+        self.assertEqual(reader.recv().body, '')
+
+    def test_max_body_size(self):
+        bodies = [
+            make_response('x' * 11, [('Content-Length', '11')]),
+            make_response(make_chunked(['x' * 6, 'x' * 5]),
+                          [('Transfer-Encoding', 'chunked')]),
+            make_response('x' * 11, []),
+        ]
+        for data in bodies:
+            self.assertRaises(
+                http.HTTPError, self.reader(data, max_body_size=10).recv)
+            self.assertEqual(
+                self.reader(data, max_body_size=11).recv().body, 'x' * 11)
+
+    def test_oversized_body_not_read(self):
+        size = 4 * http.READ_BLOCK_SIZE
+        reader = self.reader(make_response(
+            'x' * size, [('Content-Length', str(size))]),
+            max_body_size=http.READ_BLOCK_SIZE)
+        self.assertRaises(http.HTTPError, reader.recv)
+        # Reading stopped at the first block over the limit.
+        self.assertEqual(
+            len(reader.recv_data(size)), size - 2 * http.READ_BLOCK_SIZE)
+
+    def test_blocks_not_joined(self):
+        # Every block is yielded as read and joined once by recv_body(), so
+        # reading is linear in the body size.
+        chunks = ['%04d' % i for i in range(1000)]
+        reader = self.reader(make_chunked(chunks))
+        self.assertEqual(list(reader.iter_body_chunked()), chunks)
+
+        size = 3 * http.READ_BLOCK_SIZE
+        reader = self.reader(make_response(
+            'x' * size, [('Content-Length', str(size))]))
+        init_line, headers = reader.recv_head()
+        blocks = list(reader.iter_body(headers, init_line))
+        self.assertEqual(
+            [len(block) for block in blocks], [http.READ_BLOCK_SIZE] * 3)
+
+
+class HTTPMessageTest(unittest.TestCase):
+    def test_slots(self):
+        request = http.HTTPMessage(
+            http.HTTPRequestLine('GET', '/', http.HTTP_1_1))
+        response = http.HTTPMessage(
+            http.HTTPResponseLine(http.HTTP_1_1, 200, 'OK'))
+        for obj in (request, request.init_line, response.init_line):
+            self.assertFalse(hasattr(obj, '__dict__'))
+
+    def test_headers(self):
+        headers = OrderedDict([('B', '1'), ('A', '2')])
+        message = http.HTTPMessage(
+            http.HTTPResponseLine(http.HTTP_1_1, 200, 'OK'), headers)
+        # An OrderedDict is used as is, other mappings are copied.
+        self.assertIs(message.headers, headers)
+        plain = {'A': '1'}
+        message = http.HTTPMessage(
+            http.HTTPResponseLine(http.HTTP_1_1, 200, 'OK'), plain)
+        message['B'] = '2'
+        self.assertEqual(plain, {'A': '1'})
+
+    def test_reader_header_order(self):
+        headers = [('X-%d' % i, str(i)) for i in range(10, 0, -1)]
+        reader = http.HTTPReader(StringIO(make_response('', headers)))
+        self.assertEqual(reader.recv().headers.items(), headers)
+
+
+class ScriptedSocket(object):
+    '''
+    Socket receiving scripted pieces of data, then EOF.
+    '''
+
+    def __init__(self, pieces):
+        self.pieces = list(pieces)
+
+    def recv(self, size):
+        if not self.pieces:
+            return ''
+        piece = self.pieces.pop(0)
+        if len(piece) > size:
+            self.pieces.insert(0, piece[size:])
+        return piece[:size]
+
+
+class BufferedSocketReaderTest(unittest.TestCase):
+    def test_lines(self):
+        reader = http.BufferedSocketReader(ScriptedSocket(
+            ['GET / HT', 'TP/1.1\r\nHo', 'st: x\r\n\r', '\nrest', 'less']))
+        self.assertEqual(reader.readline(), 'GET / HTTP/1.1\r\n')
+        self.assertEqual(reader.readline(), 'Host: x\r\n')
+        self.assertEqual(reader.readline(), '\r\n')
+        self.assertEqual(reader.read(2), 're')
+        self.assertEqual(reader.detach(), 'st')
+        self.assertEqual(reader.readline(), 'less')
+        self.assertEqual(reader.read(1), '')
+
+    def test_compaction(self):
+        lines = ['line %d\n' % i for i in range(1000)]
+        reader = http.BufferedSocketReader(ScriptedSocket(lines), bufsize=64)
+        for line in lines:
+            self.assertEqual(reader.readline(), line)
+            # Data read already doesn't pile up.
+            self.assertLess(len(reader.buf), 3 * 64)
+        self.assertEqual(reader.readline(), '')
+
+
+def read_request(rfile):
+    '''
+    Reads a request without a body. Returns a dict of lower-cased headers.
+    '''
+    headers = {}
+    rfile.readline()
+    while True:
+        line = rfile.readline().rstrip('\r\n')
+        if not line:
+            return headers
+        name, value = line.split(':', 1)
+        headers[name.lower()] = value.strip()
+
+
+class HTTPConnectionTest(unittest.TestCase):
+    def setUp(self):
+        sock, self.peer = socket.socketpair()
+        # socketpair() returns bare _socket objects.
+        self.sock = socket.socket(_sock=sock)
+        self.peer_thread = threading.Thread(target=self.serve)
+        self.peer_thread.start()
+
+    def tearDown(self):
+        self.sock.close()
+        self.peer_thread.join()
+        self.peer.close()
+
+    def serve(self):
+        # Every response is sent along with data the client reads ahead:
+        # the next response, then the first WebSocket frame.
+        rfile = self.peer.makefile('rb')
+        read_request(rfile)
+        self.peer.sendall(
+            make_response('{"user": "user"}', [('Content-Length', '16')]) +
+            make_response(make_chunked(['{}']),
+                          [('Transfer-Encoding', 'chunked')]))
+        read_request(rfile)
+        key = read_request(rfile)['sec-websocket-key']
+        self.peer.sendall(
+            'HTTP/1.1 101 Switching Protocols\r\n'
+            'Upgrade: websocket\r\nConnection: Upgrade\r\n'
+            'Sec-WebSocket-Accept: %s\r\n\r\n' %
+            base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest()) +
+            make_ws_frame('\n{"command": "init"}'))
+
+    def request(self, uri):
+        return http.HTTPMessage(
+            http.HTTPRequestLine('GET', uri, http.HTTP_1_1),
+            {'Host': 'localhost'})
+
+    def test_login_request_upgrade(self):
+        connection = http.HTTPConnection(self.sock)
+        response = connection.request(self.request('/cockpit/login'))
+        self.assertEqual(response.body, '{"user": "user"}')
+        response = connection.request(self.request('/cockpit/manifests.json'))
+        self.assertEqual(response.body, '{}')
+
+        ws = WebSocket()
+        ws.sock = self.sock
+        ws.scheme, ws.hostname, ws.port = 'ws', 'localhost', 80
+        ws.resource = '/cockpit/socket'
+        ws.handshake(connection)
+        self.assertEqual(ws.recv(), '\n{"command": "init"}')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import socket
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client import CockpitClient
+from cockpit.client import MetricsCollector
+from cockpit.client import StatsdExporter
+from cockpit.client import format_prometheus
+from cockpit.client.metrics import DIRECTION_IN
+from cockpit.client.metrics import DIRECTION_OUT
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class GaugeTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def connect(self, metrics):
+        client = CockpitClient(self.server.url, metrics=metrics)
+        client.connect('user', 'pass')
+        return client
+
+    def test_gauges_per_client(self):
+        metrics = MetricsCollector()
+        first = self.connect(metrics)
+        second = self.connect(metrics)
+        self.assertEqual(len(metrics.read_gauges()), 4)
+
+        first.disconnect()
+        gauges = metrics.read_gauges()
+        self.assertEqual(len(gauges), 2)
+        for _, labels, _ in gauges:
+            self.assertIn(('client', second.client_id), labels)
+
+        second.disconnect()
+        self.assertEqual(metrics.read_gauges(), [])
+
+    def test_statsd_gauges_removed(self):
+        metrics = StatsdExporter()
+        self.connect(metrics).disconnect()
+        self.assertEqual(metrics.gauges, {})
+
+
+class FrameMetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.disconnect()
+        self.server.stop()
+
+    def call(self, metrics):
+        client = CockpitClient(self.server.url, metrics=metrics)
+        client.connect('user', 'pass')
+        self.clients.append(client)
+        channel = client.open_dbus_channel('session', SERVICE)
+        channel.call(PATH, SERVICE, 'Echo', [1]).wait(5)
+        return client, channel
+
+    def test_collector_per_client(self):
+        metrics = MetricsCollector()
+        first, first_channel = self.call(metrics)
+        second, second_channel = self.call(metrics)
+        # Both clients got the same channel ID from the same server.
+        self.assertEqual(first_channel.channel_id, second_channel.channel_id)
+        channel_id = first_channel.channel_id
+        for client in (first, second):
+            for direction in (DIRECTION_IN, DIRECTION_OUT):
+                self.assertIn((client.client_id, channel_id, direction),
+                              metrics.bytes)
+        self.assertIn(
+            'cockpit_bytes_total{client="%d",channel="%s",direction="in"}' %
+            (second.client_id, channel_id), format_prometheus(metrics))
+
+    def test_statsd_per_channel(self):
+        receiver = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        receiver.bind(('127.0.0.1', 0))
+        receiver.settimeout(5)
+        metrics = StatsdExporter(receiver.getsockname())
+        client, channel = self.call(metrics)
+        metrics.flush()
+        lines = []
+        while True:
+            lines.extend(receiver.recv(65536).split('\n'))
+            if any(line.startswith('cockpit.call.') for line in lines):
+                break
+        receiver.close()
+        name = 'cockpit.client.%d.channel.%s.in' % (
+            client.client_id, channel.channel_id)
+        self.assertIn(name + '.frames:1|c', lines)
+        self.assertIn('cockpit.client.%d.channel.control.in.frames:1|c' %
+                      client.client_id, lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
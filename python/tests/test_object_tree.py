@@ -0,0 +1,140 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import time
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS, make_variants
+from cockpit.remote import RemoteDBus, RemoteObjectTree
+from cockpit.remote.object_tree import OBJECT_MANAGER_INTERFACE
+from cockpit.remote.object_tree import PROPERTIES_INTERFACE
+
+SERVICE = 'org.fake.Service'
+MANAGER = '/org/fake'
+DRIVE = 'org.fake.Drive'
+BLOCK = 'org.fake.Block'
+
+
+class RemoteObjectTreeTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.server.properties.update({
+            MANAGER: {'org.fake.Manager': {'Version': '1'}},
+            MANAGER + '/sda': {DRIVE: {'Type': 'ssd', 'Size': 1},
+                               BLOCK: {'Device': 'sda'}},
+            MANAGER + '/sdb': {DRIVE: {'Type': 'hdd', 'Size': 2}},
+        })
+        self.remote = RemoteDBus(self.server.url, 'user', 'pass', SERVICE)
+        self.remote.client.start_dispatcher()
+        self.tree = None
+
+    def tearDown(self):
+        if self.tree is not None:
+            self.tree.close()
+        self.remote.close()
+        self.server.stop()
+
+    def load(self):
+        self.tree = RemoteObjectTree(self.remote, MANAGER, timeout=5)
+        return self.tree
+
+    def wait_for(self, predicate):
+        deadline = time.time() + 5
+        while not predicate():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_snapshot(self):
+        tree = self.load()
+        self.assertEqual(tree.get_paths(),
+                         [MANAGER + '/sda', MANAGER + '/sdb'])
+        self.assertEqual(tree.get_paths(BLOCK), [MANAGER + '/sda'])
+        self.assertEqual(tree.get_interfaces(MANAGER + '/sda'),
+                         [BLOCK, DRIVE])
+        self.assertEqual(tree.get(MANAGER + '/sdb', DRIVE),
+                         {'Type': 'hdd', 'Size': 2})
+        self.assertEqual(tree.find(DRIVE, Type='ssd'), [MANAGER + '/sda'])
+
+    def test_signals(self):
+        tree = self.load()
+        self.server.add_object(
+            MANAGER + '/sdc', {DRIVE: {'Type': 'ssd', 'Size': 3}}, MANAGER)
+        self.server.set_property(MANAGER + '/sdb', DRIVE, 'Size', 4)
+        self.server.remove_object(MANAGER + '/sda', MANAGER)
+        self.wait_for(lambda: MANAGER + '/sda' not in tree)
+        self.assertEqual(tree.get_paths(),
+                         [MANAGER + '/sdb', MANAGER + '/sdc'])
+        self.assertEqual(tree.get_property(MANAGER + '/sdb', DRIVE, 'Size'),
+                         4)
+        self.assertEqual(tree.get_paths(BLOCK), [])
+
+    def test_signals_during_snapshot(self):
+        def emit_signals():
+            # Signals sent before the reply, but not reflected in it.
+            self.server.emit_signal(
+                MANAGER, OBJECT_MANAGER_INTERFACE, 'InterfacesAdded',
+                [MANAGER + '/sdc', {DRIVE: make_variants({'Type': 'ssd'})}])
+            self.server.emit_signal(
+                MANAGER, OBJECT_MANAGER_INTERFACE, 'InterfacesRemoved',
+                [MANAGER + '/sda', [BLOCK]])
+            self.server.emit_signal(
+                MANAGER + '/sdb', PROPERTIES_INTERFACE, 'PropertiesChanged',
+                [DRIVE, make_variants({'Type': 'ssd'}), ['Size']])
+
+        self.server.call_hooks['GetManagedObjects'] = emit_signals
+        tree = self.load()
+        self.assertIsNone(tree.pending_signals)
+        self.assertEqual(tree.get_paths(DRIVE), [
+            MANAGER + '/sda', MANAGER + '/sdb', MANAGER + '/sdc'])
+        self.assertEqual(tree.get_paths(BLOCK), [])
+        self.assertEqual(tree.get(MANAGER + '/sdb', DRIVE), {'Type': 'ssd'})
+        self.assertEqual(tree.find(DRIVE, Type='ssd'), [
+            MANAGER + '/sda', MANAGER + '/sdb', MANAGER + '/sdc'])
+
+    def test_index(self):
+        tree = self.load()
+        tree.add_index(DRIVE, 'Type')
+        self.assertEqual(tree.find(DRIVE, Type='ssd'), [MANAGER + '/sda'])
+
+        self.server.set_property(MANAGER + '/sdb', DRIVE, 'Type', 'ssd')
+        self.wait_for(lambda: len(tree.find(DRIVE, Type='ssd')) == 2)
+        self.assertEqual(tree.indexes[(DRIVE, 'Type')], {
+            'ssd': set([MANAGER + '/sda', MANAGER + '/sdb'])})
+
+        self.server.remove_object(MANAGER + '/sda', MANAGER)
+        self.server.remove_object(MANAGER + '/sdb', MANAGER)
+        self.wait_for(lambda: len(tree) == 0)
+        # No empty index entries are left behind.
+        self.assertEqual(tree.indexes[(DRIVE, 'Type')], {})
+        self.assertEqual(tree.interfaces, {})
+        self.assertEqual(tree.find(DRIVE, Type='ssd'), [])
+
+    def test_reload(self):
+        tree = self.load()
+        tree.add_index(DRIVE, 'Type')
+        # Changed without signals, e.g. while disconnected.
+        del self.server.properties[MANAGER + '/sda']
+        self.server.properties[MANAGER + '/sdb'][DRIVE]['Type'] = 'ssd'
+        tree.reload(timeout=5)
+        self.assertEqual(tree.get_paths(), [MANAGER + '/sdb'])
+        self.assertEqual(tree.find(DRIVE, Type='ssd'), [MANAGER + '/sdb'])
+
+
+if __name__ == '__main__':
+    unittest.main()
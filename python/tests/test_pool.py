@@ -0,0 +1,96 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client.http import HTTPError
+from cockpit.client.pool import CockpitClientPool, PoolError
+from cockpit.remote import RemoteDBus
+
+SERVICE = 'org.fake.Service'
+
+
+class CockpitClientPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.other_server = FakeCockpitWS().start()
+        self.pool = CockpitClientPool(max_size=1, idle_timeout=300)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.stop()
+        self.other_server.stop()
+
+    def test_reuse(self):
+        client = self.pool.get_client(self.server.url, 'user', 'pass')
+        self.assertIs(
+            self.pool.get_client(self.server.url, 'user', u'pass'), client)
+        self.assertEqual(self.server.logins, 1)
+        entry, = self.pool.entries.values()
+        self.assertEqual(entry.leases, 2)
+        self.pool.release(client)
+        self.pool.release(client)
+        self.assertEqual(entry.leases, 0)
+
+    def test_password_digest(self):
+        client = self.pool.get_client(self.server.url, 'user', 'pass')
+        entry, = self.pool.entries.values()
+        self.assertNotIn('pass', vars(entry).values())
+        self.assertTrue(entry.check_password(u'pass'))
+        self.assertFalse(entry.check_password(u'pa\xdfs'))
+        # Another password must log in again.
+        self.assertRaises(HTTPError, self.pool.get_client,
+                          self.server.url, 'user', 'wrong')
+        self.assertEqual(self.server.logins, 2)
+        self.pool.release(client)
+
+    def test_leased_not_evicted(self):
+        client = self.pool.get_client(self.server.url, 'user', 'pass')
+        self.assertRaises(PoolError, self.pool.get_client,
+                          self.other_server.url, 'user', 'pass')
+        self.pool.release(client)
+        self.pool.get_client(self.other_server.url, 'user', 'pass')
+        self.assertFalse(client.is_dispatching)
+
+    def test_idle_timeout(self):
+        self.pool.idle_timeout = 0
+        client = self.pool.get_client(self.server.url, 'user', 'pass')
+        self.pool.evict_idle()
+        self.assertTrue(client.is_dispatching)
+        self.pool.release(client)
+        self.pool.evict_idle()
+        self.assertFalse(client.is_dispatching)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_remote_dbus(self):
+        remote = RemoteDBus(self.server.url, 'user', 'pass', SERVICE,
+                            pool=self.pool)
+        other = RemoteDBus(self.server.url, 'user', 'pass', SERVICE,
+                           pool=self.pool)
+        self.assertIs(other.client, remote.client)
+        remote.close()
+        other.close()
+        entry, = self.pool.entries.values()
+        self.assertEqual(entry.leases, 0)
+        self.assertTrue(entry.is_idle)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import threading
+import time
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS, make_variant
+from cockpit.client.channel import DBusError
+from cockpit.remote import PROPERTIES_INTERFACE, PropertyCache, RemoteDBus
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+INTERFACE = 'org.fake.Props'
+OTHER_INTERFACE = 'org.fake.Other'
+THIRD_INTERFACE = 'org.fake.Third'
+
+
+class PropertyCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.server.properties[PATH] = {
+            INTERFACE: {'Name': 'fake', 'Size': 1},
+            OTHER_INTERFACE: {'Color': 'red', 'Shape': 'round'},
+            THIRD_INTERFACE: {'Flag': True},
+        }
+        self.remote = RemoteDBus(self.server.url, 'user', 'pass', SERVICE)
+        self.remote.client.start_dispatcher()
+        self.cache = PropertyCache(self.remote)
+
+    def tearDown(self):
+        self.cache.close()
+        self.remote.close()
+        self.server.stop()
+
+    def get_server_watches(self):
+        # Every request is handled in order, so the reply to a call means
+        # the server has seen the (un)watch requests sent before it.
+        self.remote(PATH, SERVICE, 'Echo', [])
+        connection, = self.server.connections
+        return [watch for _, watch in connection.watches]
+
+    def wait_for(self, predicate):
+        deadline = time.time() + 5
+        while not predicate():
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_get(self):
+        self.assertEqual(self.cache.get(PATH, INTERFACE, 'Name'), 'fake')
+        self.server.properties[PATH][INTERFACE]['Name'] = 'stale'
+        self.assertEqual(self.cache.get(PATH, INTERFACE, 'Name'), 'fake')
+        self.assertEqual(self.get_server_watches(),
+                         [{'path': PATH, 'interface': INTERFACE}])
+
+    def test_get_all_cached(self):
+        values = {'Name': 'fake', 'Size': 1}
+        self.assertEqual(self.cache.get_all(PATH, INTERFACE), values)
+        # Changed behind the cache's back; no GetAll is made again.
+        self.server.properties[PATH][INTERFACE]['Size'] = 2
+        self.assertEqual(self.cache.get_all(PATH, INTERFACE), values)
+        self.assertEqual(self.cache.get(PATH, INTERFACE, 'Name'), 'fake')
+
+    def test_get_all_partial(self):
+        # A single Get doesn't tell about the other properties.
+        self.cache.get(PATH, INTERFACE, 'Name')
+        self.assertEqual(
+            self.cache.get_all(PATH, INTERFACE), {'Name': 'fake', 'Size': 1})
+
+    def test_get_all_expired(self):
+        self.cache.ttl = 0
+        self.cache.get_all(PATH, INTERFACE)
+        self.server.properties[PATH][INTERFACE]['Size'] = 2
+        self.assertEqual(self.cache.get_all(PATH, INTERFACE)['Size'], 2)
+
+    def test_get_all_invalidated(self):
+        self.cache.get_all(PATH, INTERFACE)
+        self.server.properties[PATH][INTERFACE]['Size'] = 2
+        self.cache.invalidate(PATH, INTERFACE, 'Size')
+        self.assertEqual(self.cache.get_all(PATH, INTERFACE)['Size'], 2)
+
+    def test_notify(self):
+        self.assertEqual(self.cache.get_all(PATH, INTERFACE)['Size'], 1)
+        self.server.set_property(PATH, INTERFACE, 'Size', 3)
+        self.wait_for(
+            lambda: self.cache.get_all(PATH, INTERFACE)['Size'] == 3)
+
+    def test_notify_unwatched(self):
+        self.server.set_property(PATH, INTERFACE, 'Size', 3)
+        self.get_server_watches()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_properties_changed(self):
+        self.cache.get_all(PATH, INTERFACE)
+        self.server.emit_signal(
+            PATH, PROPERTIES_INTERFACE, 'PropertiesChanged',
+            [INTERFACE, {'Name': make_variant('new')}, ['Size']])
+        # Not delivered without a match.
+        self.get_server_watches()
+        self.assertEqual(len(self.cache), 2)
+        self.remote.channel.add_match({'path': PATH}).wait(5)
+        self.server.emit_signal(
+            PATH, PROPERTIES_INTERFACE, 'PropertiesChanged',
+            [INTERFACE, {'Name': make_variant('new')}, ['Size']])
+        self.wait_for(
+            lambda: self.cache.get(PATH, INTERFACE, 'Name') == 'new')
+        self.assertNotIn((PATH, INTERFACE, 'Size'), self.cache.entries)
+
+    def test_unwatch_evicted(self):
+        self.cache.max_size = 3
+        self.cache.get_all(PATH, INTERFACE)
+        # The watch reports both of the properties of OTHER_INTERFACE; the
+        # oldest entry of INTERFACE is evicted.
+        self.cache.get(PATH, OTHER_INTERFACE, 'Color')
+        self.assertEqual(len(self.cache), 3)
+        self.assertEqual(len(self.get_server_watches()), 2)
+        self.cache.get(PATH, THIRD_INTERFACE, 'Flag')
+        self.assertEqual(
+            self.cache.watched,
+            set([(PATH, OTHER_INTERFACE), (PATH, THIRD_INTERFACE)]))
+        self.assertNotIn(
+            {'path': PATH, 'interface': INTERFACE}, self.get_server_watches())
+
+    def test_unwatch_failed(self):
+        self.assertRaises(
+            DBusError, self.cache.get, PATH, 'org.fake.Missing', 'Missing')
+        self.assertEqual(self.cache.watched, set())
+        self.assertEqual(self.get_server_watches(), [])
+
+    def test_watch_once(self):
+        threads = [
+            threading.Thread(target=self.cache.watch, args=(PATH, INTERFACE))
+            for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.get_server_watches()), 1)
+
+    def test_close(self):
+        self.cache.get_all(PATH, INTERFACE)
+        self.cache.close()
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.get_server_watches(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
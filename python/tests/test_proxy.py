@@ -0,0 +1,50 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.remote import MarshalError
+from cockpit.remote import RemoteDBus
+
+SERVICE = 'org.fake.Service'
+FILES = 'org.fake.Files'
+PATH = '/org/fake/Service'
+
+
+class ProxyTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.remote = RemoteDBus(self.server.url, 'user', 'pass', SERVICE)
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.stop()
+
+    def test_file_descriptor_method(self):
+        obj = self.remote.get_object(PATH)
+        files = obj.get_interface(FILES)
+        self.assertEqual(files.Echo(5).wait(), 5)
+        service = obj.get_interface(SERVICE)
+        self.assertEqual(service.Echo('b', {}).wait(), ('b', {}))
+        self.assertRaises(MarshalError, service.Broken, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import time
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client import ReconnectingCockpitClient
+from cockpit.client.channel import ChannelError
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+def wait_until(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+class ReconnectTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.client = ReconnectingCockpitClient(
+            self.server.url, backoff_initial=0.05, ping_timeout=5)
+        self.client.connect('user', 'pass')
+        self.channel = self.client.open_dbus_channel(
+            bus='session', service=SERVICE)
+
+    def tearDown(self):
+        self.client.disconnect()
+        self.server.stop()
+
+    def test_drop_mid_frame(self):
+        # The connection drops after half of a 200 KB frame; the restored
+        # connection must not wait for the rest of it.
+        call = self.channel.call(PATH, SERVICE, 'Truncate', [200000])
+        self.assertRaises(ChannelError, call.wait, 10)
+        self.assertTrue(wait_until(lambda: self.client.reconnects == 1))
+        self.assertEqual(
+            self.channel.call(PATH, SERVICE, 'Echo', [1]).wait(5), [1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.client.channel import DBusError
+from cockpit.remote import RemoteDBus
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class RemoteDBusTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.remote = RemoteDBus(self.server.url, 'user', 'pass', SERVICE)
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.stop()
+
+    def test_call(self):
+        self.assertEqual(self.remote(PATH, SERVICE, 'Echo', [1]), [1])
+        self.assertRaises(DBusError, self.remote, PATH, SERVICE, 'Fail', [])
+
+    def test_call_many(self):
+        calls = [(PATH, SERVICE, 'Echo', [i]) for i in range(3)]
+        self.assertEqual(self.remote.call_many(calls), [[0], [1], [2]])
+        replies = self.remote.call_many(
+            [(PATH, SERVICE, 'Fail', [])], return_exceptions=True)
+        self.assertIsInstance(replies[0], DBusError)
+
+    def test_service(self):
+        service = self.remote.get_service('org.fake.Other')
+        self.assertIs(self.remote.get_service('org.fake.Other'), service)
+        self.assertNotEqual(service.channel, self.remote.channel)
+        self.assertEqual(
+            service.call_many([(PATH, SERVICE, 'Echo', [2])]), [[2]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from cockpit.client import FileSessionStore
+from cockpit.client import SessionStore
+from cockpit.client.session import get_cookie_expiry
+
+URL = 'wss://example.com/cockpit/socket'
+
+
+class CookieExpiryTest(unittest.TestCase):
+    def test_max_age(self):
+        self.assertEqual(get_cookie_expiry(
+            'cockpit=x; Max-Age=60; Expires=Wed, 21 Oct 2015 07:28:00 GMT',
+            now=1000), 1060)
+
+    def test_expires(self):
+        self.assertEqual(get_cookie_expiry(
+            'cockpit=x; Path=/; Expires=Wed, 21 Oct 2015 07:28:00 GMT'),
+            1445412480)
+
+    def test_session_cookie(self):
+        self.assertIsNone(get_cookie_expiry('cockpit=x; Path=/; HttpOnly'))
+
+
+class SessionStoreTest(unittest.TestCase):
+    def test_expired_cookie(self):
+        store = SessionStore()
+        store.put(URL, 'user', 'x', time.time() - 1)
+        self.assertIsNone(store.get(URL, 'user'))
+
+    def test_renewal_keeps_cookie_expiry(self):
+        store = SessionStore()
+        expires = time.time() + 60
+        store.put(URL, 'user', 'x', expires)
+        store.put(URL, 'user', 'x')
+        self.assertLessEqual(store.sessions['user ' + URL][1], expires)
+        store.put(URL, 'user', 'y')
+        self.assertGreater(store.sessions['user ' + URL][1], expires)
+
+
+class FileSessionStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sessions.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_cookie_expiry_persisted(self):
+        FileSessionStore(self.path).put(URL, 'user', 'x', time.time() + 0.2)
+        store = FileSessionStore(self.path)
+        self.assertEqual(store.get(URL, 'user'), 'x')
+        time.sleep(0.3)
+        self.assertIsNone(store.get(URL, 'user'))
+
+    def test_old_entries(self):
+        with open(self.path, 'w') as fp:
+            json.dump({'user ' + URL: ['x', time.time() + 60]}, fp)
+        store = FileSessionStore(self.path)
+        self.assertEqual(store.get(URL, 'user'), 'x')
+        store.put(URL, 'user', 'x')
+        self.assertEqual(store.get(URL, 'user'), 'x')
+
+
+if __name__ == '__main__':
+    unittest.main()
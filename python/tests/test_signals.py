@@ -0,0 +1,130 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import threading
+import time
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.remote import RemoteDBus
+from cockpit.remote import POLICY_BLOCK, POLICY_COALESCE, SignalEvent
+
+SERVICE = 'org.fake.Service'
+PATH = '/org/fake/Service'
+
+
+class SubscriptionTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.remote = RemoteDBus(self.server.url, 'user', 'pass', SERVICE)
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.stop()
+
+    def subscribe(self, **kwargs):
+        subscription = self.remote.subscribe(
+            {'interface': SERVICE, 'member': 'Changed'}, **kwargs)
+        self.sync()
+        return subscription
+
+    def sync(self):
+        # Requests and messages are handled in order: after a reply, the
+        # server has seen the match and the client got the signals.
+        self.remote(PATH, SERVICE, 'Echo', [])
+
+    def emit(self, *args):
+        self.server.emit_signal(PATH, SERVICE, 'Changed', list(args))
+
+    def get_in_thread(self, subscription, timeout):
+        # Fails instead of hanging, if get() ignores its timeout.
+        results = []
+        thread = threading.Thread(
+            target=lambda: results.append(subscription.get(timeout)))
+        thread.daemon = True
+        thread.start()
+        thread.join(timeout + 5)
+        self.assertFalse(thread.is_alive())
+        return results[0]
+
+    def test_get(self):
+        subscription = self.subscribe()
+        self.server.emit_signal(PATH, SERVICE, 'Other', [0])
+        self.emit(1)
+        self.assertEqual(self.get_in_thread(subscription, 5),
+                         SignalEvent(PATH, SERVICE, 'Changed', [1]))
+
+    def test_get_timeout(self):
+        subscription = self.subscribe()
+        self.assertIsNone(self.get_in_thread(subscription, 0.1))
+        self.remote.client.start_dispatcher()
+        self.assertIsNone(self.get_in_thread(subscription, 0.1))
+        self.emit(1)
+        self.assertEqual(self.get_in_thread(subscription, 5).args, [1])
+
+    def test_drop_oldest(self):
+        self.remote.client.start_dispatcher()
+        subscription = self.subscribe(max_size=2)
+        for i in range(3):
+            self.emit(i)
+        self.sync()
+        self.assertEqual([subscription.get(0).args for _ in range(2)],
+                         [[1], [2]])
+        self.assertEqual(subscription.dropped, 1)
+
+    def test_coalesce(self):
+        self.remote.client.start_dispatcher()
+        subscription = self.subscribe(policy=POLICY_COALESCE)
+        self.emit(1)
+        self.emit(2)
+        self.sync()
+        self.assertEqual(subscription.get(0).args, [2])
+        self.assertIsNone(subscription.get(0))
+
+    def test_block_timeout(self):
+        self.remote.client.start_dispatcher()
+        subscription = self.subscribe(
+            max_size=1, policy=POLICY_BLOCK, block_timeout=0.2)
+        self.emit(1)
+        self.emit(2)
+        started = time.time()
+        self.sync()
+        # The dispatcher waited for room, then dropped the oldest event.
+        self.assertGreaterEqual(time.time() - started, 0.15)
+        self.assertEqual(subscription.get(0).args, [2])
+        self.assertEqual(subscription.dropped, 1)
+
+    def test_block(self):
+        self.remote.client.start_dispatcher()
+        subscription = self.subscribe(
+            max_size=1, policy=POLICY_BLOCK, block_timeout=None)
+        self.emit(1)
+        self.emit(2)
+        self.assertEqual(subscription.get(5).args, [1])
+        self.assertEqual(subscription.get(5).args, [2])
+        self.assertEqual(subscription.dropped, 0)
+
+    def test_close(self):
+        subscription = self.subscribe()
+        subscription.close()
+        self.assertIsNone(subscription.get())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from cockpit.client import FileTracer
+from cockpit.client import RingBufferTracer
+from cockpit.client.metrics import DIRECTION_IN
+from cockpit.client.metrics import DIRECTION_OUT
+from cockpit.client.trace import Tracer
+
+FRAME = '1001\n{"call": ["/", "org.fake.Service", "Echo", []], "id": "7"}'
+
+
+class RingBufferTracerTest(unittest.TestCase):
+    def test_record(self):
+        tracer = RingBufferTracer(max_payload=10)
+        tracer.trace(DIRECTION_OUT, FRAME)
+        tracer.trace(
+            DIRECTION_IN, '\n{"command": "ping"}', {'command': 'ping'})
+        out, control = tracer.records()
+        self.assertEqual(out.direction, DIRECTION_OUT)
+        self.assertEqual(out.channel_id, '1001')
+        self.assertEqual(out.size, len(FRAME))
+        self.assertEqual(out.call_id, '7')
+        self.assertEqual(out.payload, '{"call": [')
+        self.assertEqual(control.channel_id, 'control')
+        self.assertIsNone(control.call_id)
+
+    def test_size(self):
+        tracer = RingBufferTracer(size=3)
+        for i in range(5):
+            tracer.trace(DIRECTION_IN, '1\n{"id": "%d"}' % i)
+        self.assertEqual(
+            [record.call_id for record in tracer.records()], ['2', '3', '4'])
+        tracer.clear()
+        self.assertEqual(tracer.records(), [])
+
+    def test_sampling(self):
+        random.seed(0)
+        for rate, low, high in ((0.0, 0, 0), (0.25, 150, 350),
+                                (1.0, 1000, 1000)):
+            tracer = RingBufferTracer(size=1000, sample_rate=rate)
+            for _ in range(1000):
+                tracer.trace(DIRECTION_IN, FRAME)
+            self.assertTrue(low <= len(tracer.records()) <= high)
+
+    def test_base_tracer(self):
+        # Tracer.record() is a hook doing nothing.
+        Tracer().trace(DIRECTION_IN, FRAME)
+
+
+class FileTracerTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'trace.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def read_lines(self, path):
+        with open(path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_record(self):
+        tracer = FileTracer(self.path, max_payload=14)
+        # Truncation splits the two byte sequence of \xe9.
+        tracer.trace(DIRECTION_OUT, '1\n{"id": "1", "\xc3\xa9": 1}')
+        tracer.close()
+        tracer.trace(DIRECTION_OUT, FRAME)
+        record, = self.read_lines(self.path)
+        self.assertEqual(record['call_id'], '1')
+        self.assertEqual(record['channel_id'], '1')
+        self.assertEqual(record['payload'], u'{"id": "1", "\ufffd')
+
+    def test_rotation(self):
+        line_size = len(json.dumps(dict(
+            timestamp=0.0, direction=DIRECTION_IN, channel_id='1001',
+            size=len(FRAME), call_id='7', payload=FRAME[5:]))) + 1
+        tracer = FileTracer(self.path, max_bytes=3 * line_size + 10,
+                            backup_count=2)
+        for _ in range(20):
+            tracer.trace(DIRECTION_IN, FRAME)
+        tracer.close()
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         ['trace.jsonl', 'trace.jsonl.1', 'trace.jsonl.2'])
+        for name in ('', '.1', '.2'):
+            path = self.path + name
+            self.assertLessEqual(os.path.getsize(path), tracer.max_bytes)
+            self.assertTrue(self.read_lines(path))
+        # Reopening appends to the current file.
+        size = os.path.getsize(self.path)
+        tracer = FileTracer(self.path, max_bytes=tracer.max_bytes)
+        self.assertEqual(tracer.size, size)
+        tracer.close()
+
+    def test_no_backups(self):
+        tracer = FileTracer(self.path, max_bytes=200, backup_count=0)
+        for _ in range(10):
+            tracer.trace(DIRECTION_IN, FRAME)
+        tracer.close()
+        self.assertEqual(os.listdir(self.dir), ['trace.jsonl'])
+        self.assertLessEqual(os.path.getsize(self.path), 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import unittest
+
+from benchmarks.fakews import FakeCockpitWS
+from cockpit.remote import MarshalError
+from cockpit.remote import RemoteDBus
+from cockpit.remote import TypedCaller
+from cockpit.remote import Variant
+
+SERVICE = 'org.fake.Service'
+FILES = 'org.fake.Files'
+PATH = '/org/fake/Service'
+
+
+class TypedTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeCockpitWS().start()
+        self.remote = RemoteDBus(self.server.url, 'user', 'pass', SERVICE)
+
+    def tearDown(self):
+        self.remote.close()
+        self.server.stop()
+
+    def test_call(self):
+        typed = TypedCaller(self.remote)
+        self.assertEqual(
+            typed.call(PATH, SERVICE, 'Echo',
+                       ['a', {'x': Variant('u', 1), 'y': [True]}]),
+            ('a', {'x': 1, 'y': [True]}))
+
+    def test_file_descriptor(self):
+        typed = TypedCaller(self.remote)
+        self.assertEqual(typed.call(PATH, FILES, 'Echo', [3]), 3)
+        self.assertRaises(MarshalError, typed.call, PATH, FILES, 'Echo', [-1])
+
+    def test_unsupported_method(self):
+        # A method with an unsupported signature fails alone.
+        typed = TypedCaller(self.remote)
+        self.assertRaises(
+            MarshalError, typed.call, PATH, SERVICE, 'Broken', [1])
+        self.assertEqual(typed.call(PATH, FILES, 'Echo', [0]), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
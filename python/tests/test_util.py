@@ -0,0 +1,49 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+# Copyright (C) 2014 Peter Hatina <phatina@redhat.com>
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+# ##### END LICENSE BLOCK #####
+
+import json
+import unittest
+
+from cockpit.client import util
+
+FRAME = '42\n{"id": "1", "reply": [["x"]]}'
+MESSAGE = {'id': '1', 'reply': [['x']]}
+
+
+class JSONCodecTest(unittest.TestCase):
+    def tearDown(self):
+        util.set_json_codec(util.find_json_codec())
+
+    def test_stdlib_codec(self):
+        util.set_json_codec('json')
+        self.assertEqual(util.read_frame(FRAME), ('42', MESSAGE))
+
+    def test_module_codec(self):
+        # Codecs of other modules decode a copy of the payload.
+        util.set_json_codec(util.JSONCodec('other', json.dumps, json.loads))
+        self.assertEqual(util.read_frame(FRAME), ('42', MESSAGE))
+        self.assertEqual(json.loads(util.make_json(channel_seed=1)),
+                         {'channel-seed': 1})
+
+    def test_find_json_codec(self):
+        self.assertIn(util.find_json_codec().name, ('ujson', 'json'))
+
+
+if __name__ == '__main__':
+    unittest.main()